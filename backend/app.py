@@ -1,37 +1,66 @@
-from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
-from flask_socketio import SocketIO, emit, join_room
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 import os
 from flask_cors import CORS
-import pypandoc
 import json
-from models import db, bcrypt, Amendment, Chair, Delegate, Group, Message, File, Clause, UnreadCount  # Import all models
+from models import db, bcrypt, Amendment, ArchivedAmendment, Blob, Chair, Delegate, Group, Message, File, Clause, UnreadCount, Resolution, delegate_group  # Import all models
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 from bs4 import BeautifulSoup
-from sqlalchemy.orm import joinedload
-import base64
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, defer, joinedload, selectinload
+from thumbnails import create_thumbnail, is_previewable, thumbnail_name
+from conversion import ConversionCache, ConversionJobs, ConversionQueue, convert_docx, hash_file, run_in_os_thread
+from database import init_database
+from cache import LRUCache, MISSING
+from live_content import LiveContentStore, PatchConflict
+from clause_state import STATUS_SCOPE, ClauseStateCache
+from serialization import SerializationCache, dumps
+from metrics import METRICS_ENABLED, Metrics
+from message_ingest import MAX_MESSAGES_PER_SEND, MessageBatcher, MessageError, parse_message
+from attachments import (IMMUTABLE_MAX_AGE, HashingRequest, is_digest, reference_blob, release_blobs,
+                         removing_blobs, store_upload, visible_blob)
+from search import (KINDS, MAX_SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE, SearchUnavailable, install_index_hooks,
+                    search)
+from change_log import (MAX_SYNC_PAGE_SIZE, SYNC_PAGE_SIZE, changes_since, current_version, install_change_hooks,
+                        run_pruner)
+from event_replay import EventReplay
+from archive import archive_amendments, archive_query, iter_archive, stream_json, stream_ndjson
 import requests
 import re
+import atexit
+import uuid
 
 
 #configure flask app
 load_dotenv()  # Load environment variables from .env file
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for development
+app.request_class = HashingRequest  # Uploads are hashed as they arrive (see attachments.py)
+CORS(app, resources={r"/*": {"origins": "*"}},  # Allow all origins for development
+     # Pagination cursors for message history and amendments, and the amendment list version
+     expose_headers=['X-Next-Cursor', 'X-Has-More', 'X-Version'])
 BASE_UPLOAD_FOLDER = 'uploads'
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'fallback_secret_key')
 app.config['UPLOAD_FOLDER'] = BASE_UPLOAD_FOLDER
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///amendments.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['CHAT_FILES'] = os.path.join(os.getcwd(), 'chatfiles')
+# Let a front proxy that understands X-Sendfile stream attachments instead of the worker
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
 
-db.init_app(app)
+# SQLite (WAL) by default, or DATABASE_URL=postgresql://...; see database.py for pool settings
+init_database(app)
 jwt = JWTManager(app)
 bcrypt = bcrypt.init_app(app)
-socketio = SocketIO(app, cors_allowed_origins=["http://localhost:5173", "http://172.30.27.44:5173"])
+# The async worker model comes from SOCKETIO_ASYNC_MODE. It defaults to threading because
+# eventlet/gevent only work once monkey patched, which wsgi.py (the production entry point)
+# does before importing the app. SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) lets
+# several worker processes emit to the same rooms.
+socketio = SocketIO(app, cors_allowed_origins=["http://localhost:5173", "http://172.30.27.44:5173"],
+                    async_mode=os.environ.get('SOCKETIO_ASYNC_MODE') or 'threading',
+                    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None)
 
 # Ensure the base upload folder exists
 if not os.path.exists(BASE_UPLOAD_FOLDER):
@@ -43,13 +72,76 @@ if not os.path.exists(app.config['CHAT_FILES']):
 
 GROUPS = ['junior', 'senior', 'security council']
 
+# DOCX conversions are cached by content hash and tracked as jobs (see conversion.py)
+conversion_cache = ConversionCache(os.path.join(BASE_UPLOAD_FOLDER, '.html_cache'))
+conversion_jobs = ConversionJobs()
+conversion_queue = ConversionQueue()
 
-    
-# Create the database and table
+
+def insert_ignore(model, conflict_columns):
+    """INSERT ... ON CONFLICT DO NOTHING for bulk-creating rows that may already exist"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+
+
+
+# Messages, clauses and amendments are indexed for search as they are written (see search.py)
+install_index_hooks()
+# ... and appended to the change log behind /sync (see change_log.py)
+install_change_hooks()
+
+# Create or upgrade the schema and seed an empty database; existing data is left alone
+# (python initialize_db.py --reset wipes and reseeds)
 with app.app_context():
     from initialize_db import initialize_database
     initialize_database()
 
+# Opt-in request, query and emit metrics on /metrics (see metrics.py)
+metrics = Metrics() if METRICS_ENABLED else None
+if metrics:
+    with app.app_context():
+        metrics.init_app(app, db.engine)
+
+# Chat and committee room events are numbered and buffered for reconnecting clients (see event_replay.py)
+event_replay = EventReplay()
+event_replay.init_app(socketio, namespaces=['/', '/chatsocket'])
+
+# The emit hook: every socketio.emit, flask_socketio.emit() in handlers included, passes
+# through these wrappers, outermost first. Events to chat, committee and user rooms are split
+# per room and numbered, then metrics count each emit that actually goes out.
+_emit = socketio.emit
+if metrics:
+    _emit = metrics.wrap_emit(_emit)
+socketio.emit = event_replay.wrap_emit(_emit)
+
+# Serialized messages, groups and clauses, dropped on write (see serialization.py)
+serialization_cache = SerializationCache()
+serialization_cache.install_invalidation_hooks()
+
+
+def json_response(value, status=200):
+    """Like jsonify, with the fast encoder; value may also be JSON bytes already encoded"""
+    body = value if isinstance(value, bytes) else dumps(value)
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+# Published/current clause and clause status snapshots for polling clients (see clause_state.py)
+clause_state = ClauseStateCache()
+clause_state.install_invalidation_hooks()
+
+
+def state_response(snapshot):
+    """A snapshot as a response; unchanged state answers If-None-Match with 304"""
+    response = json_response(snapshot.body, snapshot.status)
+    if snapshot.status == 200:
+        response.set_etag(snapshot.etag)
+        response.cache_control.no_cache = True  # Cache, but revalidate on every poll
+        response = response.make_conditional(request)
+    return response
+
 # Endpoint to get all users
 @app.route('/delegates', methods=['GET'])
 def get_delegates():
@@ -65,39 +157,88 @@ def get_groups_for_delegate(id):
         if not delegate:
             return jsonify({"error": "Delegate not found"}), 404
 
-        groups = delegate.groups
+        groups = Group.query.join(delegate_group, delegate_group.c.group_id == Group.id)\
+            .filter(delegate_group.c.delegate_id == id).all()
+        group_ids = [group.id for group in groups]
+        # Members are only loaded (in one selectin) for groups whose summary is not cached
+        uncached = [group.id for group in groups
+                    if serialization_cache.lookup(Group, group.id, group.updated_at, 'serialize_summary') is None]
+        if uncached:
+            Group.query.filter(Group.id.in_(uncached)).options(selectinload(Group.delegates)).all()
+        # Before the commit below expires the groups, which would reload each one
+        summaries = {group.id: serialization_cache.serialize(group, 'serialize_summary') for group in groups}
+
+        # Last message per group via a max(id) aggregate instead of loading every history
+        latest_message_ids = dict(db.session.query(Message.group_id, db.func.max(Message.id))
+                                  .filter(Message.group_id.in_(group_ids))
+                                  .group_by(Message.group_id).all())
+        last_message_ids = dict(latest_message_ids)
+        # For group ID 1, always use message with ID 1
+        if 1 in last_message_ids:
+            last_message_ids[1] = 1
+        # Messages never change once sent, so a cached serialization is good for as long as
+        # the message exists; only the others are loaded
+        last_messages = {}
+        for group_id, message_id in last_message_ids.items():
+            cached = serialization_cache.lookup(Message, message_id)
+            if cached is not None:
+                last_messages[group_id] = cached.payload
+        missing_ids = [message_id for group_id, message_id in last_message_ids.items()
+                       if group_id not in last_messages]
+        if missing_ids:
+            messages_by_id = {
+                message.id: message
+                for message in Message.query.filter(Message.id.in_(missing_ids))
+                    .options(selectinload(Message.files)).all()
+            }
+            for group_id, message_id in last_message_ids.items():
+                if group_id not in last_messages and message_id in messages_by_id:
+                    last_messages[group_id] = serialization_cache.cached(messages_by_id[message_id]).payload
+
+        # Read markers for every group at once; missing rows are created in one bulk upsert, at
+        # the group's newest message so its history doesn't show up as unread
+        tracked = {group_id for (group_id,) in db.session.query(UnreadCount.group_id)
+                   .filter(UnreadCount.user_id == id, UnreadCount.group_id.in_(group_ids)).all()}
+        missing = [group_id for group_id in group_ids if group_id not in tracked]
+        if missing:
+            db.session.execute(
+                insert_ignore(UnreadCount, ['user_id', 'group_id']),
+                [{'user_id': id, 'group_id': group_id, 'count': 0,
+                  'last_read_message_id': latest_message_ids.get(group_id)} for group_id in missing]
+            )
+            db.session.commit()
+        unread_counts = count_unread(id, group_ids)
+
         group_list = []
-        for group in groups:
-            # Get the last message for the group
-            last_message = None
-            if group.messages:
-                # For group ID 1, always use message with ID 1
-                if group.id == 1:
-                    special_message = Message.query.get(1)
-                    last_message = special_message.serialize() if special_message else None
-                else:
-                    last_message = group.messages[-1].serialize()
-
-            group_data = group.serialize()
-            group_data["lastMessage"] = last_message
-            
-            # Get unread count from the UnreadCount table
-            unread_count = UnreadCount.query.filter_by(user_id=id, group_id=group.id).first()
-            if unread_count:
-                group_data["unreadCount"] = unread_count.count
-            else:
-                # Create a new entry if one doesn't exist
-                new_unread = UnreadCount(user_id=id, group_id=group.id, count=0)
-                db.session.add(new_unread)
-                db.session.commit()
-                group_data["unreadCount"] = 0
-                
+        for group_id in group_ids:
+            group_data = summaries[group_id]
+            group_data['unreadCount'] = unread_counts.get(group_id, 0)
+            group_data['lastMessage'] = last_messages.get(group_id)
             group_list.append(group_data)
 
-        return jsonify(group_list), 200
+        return json_response(group_list), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def count_unread(user_id, group_ids):
+    """Unread messages per group for a user: messages from others after their last_read_message_id.
+
+    Read markers start at the group's newest message when the row is created, so only messages
+    sent after that count. A row without a marker counts the whole history.
+    """
+    if not group_ids:
+        return {}
+    rows = db.session.query(Message.group_id, db.func.count(Message.id))\
+        .outerjoin(UnreadCount, db.and_(UnreadCount.group_id == Message.group_id,
+                                        UnreadCount.user_id == user_id))\
+        .filter(Message.group_id.in_(group_ids),
+                Message.id > db.func.coalesce(UnreadCount.last_read_message_id, 0),
+                Message.sender_id != user_id,
+                Message.group_id != 1)\
+        .group_by(Message.group_id).all()  # Gossip (group 1) messages are never counted as unread
+    return dict(rows)
+
+
 # Endpoint to get unread count for a specific user and group
 @app.route('/unread/<int:user_id>/<int:group_id>', methods=['GET'])
 def get_unread_count(user_id, group_id):
@@ -105,30 +246,45 @@ def get_unread_count(user_id, group_id):
         unread_count = UnreadCount.query.filter_by(user_id=user_id, group_id=group_id).first()
         
         if not unread_count:
-            # Create a new entry if one doesn't exist
-            unread_count = UnreadCount(user_id=user_id, group_id=group_id, count=0)
+            # Create a new entry if one doesn't exist, with everything sent so far read
+            latest = db.session.query(db.func.max(Message.id)).filter(Message.group_id == group_id).scalar()
+            unread_count = UnreadCount(user_id=user_id, group_id=group_id, count=0,
+                                       last_read_message_id=latest)
             db.session.add(unread_count)
             db.session.commit()
             
-        return jsonify({"count": unread_count.count}), 200
+        return jsonify({"count": count_unread(user_id, [group_id]).get(group_id, 0)}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Endpoint to update unread count for a specific user and group
+# The count is stored as a read marker: the newest `count` messages from others stay unread
 @app.route('/unread/<int:user_id>/<int:group_id>', methods=['POST'])
 def update_unread_count(user_id, group_id):
     try:
         count = request.json.get('count', 0)
+
+        if count > 0:
+            # Everything older than the count-th newest message from others has been read
+            nth_unread = db.session.query(Message.id)\
+                .filter(Message.group_id == group_id, Message.sender_id != user_id)\
+                .order_by(Message.id.desc()).offset(count - 1).limit(1).scalar()
+            last_read_message_id = nth_unread - 1 if nth_unread else None
+        else:
+            last_read_message_id = db.session.query(db.func.max(Message.id))\
+                .filter(Message.group_id == group_id).scalar()
         
         unread_count = UnreadCount.query.filter_by(user_id=user_id, group_id=group_id).first()
         
         if not unread_count:
             # Create a new entry if one doesn't exist
-            unread_count = UnreadCount(user_id=user_id, group_id=group_id, count=count)
+            unread_count = UnreadCount(user_id=user_id, group_id=group_id, count=count,
+                                       last_read_message_id=last_read_message_id)
             db.session.add(unread_count)
         else:
             # Update the existing entry
             unread_count.count = count
+            unread_count.last_read_message_id = last_read_message_id
             
         db.session.commit()
         
@@ -163,6 +319,28 @@ def create_message():
         )
         db.session.add(new_message)
         
+        # Files already stored on the server, sent as a JSON list of {sha256, name, type}
+        # instead of their bytes (see GET /blobs/<digest>)
+        try:
+            stored_files = json.loads(request.form.get('blobs') or '[]')
+        except ValueError:
+            return jsonify({'error': 'blobs must be a JSON list'}), 400
+        for stored in stored_files:
+            digest = str(stored.get('sha256', ''))
+            filename = secure_filename(str(stored.get('name', ''))) or digest
+            size = reference_blob(digest, sender_id) if is_digest(digest) else None
+            if size is None:
+                db.session.rollback()
+                return jsonify({'error': f'File {filename} is not stored; upload it', 'sha256': digest}), 409
+            db.session.add(File(
+                message=new_message,
+                name=filename,
+                size=size,
+                type=str(stored.get('type') or 'application/octet-stream')[:50],
+                path=f'/chatfiles/{digest}/{filename}',
+                sha256=digest
+            ))
+
         # Check if there are any files being sent
         if 'files' in request.files:
             files = request.files.getlist('files')
@@ -170,61 +348,109 @@ def create_message():
                 if file and file.filename:
                     # Secure the filename
                     filename = secure_filename(file.filename)
-                    file_path = os.path.join(app.config['CHAT_FILES'], filename)
-                    
-                    # Save the file
-                    file.save(file_path)
+
+                    # Store the content once under its digest (see attachments.py)
+                    digest, file_path, size, created = store_upload(file, app.config['CHAT_FILES'])
+
+                    # Render the image preview once here instead of on every serialization
+                    if created and is_previewable(file.mimetype):
+                        create_thumbnail(file_path)
 
                     # Create a new File entry associated with the message
                     new_file = File(
                         message=new_message,
                         name=filename,
-                        size=file.content_length,
+                        size=size,
                         type=file.mimetype,
-                        path=os.path.join('/chatfiles',filename)
+                        path=f'/chatfiles/{digest}/{filename}',
+                        sha256=digest
                     )
                     db.session.add(new_file)
 
-        # Commit all changes to the database
+        # Commit all changes to the database. Unread counts are derived from each member's
+        # last_read_message_id (see count_unread), so there is no per-recipient fan-out here
         db.session.commit()
 
-        # Don't emit for group 1 except message ID 1
-        if int(room_id) == 1 and new_message.id != 1:
-            return jsonify(new_message.serialize()), 201
-
-        # Increment unread count for all users in the group except the sender
-        group = Group.query.get(room_id)
-        if group:
-            for delegate in group.delegates:
-                if str(delegate.id) != str(sender_id):  # Skip the sender
-                    unread_count = UnreadCount.query.filter_by(user_id=delegate.id, group_id=room_id).first()
-                    if unread_count:
-                        unread_count.count += 1
-                    else:
-                        new_unread = UnreadCount(user_id=delegate.id, group_id=room_id, count=1)
-                        db.session.add(new_unread)
-            db.session.commit()
-
-        # Emit the new message to all connected clients
-        socketio.emit('new_message', new_message.serialize(), room=f"group_{room_id}", namespace='/chatsocket')
-
-        return jsonify(new_message.serialize()), 201
+        serialized = new_message.serialize()
+        broadcast_message(serialized)
+        return jsonify(serialized), 201
     except Exception as e:
         db.session.rollback()  # Roll back the transaction on error
         return jsonify({'error': str(e)}), 500
 
+# Lets a client skip uploading a file the server already has: it hashes the file, asks here
+# with ?delegate_id=, and on 200 sends {sha256, name, type} in the message's 'blobs' field
+# instead of the bytes. Only files already shared with that delegate are found; anything else
+# is a 404, whether or not someone else uploaded it
+@app.route('/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    blob = visible_blob(digest, request.args.get('delegate_id')) if is_digest(digest) else None
+    if blob is None:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify(blob.serialize()), 200
+
 # Endpoint to serve the uploaded files
+@app.route('/chatfiles/<digest>/<path:filename>', methods=['GET'])
+def download_stored_file(digest, filename):
+    """Content-addressed download: cacheable forever, resumable, conditional on the digest"""
+    if not is_digest(digest):
+        return jsonify({'error': 'File not found'}), 404
+    full_path = os.path.join(app.config['CHAT_FILES'], digest)
+    if not os.path.exists(full_path):
+        return jsonify({'error': 'File not found'}), 404
+
+    # send_file answers Range with 206 and If-None-Match with 304, and hands the open file to
+    # the server's sendfile (or to the front proxy when USE_X_SENDFILE is on)
+    response = send_file(full_path, as_attachment=True, download_name=secure_filename(filename) or digest,
+                         etag=digest, max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/chatfiles/<path:filename>', methods=['GET'])
 def download_file(filename):
+    """Files uploaded before content addressing: the name may be reused, so clients revalidate"""
     try:
-        # Log the filename and the full path we are trying to access
+        filename = secure_filename(filename)
         full_path = os.path.join(app.config['CHAT_FILES'], filename)
         
         # Check if the file exists before trying to serve it
         if not os.path.exists(full_path):
             return jsonify({'error': 'File not found'}), 404
 
-        return send_from_directory(app.config['CHAT_FILES'], filename, as_attachment=True)
+        response = send_from_directory(app.config['CHAT_FILES'], filename, as_attachment=True, max_age=0)
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Thumbnails are regenerated under the same name when a file is replaced,
+# so clients revalidate with the ETag instead of caching them forever
+THUMBNAIL_MAX_AGE = 24 * 60 * 60
+
+# Endpoint to serve image previews for chat files
+@app.route('/thumbnails/<path:filename>', methods=['GET'])
+def get_thumbnail(filename):
+    try:
+        filename = secure_filename(filename)
+        source_path = os.path.join(app.config['CHAT_FILES'], filename)
+        thumbnail_path = thumbnail_name(source_path)
+
+        # Files uploaded before thumbnails existed get their preview rendered on first request
+        if not os.path.exists(thumbnail_path):
+            if not os.path.exists(source_path) or not create_thumbnail(source_path):
+                return jsonify({'error': 'Thumbnail not found'}), 404
+
+        # send_from_directory sets the ETag and answers If-None-Match with 304. Previews of
+        # content-addressed files never change, so those can be cached for good
+        if is_digest(filename):
+            response = send_from_directory(app.config['CHAT_FILES'], thumbnail_name(filename),
+                                           mimetype='image/jpeg', max_age=IMMUTABLE_MAX_AGE)
+            response.cache_control.immutable = True
+            return response
+        return send_from_directory(app.config['CHAT_FILES'], thumbnail_name(filename),
+                                   mimetype='image/jpeg', max_age=THUMBNAIL_MAX_AGE)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -235,12 +461,15 @@ def join_user_room(data):
     if user_id:
         join_room(f"user_{user_id}")
         print(f"User {user_id} joined their own room")
+        return event_replay.position('/chatsocket', f"user_{user_id}")
 
 #join chat room
 @socketio.on('join_room',namespace='/chatsocket')
 def handle_join_room(data):
     room_id = data.get('roomId')
     join_room(f"group_{room_id}")  # Add the user to the room
+    # The ack tells a rejoining client whether it missed events
+    return event_replay.position('/chatsocket', f"group_{room_id}")
 
     
 # Example of using a namespace
@@ -248,13 +477,87 @@ def handle_join_room(data):
 def handle_connect():
     print('Client connected to /chatsocket')
 
+
+def broadcast_message(serialized):
+    """Send a stored message to its group's room"""
+    # It is about to be every member's lastMessage in /searchgroup
+    serialization_cache.store(Message, serialized['id'], None, serialized)
+    # Don't emit for group 1 except message ID 1
+    if serialized['group_id'] == 1 and serialized['id'] != 1:
+        return
+    socketio.emit('new_message', serialized, room=f"group_{serialized['group_id']}", namespace='/chatsocket')
+
+
+# Text messages sent over the socket are written in micro-batches (see message_ingest.py)
+message_batcher = MessageBatcher(app, on_stored=broadcast_message)
+socketio.start_background_task(message_batcher.run)
+
+
+@socketio.on('send_message', namespace='/chatsocket')
+def on_send_message(data):
+    """Store one message ({roomId, senderId, content, timestamp?, date?, clientId?}) or a batch
+    ({messages: [...]}); the ack lists {clientId, id, message} or {clientId, error} per message"""
+    items = data.get('messages') if isinstance(data, dict) and 'messages' in data else [data]
+    if not isinstance(items, list) or not items:
+        return {'ok': False, 'error': 'No messages'}
+    if len(items) > MAX_MESSAGES_PER_SEND:
+        return {'ok': False, 'error': f'At most {MAX_MESSAGES_PER_SEND} messages per send'}
+
+    acks = [None] * len(items)
+    valid = []  # (position in items, column values)
+    for position, item in enumerate(items):
+        client_id = item.get('clientId') if isinstance(item, dict) else None
+        try:
+            valid.append((position, parse_message(item)))
+        except MessageError as e:
+            acks[position] = {'clientId': client_id, 'error': str(e)}
+
+    if valid:
+        results = message_batcher.submit([values for _, values in valid])
+        for (position, _), result in zip(valid, results):
+            client_id = items[position].get('clientId')
+            if result is None or 'error' in result:
+                acks[position] = {'clientId': client_id, 'error': (result or {}).get('error', 'Not stored')}
+            else:
+                acks[position] = {'clientId': client_id, 'id': result['id'], 'message': result}
+    return {'ok': all('error' not in ack for ack in acks), 'messages': acks}
+
+# Default and maximum number of messages returned per history window
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
 # Endpoint to get messages for a group with pagination
+# Keyset pagination: ?before_id=<id> scrolls back, ?after_id=<id> catches up, ?limit=<n> sizes the window.
+# Without a cursor the newest window is returned. The cursor for the next page in the same
+# direction is returned in the X-Next-Cursor header so the body stays a plain list of messages.
 @app.route('/groups/<int:group_id>/messages', methods=['GET'])
 def get_group_messages(group_id):
     try:
         group = Group.query.get_or_404(group_id)
-        messages = Message.query.filter_by(group_id=group_id).all()
-        
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+        limit = request.args.get('limit', MESSAGE_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+
+        query = Message.query.filter_by(group_id=group_id)\
+            .options(selectinload(Message.sender), selectinload(Message.files))
+
+        if after_id is not None:
+            # Catching up: oldest first, starting right after the cursor
+            messages = query.filter(Message.id > after_id)\
+                .order_by(Message.id.asc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            next_cursor = messages[-1].id if has_more else None
+        else:
+            # Scrolling back: newest first from the cursor, then flipped into display order
+            if before_id is not None:
+                query = query.filter(Message.id < before_id)
+            messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit][::-1]
+            next_cursor = messages[0].id if has_more else None
+
         messages_data = [{
             'id': msg.id,
             'text': msg.text,
@@ -262,21 +565,18 @@ def get_group_messages(group_id):
             'sender_id': msg.sender_id,
             'sender_name': msg.sender.name if msg.sender else 'Unknown',
             'date': msg.date,
-            'files': [{
-                'name': file.name,
-                'size': file.size,
-                'type': file.type,
-                'url': f"http://localhost:8000/{file.path}",
-                'preview': f"data:{file.type};base64,{base64.b64encode(open(file.path, 'rb').read()).decode('utf-8')}" if file.type.startswith('image/') and os.path.exists(file.path) else None
-            } for file in msg.files]
+            'files': [file.serialize() for file in msg.files]
         } for msg in messages]
-        
-        return jsonify(messages_data), 200
+
+        response = jsonify(messages_data)
+        response.headers['X-Next-Cursor'] = str(next_cursor) if next_cursor is not None else ''
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        return response, 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Endpoint to create a new group
 @app.route('/groups', methods=['POST'])
@@ -341,6 +641,58 @@ def create_group():
 
 
 
+# Fields of the amendment list, by name; amended_clause (HTML) is left out unless asked for
+AMENDMENT_FIELDS = {
+    'id': lambda amendment: amendment.id,
+    'amendment_text': lambda amendment: amendment.amendment_text,
+    'country': lambda amendment: amendment.country,
+    'committee': lambda amendment: amendment.committee,
+    'clause_id': lambda amendment: amendment.clause_id,
+    'timestamp': lambda amendment: amendment.timestamp.isoformat(),
+    'is_published': lambda amendment: amendment.is_published,
+    'is_rejected': lambda amendment: amendment.is_rejected,
+    'is_passed': lambda amendment: amendment.is_passed,
+    'amended_clause': lambda amendment: amendment.amended_clause,
+    'under_debate': lambda amendment: amendment.under_debate,
+    'debate_clause_id': lambda amendment: amendment.debate_clause_id,
+    'clause_status': lambda amendment: amendment.clause.is_published if amendment.clause else None,
+}
+DEFAULT_AMENDMENT_FIELDS = [name for name in AMENDMENT_FIELDS if name != 'amended_clause']
+
+AMENDMENT_STATUSES = {
+    'pending': db.and_(db.not_(Amendment.is_published), db.not_(Amendment.is_rejected),
+                       db.not_(Amendment.is_passed)),
+    'published': Amendment.is_published,
+    'passed': Amendment.is_passed,
+    'rejected': Amendment.is_rejected,
+    'under_debate': Amendment.under_debate,
+}
+
+MAX_AMENDMENT_PAGE_SIZE = 500
+# ?since= also returns rows changed this long before the version, so a write that committed
+# after a refresh read but carries an earlier updated_at is not missed
+AMENDMENT_SINCE_OVERLAP = timedelta(seconds=2)
+
+
+@event.listens_for(Session, 'before_flush')
+def touch_amendments_of_clause(session, flush_context, instances):
+    """Amendments are served with their clause's clause_status, so publishing or unpublishing
+    a clause changes its amendments as far as ?since= is concerned"""
+    clause_ids = [clause.id for clause in session.dirty
+                  if isinstance(clause, Clause) and clause.id is not None
+                  and inspect(clause).attrs.is_published.history.has_changes()]
+    if clause_ids:
+        session.execute(db.update(Amendment).where(Amendment.clause_id.in_(clause_ids))
+                        .values(updated_at=datetime.utcnow()))
+
+
+# Amendments of ?committee=, newest first. Optional:
+#   status=pending,published,passed,rejected,under_debate  (any of them)
+#   fields=id,country,...  (default: everything but amended_clause)
+#   limit=<n>&before_id=<id>  keyset pages; the next before_id is in X-Next-Cursor
+#   since=<X-Version of an earlier response>  only what changed since, plus {id, deleted: true}
+#   for amendments deleted since
+# Every response carries the X-Version to pass as since= next time.
 @app.route('/amendments', methods=['GET'])
 def get_amendments():
     committee = request.args.get('committee')
@@ -348,45 +700,183 @@ def get_amendments():
     if not committee:
         return jsonify({'error': 'Committee is required!'}), 400
 
-    amendments = Amendment.query.filter_by(committee=committee)\
-        .options(joinedload(Amendment.clause))\
-        .order_by(Amendment.timestamp.desc()).all()
-
-    amendments_list = []
-    for amendment in amendments:
-        amendment_data = {
-            'id': amendment.id,
-            'amendment_text': amendment.amendment_text, 
-            'country': amendment.country,
-            'committee': amendment.committee,
-            'clause_id': amendment.clause_id,
-            'timestamp': amendment.timestamp.isoformat(),
-            'is_published': amendment.is_published,
-            'is_rejected': amendment.is_rejected,
-            'is_passed': amendment.is_passed,
-            'amended_clause': amendment.amended_clause,
-            'under_debate': amendment.under_debate,
-            'debate_clause_id': amendment.debate_clause_id,
-            'clause_status': amendment.clause.is_published if amendment.clause else None
-        }
-        amendments_list.append(amendment_data)
-    
-    return jsonify(amendments_list), 200
+    statuses = [status for status in request.args.get('status', '').split(',') if status]
+    if any(status not in AMENDMENT_STATUSES for status in statuses):
+        return jsonify({'error': f'status must be one or more of {", ".join(AMENDMENT_STATUSES)}'}), 400
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or DEFAULT_AMENDMENT_FIELDS
+    if any(field not in AMENDMENT_FIELDS for field in fields):
+        return jsonify({'error': f'fields must be among {", ".join(AMENDMENT_FIELDS)}'}), 400
+    fields = ['id'] + [field for field in fields if field != 'id']
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = min(max(limit, 1), MAX_AMENDMENT_PAGE_SIZE)
+    before_id = request.args.get('before_id', type=int)
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'since must be the X-Version of an earlier response'}), 400
+
+    # Taken before reading, so anything written while this runs is newer than the version
+    version = datetime.utcnow()
+
+    query = Amendment.query.filter_by(committee=committee)
+    if 'amended_clause' not in fields:
+        query = query.options(defer(Amendment.amended_clause))
+    if 'clause_status' in fields:
+        query = query.options(joinedload(Amendment.clause))
+    if statuses:
+        query = query.filter(db.or_(*(AMENDMENT_STATUSES[status] for status in statuses)))
+    if since is not None:
+        query = query.filter(Amendment.updated_at > since - AMENDMENT_SINCE_OVERLAP)
+    if before_id is not None:
+        # Keyset on (timestamp, id), the list order
+        cursor = db.session.query(Amendment.timestamp).filter_by(id=before_id).scalar()
+        if cursor is None:
+            return jsonify({'error': 'Unknown before_id'}), 400
+        query = query.filter(db.or_(Amendment.timestamp < cursor,
+                                    db.and_(Amendment.timestamp == cursor, Amendment.id < before_id)))
+    query = query.order_by(Amendment.timestamp.desc(), Amendment.id.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+    amendments = query.all()
+
+    has_more = limit is not None and len(amendments) > limit
+    amendments = amendments[:limit]
+    amendments_list = [{field: AMENDMENT_FIELDS[field](amendment) for field in fields} for amendment in amendments]
+
+    # Deleted amendments are archived; report them first so an incremental refresh drops them
+    # (SQLite may hand a deleted id to a newer amendment, which then follows in the list)
+    if since is not None and before_id is None:
+        deleted = db.session.query(ArchivedAmendment.amendment_id).filter(
+            ArchivedAmendment.committee == committee,
+            ArchivedAmendment.archived_at > since - AMENDMENT_SINCE_OVERLAP).distinct()
+        amendments_list = [{'id': id, 'deleted': True} for id, in deleted] + amendments_list
+
+    response = jsonify(amendments_list)
+    response.headers['X-Version'] = version.isoformat()
+    if limit is not None:
+        response.headers['X-Next-Cursor'] = str(amendments[-1].id) if has_more else ''
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+    return response, 200
+
+
+def sync_payloads(ids):
+    """entity -> {id: payload} for the logged rows (entity -> ids) that still exist"""
+    payloads = {entity: {} for entity in ids}
+    if ids.get('amendment'):
+        for amendment in Amendment.query.options(defer(Amendment.amended_clause), joinedload(Amendment.clause))\
+                .filter(Amendment.id.in_(ids['amendment'])):
+            payloads['amendment'][amendment.id] = {field: AMENDMENT_FIELDS[field](amendment)
+                                                   for field in DEFAULT_AMENDMENT_FIELDS}
+    if ids.get('clause'):
+        for clause in Clause.query.options(defer(Clause.html_content)).filter(Clause.id.in_(ids['clause'])):
+            payloads['clause'][clause.id] = clause_summary(clause)
+    if ids.get('resolution'):
+        for resolution in Resolution.query.filter(Resolution.id.in_(ids['resolution'])):
+            payloads['resolution'][resolution.id] = resolution.serialize()
+    if ids.get('group'):
+        for group in Group.query.options(selectinload(Group.delegates)).filter(Group.id.in_(ids['group'])):
+            payloads['group'][group.id] = serialization_cache.serialize(group, 'serialize_summary')
+    if ids.get('message'):
+        for message in Message.query.options(selectinload(Message.files), joinedload(Message.sender))\
+                .filter(Message.id.in_(ids['message'])):
+            payloads['message'][message.id] = serialization_cache.serialize(message)
+    return payloads
+
+
+# Everything that changed after ?since=<version> (see change_log.py): the amendments, clauses
+# and resolutions of ?committee=, and with ?delegate_id= that delegate's groups and their
+# messages. Each changed row is listed once, in the order of its last change, with its
+# current data or deleted: true. Without since, or when the log no longer goes back that far,
+# the answer is reset: true and the current version: reload everything, then sync from there.
+# has_more means another page follows from the returned version (?limit= sizes pages).
+@app.route('/sync', methods=['GET'])
+def sync():
+    committee = request.args.get('committee')
+    delegate_id = request.args.get('delegate_id', type=int)
+    since = request.args.get('since', type=int)
+    limit = min(max(request.args.get('limit', SYNC_PAGE_SIZE, type=int), 1), MAX_SYNC_PAGE_SIZE)
 
+    if not committee and delegate_id is None:
+        return jsonify({'error': 'committee or delegate_id is required'}), 400
 
-# Dictionary to store content based on group
-content_store = {
-    'junior': '',
-    'senior': '',
-    'security-council': ''
-}
+    group_ids = []
+    if delegate_id is not None:
+        group_ids = [id for id, in db.session.query(delegate_group.c.group_id)
+                     .filter(delegate_group.c.delegate_id == delegate_id)]
 
-# Storage for resolutions by committee
-resolutions = {
-    'junior': [],
-    'senior': [],
-    'security-council': [],
-}
+    if since is None:
+        rows, version, has_more, reset = [], current_version(), False, True
+    else:
+        rows, version, has_more, reset = changes_since(since, committee=committee, group_ids=group_ids,
+                                                       limit=limit)
+
+    # The last change of each row decides whether it is listed with its data or as deleted
+    last = {}
+    for row in rows:
+        last.pop((row.entity, row.entity_id), None)
+        last[row.entity, row.entity_id] = row.deleted
+    ids = {}
+    for (entity, id), deleted in last.items():
+        if not deleted:
+            ids.setdefault(entity, []).append(id)
+    payloads = sync_payloads(ids)
+
+    changes = []
+    for (entity, id), deleted in last.items():
+        data = None if deleted else payloads[entity].get(id)
+        # Rows deleted by a later change outside this page count as deleted here, too
+        changes.append({'entity': entity, 'id': id, 'deleted': True} if data is None else
+                       {'entity': entity, 'id': id, 'deleted': False, 'data': data})
+    return json_response({'version': version, 'reset': reset, 'has_more': has_more, 'changes': changes})
+
+
+# Live editor content per committee (/current): cached in memory, written behind to the
+# database so every worker converges on the same content (see live_content.py)
+def on_live_content_merged(group, content, version):
+    # The clients' versions don't lead to the merged document, so they all get it whole
+    socketio.emit('content_snapshot', {'group': group, 'version': version, 'content': content},
+                  to=group, namespace='/content')
+
+
+live_content = LiveContentStore(app, on_merge=on_live_content_merged)
+socketio.start_background_task(live_content.run_flusher, socketio.sleep)
+
+# Old change log rows are pruned in the background (see change_log.py)
+socketio.start_background_task(run_pruner, app, socketio.sleep)
+atexit.register(live_content.flush)
+
+# Resolutions per committee, served from memory between additions
+RESOLUTION_CACHE_TTL = 1.0
+resolution_cache = LRUCache(max_entries=64, ttl=RESOLUTION_CACHE_TTL)
+
+
+def url_committee(committee):
+    """'security council' / 'Security-Council' -> 'security-council', as used in URLs and event names"""
+    return committee.lower().replace(' ', '-') if committee else committee
+
+
+def known_committee(committee):
+    """Database form of a committee name, or None if it is not one of GROUPS"""
+    committee = (committee or '').lower().replace('-', ' ')
+    return committee if committee in GROUPS else None
+
+def committee_room(committee):
+    """Socket room for everyone following a committee ('security-council' and 'Security Council' share one)"""
+    return f"committee_{committee.lower().replace('-', ' ')}"
+
+@socketio.on('join_committee')
+def join_committee(data):
+    committee = data.get('committee')
+    if not committee:
+        return
+    room = committee_room(committee)
+    # A connection follows one committee at a time; switching leaves the previous room
+    for joined in rooms():
+        if joined.startswith('committee_') and joined != room:
+            leave_room(joined)
+    join_room(room)
+    return event_replay.position('/', room)
 
 def normalize_committee_name(committee):
     """Convert between URL-friendly and database-friendly committee names"""
@@ -459,9 +949,8 @@ def loginDelegate():
 # Endpoint to add a resolution
 @app.route('/api/resolutions/<committee>', methods=['POST'])
 def add_resolution(committee):
-    committee = committee.lower()
-    committee = normalize_committee_name(committee)
-    if committee not in resolutions:
+    committee = known_committee(committee)
+    if not committee:
         return jsonify({"error": "Invalid committee"}), 400
 
     data = request.json.get('data')
@@ -473,61 +962,117 @@ def add_resolution(committee):
         if clause:
             clause.is_published = False
             clause.is_passed = True  # Set is_passed to True
-            db.session.commit()
-    
-    resolutions[committee].append(data)
+
+    # Stored with the clause update in one commit
+    db.session.add(Resolution(committee=committee, clause_id=clause_id if clause_id else None,
+                              data=json.dumps(data)))
+    db.session.commit()
+    resolution_cache.invalidate(committee)
     
     # Emit a WebSocket event to update the committee's data
-    socketio.emit(f'update-{committee}', data)
+    socketio.emit(f'update-{url_committee(committee)}', data, to=committee_room(committee))
     socketio.emit('clause_status_changed', {
         'clauseId': clause_id,
         'committee': committee,
         'is_published': False,
         'is_passed': True
-    })
+    }, to=committee_room(committee))
     
     return jsonify({"message": "Resolution added successfully"}), 200
 
 # Endpoint to get resolutions
 @app.route('/api/resolutions/<committee>', methods=['GET'])
 def get_resolutions(committee):
-    committee=committee.lower()
-    if committee not in resolutions:
+    committee = known_committee(committee)
+    if not committee:
         return jsonify({"error": "Invalid committee"}), 400
-    print(resolutions[committee])
-    return jsonify(resolutions[committee]), 200
+
+    committee_resolutions = resolution_cache.get(committee)
+    if committee_resolutions is MISSING:
+        committee_resolutions = [resolution.serialize() for resolution in
+                                 Resolution.query.filter_by(committee=committee).order_by(Resolution.id).all()]
+        resolution_cache.put(committee, committee_resolutions)
+    return jsonify(committee_resolutions), 200
 
 @app.route('/current', methods=['GET', 'POST'])
 def current_content():
+    # Live editor documents are versioned and change by patches; see live_content.py
     if request.method == 'POST':
-        # Get content and group from the request
+        # Get the group and either a patch against base_version or the whole content
         data = request.json
-        group = data.get('group').lower()
-        content = data.get('content')
-
-        
-        # Store the content for the specific group
-        if group in content_store:
-            content_store[group] = content
-            # Broadcast the new content to all connected clients in the relevant group
-            socketio.emit('update_content', {'group': group, 'content': content}, room=group)
-            return jsonify({"message": "Content stored and broadcasted successfully"}), 200
-        else:
+        group = url_committee(data.get('group'))
+        if not known_committee(group):
             return jsonify({"error": "Invalid group"}), 400
 
+        try:
+            if 'base_version' in data:
+                patch = live_content.apply(group, int(data['base_version']), int(data['pos']),
+                                           int(data['delete']), data.get('insert', ''))
+            else:
+                patch = live_content.replace(group, data.get('content') or '')
+        except PatchConflict as e:
+            _, version = live_content.snapshot(group)
+            return jsonify({"error": str(e), "version": version}), 409
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Malformed patch"}), 400
+
+        # Broadcast only the change to the clients following this group
+        if patch:
+            socketio.emit('content_patch', dict(patch, group=group), room=group, namespace='/content')
+        _, version = live_content.snapshot(group)
+        return jsonify({"message": "Content stored and broadcasted successfully", "version": version}), 200
+
     elif request.method == 'GET':
-        group = request.args.get('group')
-        # Return the content for the requested group
-        if group in content_store:
-            return jsonify({"content": content_store[group]}), 200
-        else:
+        group = url_committee(request.args.get('group'))
+        if not known_committee(group):
             return jsonify({"error": "Invalid group"}), 400
 
+        # ?since=<version> returns just the patches after it when they are still available
+        since = request.args.get('since', type=int)
+        if since is not None:
+            patches = live_content.patches_since(group, since)
+            if patches is not None:
+                return jsonify({"version": since + len(patches), "patches": patches}), 200
+        content, version = live_content.snapshot(group)
+        return jsonify({"content": content, "version": version}), 200
+
+
+def content_catch_up(group, version):
+    """(event, payload) bringing a client at version (None if it has nothing) up to date"""
+    if version is not None:
+        patches = live_content.patches_since(group, version)
+        if patches is not None:
+            return 'content_patches', {'group': group, 'version': version + len(patches), 'patches': patches}
+    content, current_version = live_content.snapshot(group)
+    return 'content_snapshot', {'group': group, 'version': current_version, 'content': content}
+
+
 @socketio.on('join', namespace='/content')
 def on_join(data):
-    group = data['group']
+    group = url_committee(data['group'])
+    if not known_committee(group):
+        return
     join_room(group)
-    emit('update_content', {'group': group, 'content': content_store[group]}, room=group)
+    # Only the joining client needs catching up: the patch tail after its version, or a snapshot
+    emit(*content_catch_up(group, data.get('version')))
+
+
+@socketio.on('patch', namespace='/content')
+def on_content_patch(data):
+    """Apply an editor patch and relay it to the other clients; the return value is the ack"""
+    group = url_committee(data.get('group'))
+    if not known_committee(group):
+        return {'ok': False, 'error': 'Invalid group'}
+    try:
+        patch = live_content.apply(group, int(data['base_version']), int(data['pos']),
+                                   int(data['delete']), data.get('insert', ''))
+    except PatchConflict as e:
+        return {'ok': False, 'error': str(e), 'version': live_content.snapshot(group)[1]}
+    except (KeyError, TypeError, ValueError):
+        return {'ok': False, 'error': 'Malformed patch'}
+
+    emit('content_patch', dict(patch, group=group), to=group, include_self=False)
+    return {'ok': True, 'version': patch['version'], 'pos': patch['pos']}
 
     
 @app.route('/amendments/add', methods=['POST'])
@@ -558,7 +1103,7 @@ def add_amendment():
     }
 
     # Emit the new amendment to all connected clients
-    socketio.emit('new_amendment', amendment_data)
+    socketio.emit('new_amendment', amendment_data, to=committee_room(new_amendment.committee))
 
     return jsonify({'message': 'Amendment added successfully.'}), 200
 
@@ -566,35 +1111,20 @@ def add_amendment():
 
 @app.route('/amendments/delete', methods=['POST'])
 def delete_all_amendments():
-    amendments = Amendment.query.all()
-    if amendments:
-        archive_file = 'archived_amendments.json'
-
-        if os.path.exists(archive_file):
-            with open(archive_file, 'r') as file:
-                archived_data = json.load(file)
-        else:
-            archived_data = []
-
-        archived_data.extend([
-            {
-                'id': amendment.id,
-                'amendment_text': amendment.amendment_text,
-                'country': amendment.country,
-                'committee': amendment.committee,
-                'timestamp': amendment.timestamp.isoformat()
-            }
-            for amendment in amendments
-        ])
-
-        with open(archive_file, 'w') as file:
-            json.dump(archived_data, file, indent=4)
-
-        db.session.query(Amendment).delete()
+    # Only what exists now: amendments added while this runs are neither archived nor deleted
+    last_id, = db.session.query(db.func.max(Amendment.id)).one()
+    if last_id is not None:
+        committees = [committee for (committee,) in
+                      db.session.query(Amendment.committee).filter(Amendment.id <= last_id).distinct()]
+
+        # Archive and delete in one transaction
+        archive_amendments(Amendment.id <= last_id)
+        db.session.query(Amendment).filter(Amendment.id <= last_id).delete(synchronize_session=False)
         db.session.commit()
 
         # Emit an event to notify clients to clear the amendments list
-        socketio.emit('amendments_cleared')
+        for committee in committees:
+            socketio.emit('amendments_cleared', {'committee': committee}, to=committee_room(committee))
 
     return jsonify({'message': 'All amendments have been deleted and archived.'}), 200
 
@@ -603,36 +1133,110 @@ def delete_all_amendments():
 def delete_single_amendment(amendment_id):
     amendment = Amendment.query.get(amendment_id)
     if amendment:
-        archive_file = 'archived_amendments.json'
-
-        if os.path.exists(archive_file):
-            with open(archive_file, 'r') as file:
-                archived_data = json.load(file)
-        else:
-            archived_data = []
-
-        archived_data.append({
-            'id': amendment.id,
-            'amendment_text': amendment.amendment_text,
-            'country': amendment.country,
-            'committee': amendment.committee,
-            'timestamp': amendment.timestamp.isoformat()
-        })
-
-        with open(archive_file, 'w') as file:
-            json.dump(archived_data, file, indent=4)
-
+        committee = amendment.committee
+        archive_amendments(Amendment.id == amendment_id)
         db.session.delete(amendment)
         db.session.commit()
 
         # Emit an event to notify clients about the deletion
-        socketio.emit('amendment_deleted', {'id': amendment_id})
+        socketio.emit('amendment_deleted', {'id': amendment_id, 'committee': committee}, to=committee_room(committee))
 
         return jsonify({'message': f'Amendment {amendment_id} has been deleted and archived.'}), 200
 
     return jsonify({'error': 'Amendment not found'}), 404
 
 
+# Endpoint to query archived amendments
+@app.route('/amendments/archive', methods=['GET'])
+def get_archived_amendments():
+    """Archived amendments, oldest first, streamed as a JSON array (or NDJSON with format=ndjson).
+
+    Filters: committee, country, and from/to as ISO dates or datetimes on the submission time.
+    """
+    try:
+        since = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        until = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+
+    rows = iter_archive(archive_query(committee=request.args.get('committee'),
+                                      country=request.args.get('country'),
+                                      since=since, until=until))
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(stream_ndjson(rows)), mimetype='application/x-ndjson')
+    return Response(stream_with_context(stream_json(rows)), mimetype='application/json')
+
+
+def search_result_fields(hits):
+    """(kind, id) -> what a result lists about the row, for the rows of hits that still exist"""
+    ids = {}
+    for kind, id, _, _ in hits:
+        ids.setdefault(kind, []).append(id)
+    fields = {}
+    if ids.get('message'):
+        for message in Message.query.filter(Message.id.in_(ids['message'])):
+            fields['message', message.id] = {
+                'group_id': message.group_id, 'sender_id': message.sender_id, 'text': message.text,
+                'timestamp': message.timestamp, 'date': message.date,
+            }
+    if ids.get('clause'):
+        for clause in Clause.query.options(defer(Clause.html_content)).filter(Clause.id.in_(ids['clause'])):
+            fields['clause', clause.id] = {
+                'committee': clause.committee, 'country': clause.country, 'filename': clause.filename,
+                'timestamp': clause.timestamp.isoformat(), 'is_published': clause.is_published,
+            }
+    if ids.get('amendment'):
+        for amendment in Amendment.query.filter(Amendment.id.in_(ids['amendment'])):
+            fields['amendment', amendment.id] = {
+                'committee': amendment.committee, 'country': amendment.country, 'clause_id': amendment.clause_id,
+                'amendment_text': amendment.amendment_text, 'timestamp': amendment.timestamp.isoformat(),
+                'is_published': amendment.is_published, 'is_rejected': amendment.is_rejected,
+                'is_passed': amendment.is_passed,
+            }
+    return fields
+
+
+# Full-text search, best matches first (see search.py). Clauses and amendments are searched
+# within ?committee=, chat messages within the groups of ?delegate_id= (or just ?group_id=).
+# ?kind=message,clause,amendment narrows the kinds; ?limit= and ?offset= page through results.
+@app.route('/search', methods=['GET'])
+def search_all():
+    query = request.args.get('q', '').strip()
+    committee = request.args.get('committee')
+    delegate_id = request.args.get('delegate_id', type=int)
+    group_id = request.args.get('group_id', type=int)
+    kinds = [kind for kind in request.args.get('kind', ','.join(KINDS)).split(',') if kind]
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), MAX_SEARCH_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    if not kinds or any(kind not in KINDS for kind in kinds):
+        return jsonify({'error': f'kind must be one or more of {", ".join(KINDS)}'}), 400
+    if not committee and delegate_id is None:
+        return jsonify({'error': 'committee or delegate_id is required'}), 400
+
+    # Delegates only find messages of the groups they are in
+    group_ids = []
+    if delegate_id is not None and 'message' in kinds:
+        group_ids = [id for id, in db.session.query(delegate_group.c.group_id)
+                     .filter(delegate_group.c.delegate_id == delegate_id)]
+        if group_id is not None:
+            group_ids = [group_id] if group_id in group_ids else []
+
+    try:
+        hits, has_more = search(db.session, query, committee=committee, group_ids=group_ids, kinds=kinds,
+                                limit=limit, offset=offset)
+    except SearchUnavailable:
+        return jsonify({'error': 'Search is not available on this database'}), 503
+
+    # Rows deleted since they were indexed are left out
+    fields = search_result_fields(hits)
+    results = [dict(fields[kind, id], kind=kind, id=id, score=score, snippet=snippet)
+               for kind, id, score, snippet in hits if (kind, id) in fields]
+    return json_response({'results': results, 'next_offset': offset + limit if has_more else None})
+
+
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -660,14 +1264,12 @@ def get_group_folder(group):
     return os.path.join(BASE_UPLOAD_FOLDER, group)
 
 def docx_to_html(docx_path):
-    html_content = pypandoc.convert_file(docx_path, 'html5')
+    html_content, _ = convert_docx(docx_path)
     return html_content
 
-@app.route('/files/<committee>', methods=['GET'])
-def list_files(committee):
-    normalized_committee = committee
-    clauses = Clause.query.filter_by(committee=normalized_committee).order_by(Clause.timestamp.desc()).all()
-    return jsonify([{
+def clause_summary(clause):
+    """A clause as listed by /files/<committee>"""
+    return {
         'id': clause.id,
         'filename': clause.filename,
         'country': clause.country,
@@ -675,7 +1277,13 @@ def list_files(committee):
         'is_published': clause.is_published,
         'is_rejected': clause.is_rejected,
         'is_passed': clause.is_passed
-    } for clause in clauses])
+    }
+
+@app.route('/files/<committee>', methods=['GET'])
+def list_files(committee):
+    normalized_committee = committee
+    clauses = Clause.query.filter_by(committee=normalized_committee).order_by(Clause.timestamp.desc()).all()
+    return jsonify([clause_summary(clause) for clause in clauses])
 
 @app.route('/clause/<int:clause_id>', methods=['GET'])
 def get_clause(clause_id):
@@ -689,30 +1297,21 @@ def get_clause(clause_id):
         'timestamp': clause.timestamp.isoformat()
     })
 
-@app.route('/upload/<committee>', methods=['POST'])
-def upload_file(committee):
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-
-    if file and file.filename.endswith('.docx'):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], committee, filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        file.save(file_path)
-        try:
-            # Convert DOCX to HTML using pypandoc
-            html_content = pypandoc.convert_file(
-                file_path,
-                'html',
-                format='docx',
-                extra_args=['--wrap=none', '--extract-media=media']
-            )
-            # Get country from session or request
-            country = request.headers.get('X-Country', 'Unknown')
+def run_conversion_job(job_id, file_path, digest, committee, country, filename):
+    """Convert an uploaded clause in the background, then store it and notify the committee"""
+    try:
+        # Stays queued until a conversion slot is free
+        with conversion_queue.slot():
+            conversion_jobs.update(job_id, status='converting')
+            # A document we have already converted skips conversion entirely
+            html_content = conversion_cache.get(digest)
+            cached = html_content is not None
+            converter = 'cache'
+            if not cached:
+                html_content, converter = run_in_os_thread(convert_docx, file_path)
+                conversion_cache.put(digest, html_content)
+
+        with app.app_context():
             # Save to database
             clause = Clause(
                 committee=committee,
@@ -722,22 +1321,69 @@ def upload_file(committee):
             )
             db.session.add(clause)
             db.session.commit()
-            # Emit websocket event
-            socketio.emit('new_clause', {
+            clause_data = {
                 'id': clause.id,
                 'committee': committee,
                 'country': country,
                 'filename': filename,
                 'timestamp': clause.timestamp.isoformat()
-            })
-            
-            return jsonify({'message': 'File uploaded successfully'}), 200
-            
-        except Exception as e:
-            return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
-        
+            }
+
+        conversion_jobs.update(job_id, status='done', clause_id=clause_data['id'], cached=cached,
+                              converter=converter)
+        # Emit websocket events
+        socketio.emit('new_clause', clause_data, to=committee_room(committee))
+        socketio.emit('clause_converted', conversion_jobs.get(job_id), to=committee_room(committee))
+    except Exception as e:
+        conversion_jobs.update(job_id, status='failed', error=f'Conversion failed: {str(e)}')
+        socketio.emit('clause_converted', conversion_jobs.get(job_id), to=committee_room(committee))
+
+@app.route('/upload/<committee>', methods=['POST'])
+def upload_file(committee):
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file and file.filename.endswith('.docx'):
+        filename = secure_filename(file.filename)
+        folder = os.path.join(app.config['UPLOAD_FOLDER'], committee)
+        os.makedirs(folder, exist_ok=True)
+        # Stored under its digest, so a later upload with the same name can't replace the bytes
+        # the job converts (and caches under this digest) before it runs
+        upload_path = os.path.join(folder, f"{uuid.uuid4().hex}.upload")
+        file.save(upload_path)
+        digest = hash_file(upload_path)
+        file_path = os.path.join(folder, f"{digest}.docx")
+        os.replace(upload_path, file_path)
+
+        # Get country from session or request
+        country = request.headers.get('X-Country', 'Unknown')
+
+        # Conversion happens off the request; clients poll the job or wait for clause_converted
+        if not conversion_queue.reserve():
+            return jsonify({'error': 'Too many uploads waiting for conversion, try again shortly'}), 503
+        job_id = conversion_jobs.create(committee=committee, country=country, filename=filename)
+        socketio.start_background_task(run_conversion_job, job_id, file_path, digest,
+                                       committee, country, filename)
+
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'job_id': job_id,
+            'status': 'queued'
+        }), 202
+
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/upload/jobs/<job_id>', methods=['GET'])
+def get_conversion_job(job_id):
+    job = conversion_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
 @app.route('/clause/<int:clause_id>/publish', methods=['POST'])
 def publish_clause(clause_id):
     try:
@@ -780,7 +1426,7 @@ def publish_clause(clause_id):
             'country': clause.country,
             'content': clause.html_content,
             'timestamp': clause.timestamp.isoformat()
-        })
+        }, to=committee_room(clause.committee))
 
         return jsonify({
             'success': True,
@@ -796,34 +1442,40 @@ def publish_clause(clause_id):
 
 @app.route('/clause/<int:clause_id>/status', methods=['GET'])
 def get_clause_status(clause_id):
-    try:
-        clause = Clause.query.get_or_404(clause_id)
-        return jsonify({
+    def build():
+        clause = db.session.get(Clause, clause_id)
+        if not clause:
+            return 404, {'error': 'Clause not found'}
+        return 200, {
             'is_published': clause.is_published,
             'committee': clause.committee,
             'country': clause.country
-        }), 200
+        }
+
+    try:
+        return state_response(clause_state.get(STATUS_SCOPE, clause_id, build))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/committee/<committee>/published-clause', methods=['GET'])
 def get_published_clause(committee):
-    try:
-        clause = Clause.query.filter_by(
+    def build():
+        # Only the id and version are read; the payload comes from the cache unless the clause changed
+        published = db.session.query(Clause.id, Clause.updated_at).filter_by(
             committee=committee,
             is_published=True
         ).order_by(Clause.timestamp.desc()).first()
-        
-        if clause:
-            return jsonify({
-                'id': clause.id,
-                'content': clause.html_content,
-                'country': clause.country,
-                'filename': clause.filename,
-                'timestamp': clause.timestamp.isoformat()
-            }), 200
+
+        if published:
+            cached = serialization_cache.lookup(Clause, published.id, published.updated_at, 'serialize_published')
+            if cached is None:
+                cached = serialization_cache.cached(db.session.get(Clause, published.id), 'serialize_published')
+            return 200, cached.payload
         else:
-            return jsonify({'message': 'No published clause found'}), 404
+            return 404, {'message': 'No published clause found'}
+
+    try:
+        return state_response(clause_state.get(committee.lower(), ('published', committee), build))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -839,7 +1491,7 @@ def reject_clause(clause_id):
         socketio.emit('clause_rejected', {
             'clauseId': clause.id,
             'committee': clause.committee
-        })
+        }, to=committee_room(clause.committee))
         
         return jsonify({'success': True, 'message': 'Clause rejected successfully'}), 200
     except Exception as e:
@@ -856,7 +1508,7 @@ def unpublish_clause(clause_id):
         socketio.emit('clause_unpublished', {
             'clauseId': clause.id,
             'committee': clause.committee
-        })
+        }, to=committee_room(clause.committee))
         
         return jsonify({'success': True, 'message': 'Clause unpublished successfully'}), 200
     except Exception as e:
@@ -864,27 +1516,29 @@ def unpublish_clause(clause_id):
 
 @app.route('/committee/<committee>/current-clause', methods=['GET'])
 def get_current_clause(committee):
-    try:
+    def build():
         clause = Clause.query.filter_by(
             committee=committee.lower(),
             is_published=True
         ).first()
-        
+
         if not clause:
-            return jsonify({'message': 'No published clause'}), 404
-            
+            return 404, {'message': 'No published clause'}
+
         # Find active amendment if exists
         active_amendment = Amendment.query.filter_by(
             debate_clause_id=clause.id,
             under_debate=True
         ).first()
-        
-        response_data = clause.serialize()
+
+        response_data = serialization_cache.serialize(clause)
         if active_amendment:
             response_data['active_amendment_id'] = active_amendment.id
-            
-        return jsonify(response_data), 200
-        
+        return 200, response_data
+
+    try:
+        # The clause and amendment queries run once per change, not once per poll
+        return state_response(clause_state.get(committee.lower(), 'current', build))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -901,7 +1555,7 @@ def publish_amendment(amendment_id):
         socketio.emit('amendment_published', {
             'id': amendment.id,
             'committee': amendment.committee
-        })
+        }, to=committee_room(amendment.committee))
         
         return jsonify({'message': 'Amendment published successfully'}), 200
     except Exception as e:
@@ -926,7 +1580,7 @@ def reject_amendment(amendment_id):
             'amendment_id': amendment_id,
             'committee': amendment.committee,
             'debate_clause_id': debate_clause_id  # Include clause ID for cleanup
-        })
+        }, to=committee_room(amendment.committee))
         
         return jsonify({'success': True, 'message': 'Amendment rejected and removed'}), 200
     except Exception as e:
@@ -964,7 +1618,7 @@ def approve_amendment(amendment_id):
                 'type': 'amendment_approved',
                 'amendment_id': amendment.id,
                 'clause_id': clause.id
-            })
+            }, to=committee_room(amendment.committee))
         else:
             db.session.commit()
 
@@ -975,7 +1629,7 @@ def approve_amendment(amendment_id):
             'is_published': False,
             'is_passed': True,
             'country': amendment.country
-        })
+        }, to=committee_room(amendment.committee))
 
         return jsonify({'message': 'Amendment approved successfully'}), 200
     except Exception as e:
@@ -1013,7 +1667,7 @@ def update_current_clause(committee):
             'amended_content': data['content'],     # Get amended content from request
             'committee': committee,
             'country': clause.country
-        })
+        }, to=committee_room(committee))
         return jsonify({'message': 'Amendment published successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -1050,7 +1704,7 @@ def unpublish_amendment(amendment_id):
             'amendment_id': amendment_id,
             'clause_id': debate_clause_id,
             'original_content': original_clause.html_content if original_clause else ''
-        })
+        }, to=committee_room(committee))
         
         return jsonify({'message': 'Amendment unpublished and changes reverted'}), 200
     except Exception as e:
@@ -1126,7 +1780,7 @@ def finalize_amendment(amendment_id):
             'approved': data.get('approved'),
             'new_content': clause.html_content,
             'committee': amendment.committee
-        })
+        }, to=committee_room(amendment.committee))
         
         return jsonify({'message': 'Amendment finalized successfully'}), 200
     except Exception as e:
@@ -1137,8 +1791,13 @@ def finalize_amendment(amendment_id):
 def delete_message(message_id):
     try:
         message = Message.query.get_or_404(message_id)
+        digests = [file.sha256 for file in message.files]
         db.session.delete(message)
-        db.session.commit()
+        db.session.flush()
+        # Stored files no other message uses are deleted together with the message
+        unused = release_blobs(digests)
+        with removing_blobs(app.config['CHAT_FILES'], unused):
+            db.session.commit()
         return jsonify({'message': 'Message deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -1300,4 +1959,5 @@ def update_clause_content(clause_id):
         }), 500
 
 if __name__ == '__main__':
+    # Development server with the reloader; use wsgi.py to serve a conference
     socketio.run(app,host='0.0.0.0', port=8000,debug=True)
@@ -0,0 +1,98 @@
+# archive.py
+#
+# Deleted amendments are copied into the append-only archived_amendments table. Archiving is
+# one INSERT ... SELECT in the caller's transaction, so its cost depends on the amendments
+# being deleted, not on the size of the archive, and concurrent deletions cannot lose rows.
+
+import json
+import os
+from datetime import datetime
+
+from models import db, Amendment, ArchivedAmendment
+
+# Rows fetched per round trip while streaming archive queries
+ARCHIVE_BATCH_SIZE = 500
+
+# Where the archive lived before it moved into the database (relative to the working directory)
+LEGACY_ARCHIVE_FILE = 'archived_amendments.json'
+
+
+def archive_amendments(*criteria):
+    """Copy the amendments matching criteria into the archive; the caller deletes and commits"""
+    columns = ['amendment_id', 'amendment_text', 'country', 'committee', 'clause_id',
+               'is_passed', 'is_rejected', 'timestamp', 'archived_at']
+    source = db.select(
+        Amendment.id, Amendment.amendment_text, Amendment.country, Amendment.committee,
+        Amendment.clause_id, Amendment.is_passed, Amendment.is_rejected, Amendment.timestamp,
+        db.literal(datetime.utcnow(), ArchivedAmendment.archived_at.type),
+    ).where(*criteria)
+    result = db.session.execute(ArchivedAmendment.__table__.insert().from_select(columns, source))
+    return result.rowcount
+
+
+def archive_query(committee=None, country=None, since=None, until=None):
+    """Archive rows filtered by committee, country and submission time, oldest first"""
+    query = db.select(ArchivedAmendment)
+    if committee:
+        query = query.where(ArchivedAmendment.committee == committee)
+    if country:
+        query = query.where(ArchivedAmendment.country == country)
+    if since:
+        query = query.where(ArchivedAmendment.timestamp >= since)
+    if until:
+        query = query.where(ArchivedAmendment.timestamp < until)
+    return query.order_by(ArchivedAmendment.timestamp, ArchivedAmendment.id)
+
+
+def iter_archive(query, batch_size=ARCHIVE_BATCH_SIZE):
+    """Serialized rows of an archive query, fetched batch by batch"""
+    result = db.session.execute(query.execution_options(yield_per=batch_size)).scalars()
+    for row in result:
+        yield row.serialize()
+
+
+def stream_json(rows):
+    """A JSON array produced one row at a time"""
+    yield '['
+    for index, row in enumerate(rows):
+        yield (',\n' if index else '\n') + json.dumps(row)
+    yield '\n]\n'
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def import_legacy_archive(path=LEGACY_ARCHIVE_FILE):
+    """Copy a pre-database archived_amendments.json into the empty table; returns the row count.
+
+    Runs in the caller's transaction. Once the table has rows the file is ignored, so it is
+    imported exactly once and can be deleted afterwards.
+    """
+    if not os.path.exists(path) or db.session.query(ArchivedAmendment.id).first() is not None:
+        return 0
+    with open(path, 'r') as file:
+        archived_data = json.load(file)
+    if not archived_data:
+        return 0
+
+    def parse_timestamp(value):
+        try:
+            return datetime.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+
+    archived_at = datetime.utcnow()
+    db.session.execute(ArchivedAmendment.__table__.insert(), [
+        {
+            'amendment_id': entry.get('id'),
+            'amendment_text': entry.get('amendment_text') or '',
+            'country': entry.get('country') or '',
+            'committee': entry.get('committee') or '',
+            'timestamp': parse_timestamp(entry.get('timestamp')),
+            'archived_at': archived_at,
+        }
+        for entry in archived_data
+    ])
+    return len(archived_data)
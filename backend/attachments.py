@@ -0,0 +1,185 @@
+# attachments.py
+#
+# Chat attachments are stored once per content, under the SHA-256 of their bytes
+# (CHAT_FILES/<digest>), and linked as /chatfiles/<digest>/<filename>. A digest always names
+# the same bytes, so those URLs can be cached by clients forever; the filename part only sets
+# the download name.
+#
+# Every stored file has a Blob row counting the File rows that use it. Uploads are hashed
+# while werkzeug receives them (HashingRequest), so a file is written to disk exactly once and
+# never held in memory whole. A client that already knows the digest of a stored file can
+# reference it instead of sending the bytes again (see GET /blobs/<digest>), as long as the
+# file is already attached to a message they sent or that was sent to one of their groups. A
+# digest alone never reveals whether anyone else uploaded that content. When the last File
+# using a blob is deleted, the blob and its thumbnail are removed.
+#
+# Ordering: adding a reference and removing a blob both write the blob's row before touching
+# the disk, and keep that row locked until commit. A blob's file therefore cannot be removed
+# by one request while another one is starting to use it.
+
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import Request, current_app
+from sqlalchemy.dialects import postgresql, sqlite
+
+from conversion import hash_file
+from models import db, Blob, File, Message, delegate_group
+from thumbnails import thumbnail_name
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Content-addressed downloads never change; a year is the longest max-age caches honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def is_digest(value):
+    return bool(DIGEST_PATTERN.match(value or ''))
+
+
+class HashingFile:
+    """A temporary file in the chat files folder that hashes what is written to it"""
+
+    def __init__(self, folder):
+        self.file = tempfile.NamedTemporaryFile(dir=folder, prefix='.upload-')
+        self.name = self.file.name
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, flush, close, ... go to the temporary file
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+class HashingRequest(Request):
+    """Receives file uploads straight into the chat files folder, hashing them on the way.
+
+    Installed as app.request_class. The temporary file is deleted when the request is closed;
+    store_upload links it into the store first.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(current_app.config['CHAT_FILES'])
+
+
+def _increment(digest, size):
+    """Add one reference to the digest's Blob row, creating the row if needed"""
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    statement = insert(Blob).values(sha256=digest, size=size, ref_count=1, created_at=datetime.utcnow())
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[Blob.sha256], set_={'ref_count': Blob.ref_count + 1}))
+
+
+def store_upload(upload, folder):
+    """Store an uploaded FileStorage and reference its blob; returns (digest, path, size, created).
+
+    created is False when the same content was already stored. Runs in the caller's
+    transaction; the caller commits.
+    """
+    stream = upload.stream
+    if isinstance(stream, HashingFile):
+        stream.flush()
+        digest, size, source = stream.hexdigest(), stream.size, stream.name
+    else:
+        # Uploads that did not come through HashingRequest (e.g. from scripts)
+        source = os.path.join(folder, f'.upload-{uuid.uuid4().hex}')
+        upload.save(source)
+        digest = hash_file(source)
+        size = os.path.getsize(source)
+
+    _increment(digest, size)
+    path = os.path.join(folder, digest)
+    created = not os.path.exists(path)
+    try:
+        if created:
+            os.link(source, path)
+    except FileExistsError:
+        created = False
+    finally:
+        if not isinstance(stream, HashingFile):
+            os.remove(source)
+    return digest, path, size, created
+
+
+def _visible_to(digest, delegate_id):
+    """Whether the blob is attached to a message the delegate sent or can read in a group"""
+    try:
+        delegate_id = int(delegate_id)
+    except (TypeError, ValueError):
+        return db.false()
+    groups = db.select(delegate_group.c.group_id).where(delegate_group.c.delegate_id == delegate_id)
+    return db.select(File.id).join(Message, File.message_id == Message.id).where(
+        File.sha256 == digest,
+        db.or_(Message.sender_id == delegate_id, Message.group_id.in_(groups)),
+    ).exists()
+
+
+def visible_blob(digest, delegate_id):
+    """The stored blob, if the delegate can already see a file with this content, else None"""
+    return Blob.query.filter(Blob.sha256 == digest, Blob.ref_count > 0, _visible_to(digest, delegate_id)).first()
+
+
+def reference_blob(digest, delegate_id):
+    """Add a reference to a stored blob the delegate can see; returns its size, or None if it is
+    not stored or not theirs to reference"""
+    result = db.session.execute(
+        db.update(Blob).where(Blob.sha256 == digest, Blob.ref_count > 0, _visible_to(digest, delegate_id))
+        .values(ref_count=Blob.ref_count + 1)
+        .returning(Blob.size)
+    ).first()
+    return result.size if result else None
+
+
+def release_blobs(digests):
+    """Drop one reference per digest (repeats allowed); returns the digests no longer used.
+
+    The caller removes those with removing_blobs() around its commit.
+    """
+    counts = Counter(digest for digest in digests if digest)
+    if not counts:
+        return []
+    for digest, count in counts.items():
+        db.session.execute(db.update(Blob).where(Blob.sha256 == digest)
+                           .values(ref_count=Blob.ref_count - count))
+    return db.session.execute(
+        db.delete(Blob).where(Blob.sha256.in_(list(counts)), Blob.ref_count <= 0).returning(Blob.sha256)
+    ).scalars().all()
+
+
+@contextmanager
+def removing_blobs(folder, digests):
+    """Delete the blobs' files if the block (the commit) succeeds, keep them if it raises"""
+    moved = []
+    try:
+        for digest in digests:
+            for name in (digest, thumbnail_name(digest)):
+                path = os.path.join(folder, name)
+                if os.path.exists(path):
+                    trash = os.path.join(folder, f'.deleted-{uuid.uuid4().hex}')
+                    os.replace(path, trash)
+                    moved.append((path, trash))
+        yield
+    except BaseException:
+        for path, trash in moved:
+            os.replace(trash, path)
+        raise
+    for _, trash in moved:
+        os.remove(trash)
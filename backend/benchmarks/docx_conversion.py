@@ -0,0 +1,159 @@
+# benchmarks/docx_conversion.py
+#
+# Compares the in-process DOCX converter (docx_html.py) with pandoc on a corpus of
+# resolutions. Without --corpus a synthetic corpus of 2-5 page resolutions is generated:
+# preambulatory clauses, multi-level operative clauses and the odd table, with a few
+# documents containing merged table cells to exercise the pandoc fallback.
+#
+#   python benchmarks/docx_conversion.py --documents 20 --repeat 3
+#   python benchmarks/docx_conversion.py --corpus path/to/resolutions
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pypandoc
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import docx_html
+from conversion import PANDOC_ARGS
+from stats import summarize
+
+PREAMBULATORY = ['Recalling', 'Noting with concern', 'Recognizing', 'Deeply disturbed by', 'Affirming',
+                 'Bearing in mind', 'Welcoming', 'Alarmed by', 'Emphasizing', 'Guided by']
+OPERATIVE = ['Calls upon', 'Urges', 'Encourages', 'Requests', 'Decides', 'Recommends', 'Supports',
+             'Further invites', 'Designates', 'Expresses its hope']
+FILLER = ('member states to strengthen regional cooperation on the implementation of existing '
+          'frameworks, with particular attention to transparency, capacity building and the '
+          'participation of civil society organisations in monitoring progress')
+
+# Four-level clause numbering: 1. / a. / i. / A.
+RESOLUTION_LIST = (
+    '<w:abstractNum {ns} w:abstractNumId="90">'
+    + ''.join(
+        f'<w:lvl w:ilvl="{level}"><w:start w:val="1"/><w:numFmt w:val="{fmt}"/>'
+        f'<w:lvlText w:val="%{level + 1}."/></w:lvl>'
+        for level, fmt in enumerate(['decimal', 'lowerLetter', 'lowerRoman', 'upperLetter'])
+    )
+    + '</w:abstractNum>'
+)
+
+
+def _add_resolution_numbering(document):
+    numbering = document.part.numbering_part.element
+    numbering.insert(0, parse_xml(RESOLUTION_LIST.format(ns=nsdecls('w'))))
+    numbering.append(parse_xml(f'<w:num {nsdecls("w")} w:numId="90"><w:abstractNumId w:val="90"/></w:num>'))
+    return 90
+
+
+def _list_paragraph(document, num_id, level, lead, text):
+    paragraph = document.add_paragraph()
+    paragraph._p.get_or_add_pPr().append(parse_xml(
+        f'<w:numPr {nsdecls("w")}><w:ilvl w:val="{level}"/><w:numId w:val="{num_id}"/></w:numPr>'
+    ))
+    paragraph.add_run(lead).underline = True
+    paragraph.add_run(f' {text};')
+    return paragraph
+
+
+def generate_resolution(path, rng, with_merged_cells=False):
+    document = Document()
+    num_id = _add_resolution_numbering(document)
+
+    document.add_heading('Draft Resolution', level=1)
+    for label in ('Committee', 'Topic', 'Main submitter'):
+        paragraph = document.add_paragraph()
+        paragraph.add_run(f'{label}: ').bold = True
+        paragraph.add_run(rng.choice(['Security Council', 'Junior', 'Senior', 'Kenya', 'Japan']))
+
+    for _ in range(rng.randint(6, 14)):
+        paragraph = document.add_paragraph()
+        paragraph.add_run(rng.choice(PREAMBULATORY)).italic = True
+        paragraph.add_run(f' the efforts of {FILLER},')
+
+    for _ in range(rng.randint(8, 20)):
+        _list_paragraph(document, num_id, 0, rng.choice(OPERATIVE), FILLER)
+        for _ in range(rng.randint(0, 4)):
+            _list_paragraph(document, num_id, 1, 'such as', FILLER[:rng.randint(40, len(FILLER))])
+            for _ in range(rng.randint(0, 2)):
+                _list_paragraph(document, num_id, 2, 'including', FILLER[:rng.randint(30, 90)])
+
+    if rng.random() < 0.4 or with_merged_cells:
+        table = document.add_table(rows=4, cols=3)
+        for row in table.rows:
+            for cell in row.cells:
+                cell.text = rng.choice(['Funding', 'Timeline', 'Oversight', '2026', 'UNDP', 'Annual'])
+        if with_merged_cells:
+            table.cell(0, 0).merge(table.cell(0, 1))
+
+    document.add_paragraph('Decides to remain actively seized of the matter.')
+    document.save(path)
+
+
+def generate_corpus(folder, count, seed):
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f'resolution_{index:03d}.docx')
+        # Roughly one document in ten needs the pandoc fallback
+        generate_resolution(path, rng, with_merged_cells=index % 10 == 9)
+        paths.append(path)
+    return paths
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def run(paths, repeat):
+    native_times, pandoc_times, fallbacks = [], [], []
+    for path in paths:
+        for _ in range(repeat):
+            pandoc_times.append(timed(pypandoc.convert_file, path, 'html', format='docx', extra_args=PANDOC_ARGS))
+            try:
+                native_times.append(timed(docx_html.convert, path))
+            except docx_html.UnsupportedDocument as e:
+                fallbacks.append({'document': os.path.basename(path), 'reason': str(e)})
+                break
+
+    native, pandoc = summarize(native_times), summarize(pandoc_times)
+    return {
+        'documents': len(paths),
+        'repeat': repeat,
+        'native_coverage': round(1 - len(fallbacks) / len(paths), 3) if paths else None,
+        'native': native,
+        'pandoc': pandoc,
+        'speedup_p50': round(pandoc['p50_ms'] / native['p50_ms'], 1) if native_times and pandoc_times else None,
+        'fallbacks': fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Native DOCX converter vs pandoc')
+    parser.add_argument('--corpus', help='folder of .docx files (default: generate a synthetic corpus)')
+    parser.add_argument('--documents', type=int, default=20, help='size of the generated corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='conversions per document and path')
+    parser.add_argument('--seed', type=int, default=2025)
+    args = parser.parse_args()
+
+    if args.corpus:
+        print(json.dumps(run(sorted(glob.glob(os.path.join(args.corpus, '*.docx'))), args.repeat), indent=2))
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(json.dumps(run(generate_corpus(folder, args.documents, args.seed), args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+# benchmarks/load_suite.py
+#
+# End-to-end load test. `seed` builds a conference-sized database: the roster (committees and
+# delegates) goes through initialize_db like a real one, then caucus groups, chat history,
+# clauses and amendments are bulk-inserted. `run` drives a running server over HTTP and
+# Socket.IO with a mix of virtual delegates and reports latency percentiles and throughput per
+# action as JSON, tagged with the current commit so runs can be compared over time.
+#
+#   python benchmarks/load_suite.py seed --database /tmp/spimun_load.db
+#   DATABASE_URL=sqlite:////tmp/spimun_load.db python wsgi.py
+#   python benchmarks/load_suite.py run --url http://127.0.0.1:8000 --users 50 --duration 60 \
+#       --output results/$(git rev-parse --short HEAD).json
+#
+# The defaults are 5 committees, 400 delegates, 2,000 groups and 200,000 messages. Seeding is
+# deterministic for a given --seed. Needs the asyncio client extras for `run`:
+# pip install -r benchmarks/requirements.txt
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stats import summarize
+
+COMMITTEES = ['junior', 'senior', 'security council', 'general assembly', 'human rights council']
+COUNTRIES = ['USA', 'UK', 'France', 'China', 'Russia', 'Germany', 'Japan', 'India', 'Brazil', 'Canada',
+             'Mexico', 'Egypt', 'Nigeria', 'Kenya', 'Australia', 'Indonesia', 'Turkey', 'Italy', 'Spain',
+             'Argentina', 'Chile', 'Norway', 'Sweden', 'Poland', 'Vietnam']
+
+SEARCH_TERMS = ['clause', 'amendment', 'agreed', 'vote', 'draft', 'meet session', '"calls upon"', 'urg']
+
+# Relative frequency of each action a virtual delegate takes
+DEFAULT_MIX = 'history=4,searchgroup=1,post=2,socket=2,amendments=1,search=1,upload=0.1'
+
+INSERT_BATCH_SIZE = 10000
+
+
+# --- seed ---------------------------------------------------------------------------------
+
+def build_roster(committees, delegates):
+    names = COMMITTEES[:committees] + [f'committee {index}' for index in range(len(COMMITTEES), committees)]
+    return {
+        'committees': [{'name': name} for name in names],
+        'delegates': [
+            {'name': f'Delegate {index:04d}', 'country': COUNTRIES[index % len(COUNTRIES)],
+             'committee': names[index % len(names)]}
+            for index in range(delegates)
+        ],
+    }
+
+
+def seed(args):
+    from flask import Flask
+    from database import init_database
+    from initialize_db import initialize_database
+    from models import db, Amendment, Clause, Delegate, Group, Message, delegate_group
+    from search import rebuild_search_index
+
+    url = args.database_url or f'sqlite:///{os.path.abspath(args.database)}'
+    if url.startswith('sqlite:///') and os.path.exists(args.database or ''):
+        if not args.force:
+            sys.exit(f'{args.database} exists; pass --force to replace it')
+        os.remove(args.database)
+
+    rng = random.Random(args.seed)
+    app = Flask('load_suite')
+    init_database(app, url)
+    started = time.perf_counter()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as roster_file:
+        json.dump(build_roster(args.committees, args.delegates), roster_file)
+    try:
+        with app.app_context():
+            if not initialize_database(roster_file.name):
+                sys.exit('The database is already seeded; seed an empty database')
+    finally:
+        os.remove(roster_file.name)
+
+    with app.app_context():
+        delegates = db.session.query(Delegate.id, Delegate.committee, Delegate.country)\
+            .filter(Delegate.country != 'Chair').all()
+        by_committee = {}
+        for delegate in delegates:
+            by_committee.setdefault(delegate.committee, []).append(delegate)
+
+        # Caucus groups, mostly within one committee, 3 to 15 members
+        first_group = (db.session.query(db.func.max(Group.id)).scalar() or 0) + 1
+        db.session.execute(Group.__table__.insert(), [{'name': f'Caucus {index}'} for index in range(args.groups)])
+        group_ids = list(range(first_group, first_group + args.groups))
+        members = {}
+        memberships = []
+        for group_id in group_ids:
+            pool = by_committee[rng.choice(list(by_committee))]
+            chosen = rng.sample(pool, min(len(pool), rng.randint(3, 15)))
+            if rng.random() < 0.2:
+                chosen.append(rng.choice(delegates))
+            members[group_id] = sorted({delegate.id for delegate in chosen})
+            memberships += [{'delegate_id': delegate_id, 'group_id': group_id} for delegate_id in members[group_id]]
+        db.session.execute(delegate_group.insert(), memberships)
+
+        # Chat history: a few busy rooms and a long tail, spread over three conference days
+        cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 0.8 for rank in range(len(group_ids))))
+        start = datetime(2026, 3, 1, 8, 0)
+        rows = []
+        for index in range(args.messages):
+            group_id = rng.choices(group_ids, cum_weights=cum_weights)[0]
+            created_at = start + timedelta(seconds=index * (3 * 24 * 3600) / max(args.messages, 1))
+            rows.append({
+                'text': f'Message {index} ' + rng.choice(['on the draft', 'about clause 3', 'agreed', 'vote yes?',
+                                                          'see the amendment', 'meet after session']),
+                'sender_id': rng.choice(members[group_id]),
+                'group_id': group_id,
+                'timestamp': created_at.strftime('%H:%M'),
+                'date': created_at.strftime('%Y-%m-%d'),
+                'created_at': created_at,
+            })
+            if len(rows) >= INSERT_BATCH_SIZE:
+                db.session.execute(Message.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(Message.__table__.insert(), rows)
+
+        # Clauses (one published per committee) and amendments against them
+        clause_ids = {}
+        for committee in by_committee:
+            for index in range(args.clauses):
+                clause = Clause(committee=committee, country=rng.choice(COUNTRIES), filename=f'clause{index}.docx',
+                                html_content=f'<p>{committee} clause {index}</p>' * 20, is_published=index == 0)
+                db.session.add(clause)
+                db.session.flush()
+                clause_ids.setdefault(committee, []).append(clause.id)
+        db.session.execute(Amendment.__table__.insert(), [
+            {
+                'amendment_text': f'Amendment {index}: strike "{rng.choice(["calls upon", "urges", "decides"])}"',
+                'country': delegate.country,
+                'committee': delegate.committee,
+                'clause_id': rng.choice(clause_ids[delegate.committee]),
+                'timestamp': start + timedelta(seconds=rng.randint(0, 3 * 24 * 3600)),
+                'is_published': False, 'is_rejected': False, 'is_passed': False,
+                'amended_clause': '', 'under_debate': False,
+            }
+            for index, delegate in ((index, rng.choice(delegates)) for index in range(args.amendments))
+        ])
+        # Core inserts bypass the session hooks that keep the search index current
+        indexed = rebuild_search_index(db.session)
+        db.session.commit()
+
+    print(json.dumps({
+        'database': url,
+        'committees': args.committees,
+        'delegates': len(delegates),
+        'groups': args.groups,
+        'memberships': len(memberships),
+        'messages': args.messages,
+        'amendments': args.amendments,
+        'search_documents': indexed,
+        'seconds': round(time.perf_counter() - started, 1),
+    }, indent=2))
+
+
+# --- run ----------------------------------------------------------------------------------
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def sample_docx():
+    import docx
+    document = docx.Document()
+    document.add_paragraph('The General Assembly,')
+    for index in range(1, 6):
+        document.add_paragraph(f'{index}. Calls upon all member states to consider item {index};')
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, action, seconds, ok=True, error=None):
+        if ok:
+            self.latencies.setdefault(action, []).append(seconds)
+        else:
+            self.errors.setdefault(action, []).append(error)
+
+    async def time(self, action, coroutine):
+        started = time.perf_counter()
+        try:
+            result = await coroutine
+        except Exception as e:
+            self.record(action, 0, ok=False, error=f'{type(e).__name__}: {e}')
+            return None
+        self.record(action, time.perf_counter() - started)
+        return result
+
+
+async def http_json(session, method, url, expect=(200, 201, 202), **kwargs):
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.read()
+        if response.status not in expect:
+            raise RuntimeError(f'{method} {url} -> {response.status}')
+        return response.headers, (json.loads(body) if body else None)
+
+
+class VirtualDelegate:
+    def __init__(self, args, session, recorder, delegate, docx_bytes, rng):
+        self.args, self.session, self.recorder = args, session, recorder
+        self.delegate, self.docx_bytes, self.rng = delegate, docx_bytes, rng
+        self.groups = []
+        self.socket = None
+
+    async def connect(self):
+        import socketio
+        _, groups = await http_json(self.session, 'GET', f'{self.args.url}/searchgroup/{self.delegate["id"]}')
+        self.groups = [group['id'] for group in groups if group['id'] != 1] or [1]
+        if self.args.sockets:
+            self.socket = socketio.AsyncClient(reconnection=False)
+            await self.socket.connect(self.args.url, namespaces=['/chatsocket'], transports=['websocket'])
+            for group_id in self.groups[:10]:
+                await self.socket.emit('join_room', {'roomId': group_id}, namespace='/chatsocket')
+
+    async def history(self):
+        group_id = self.rng.choice(self.groups)
+        headers, _ = await http_json(self.session, 'GET', f'{self.args.url}/groups/{group_id}/messages')
+        # Scroll back a page now and then
+        if headers.get('X-Has-More') == 'true' and self.rng.random() < 0.3:
+            await http_json(self.session, 'GET', f'{self.args.url}/groups/{group_id}/messages',
+                            params={'before_id': headers['X-Next-Cursor']})
+
+    async def searchgroup(self):
+        await http_json(self.session, 'GET', f'{self.args.url}/searchgroup/{self.delegate["id"]}')
+
+    async def post(self):
+        import aiohttp
+        form = aiohttp.FormData()
+        form.add_field('content', f'load test {time.time()}')
+        form.add_field('roomId', str(self.rng.choice(self.groups)))
+        form.add_field('senderId', str(self.delegate['id']))
+        form.add_field('timestamp', time.strftime('%H:%M'))
+        form.add_field('date', time.strftime('%Y-%m-%d'))
+        await http_json(self.session, 'POST', f'{self.args.url}/messages', data=form)
+
+    async def socket_send(self):
+        if self.socket is None:
+            raise RuntimeError('sockets disabled')
+        ack = await self.socket.call('send_message', {
+            'roomId': self.rng.choice(self.groups), 'senderId': self.delegate['id'],
+            'content': f'load test {time.time()}',
+        }, namespace='/chatsocket', timeout=30)
+        if not ack or not ack.get('ok'):
+            raise RuntimeError(f'send_message failed: {ack}')
+
+    async def amendments(self):
+        await http_json(self.session, 'GET', f'{self.args.url}/amendments',
+                        params={'committee': self.delegate['committee']})
+
+    async def search(self):
+        await http_json(self.session, 'GET', f'{self.args.url}/search', params={
+            'q': self.rng.choice(SEARCH_TERMS), 'committee': self.delegate['committee'],
+            'delegate_id': self.delegate['id'],
+        })
+
+    async def upload(self):
+        import aiohttp
+        form = aiohttp.FormData()
+        form.add_field('file', self.docx_bytes, filename=f'load_{self.rng.randint(0, 10**9)}.docx',
+                       content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+        await http_json(self.session, 'POST', f'{self.args.url}/upload/{self.delegate["committee"]}',
+                        data=form, headers={'X-Country': self.delegate['country']})
+
+    async def act(self, deadline, actions, weights):
+        handlers = {'history': self.history, 'searchgroup': self.searchgroup, 'post': self.post,
+                    'socket': self.socket_send, 'amendments': self.amendments, 'search': self.search,
+                    'upload': self.upload}
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            await self.recorder.time(action, handlers[action]())
+            if self.args.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.disconnect()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(args):
+    import aiohttp
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    if not args.sockets:
+        mix.pop('socket', None)
+    actions, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+
+    connector = aiohttp.TCPConnector(limit=args.users * 2)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        _, delegates = await http_json(session, 'GET', f'{args.url}/delegates')
+        delegates = [delegate for delegate in delegates if delegate.get('country') != 'Chair']
+        docx_bytes = sample_docx() if 'upload' in mix else None
+        users = [VirtualDelegate(args, session, recorder, rng.choice(delegates), docx_bytes,
+                                 random.Random(rng.random())) for _ in range(args.users)]
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.ramp)
+
+        async def connect(user):
+            async with semaphore:
+                await recorder.time('connect', user.connect())
+
+        await asyncio.gather(*[connect(user) for user in users])
+        connect_wall = time.perf_counter() - started
+
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[user.act(deadline, actions, weights) for user in users if user.groups])
+        wall = time.perf_counter() - started
+        await asyncio.gather(*[user.close() for user in users], return_exceptions=True)
+
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'url': args.url,
+        'users': args.users,
+        'sockets': args.sockets,
+        'duration_s': round(wall, 2),
+        'connect_wall_s': round(connect_wall, 2),
+        'mix': mix,
+        'total_requests': sum(len(values) for name, values in recorder.latencies.items() if name != 'connect'),
+        'actions': {},
+    }
+    report['throughput_per_s'] = round(report['total_requests'] / wall, 1) if wall else None
+    for action in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = recorder.latencies.get(action, [])
+        errors = recorder.errors.get(action, [])
+        report['actions'][action] = dict(
+            summarize(latencies),
+            throughput_per_s=round(len(latencies) / wall, 1) if wall and action != 'connect' else None,
+            errors=len(errors),
+            first_errors=sorted(set(errors))[:3],
+        )
+    return report
+
+
+def run(args):
+    report = asyncio.run(run_load(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conference-scale seed data and end-to-end load test')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='build a conference-sized database')
+    seed_parser.add_argument('--database', default='spimun_load.db', help='SQLite file to create')
+    seed_parser.add_argument('--database-url', help='seed this (empty) database instead, e.g. postgresql://...')
+    seed_parser.add_argument('--force', action='store_true', help='replace an existing SQLite file')
+    seed_parser.add_argument('--committees', type=int, default=5)
+    seed_parser.add_argument('--delegates', type=int, default=400)
+    seed_parser.add_argument('--groups', type=int, default=2000)
+    seed_parser.add_argument('--messages', type=int, default=200000)
+    seed_parser.add_argument('--clauses', type=int, default=10, help='clauses per committee')
+    seed_parser.add_argument('--amendments', type=int, default=2000)
+    seed_parser.add_argument('--seed', type=int, default=1)
+    seed_parser.set_defaults(handler=seed)
+
+    run_parser = commands.add_parser('run', help='drive a running server and report latencies')
+    run_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--users', type=int, default=50, help='concurrent virtual delegates')
+    run_parser.add_argument('--duration', type=float, default=30, help='seconds of load after connecting')
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help='action=weight list')
+    run_parser.add_argument('--think', type=float, default=0.0, help='mean seconds between a user\'s actions')
+    run_parser.add_argument('--no-sockets', dest='sockets', action='store_false',
+                            help='HTTP only; drops the socket action from the mix')
+    run_parser.add_argument('--ramp', type=int, default=25, help='users connecting in parallel')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='also write the JSON report to this file')
+    run_parser.set_defaults(handler=run)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# benchmarks/query_plans.py
+#
+# Runs EXPLAIN QUERY PLAN (SQLite) for the queries behind the hot endpoints against a fresh
+# schema built from models.py, and exits non-zero if any of them falls back to a full table
+# scan or a temporary sort. Run it after changing models or those queries:
+#
+#   python benchmarks/query_plans.py
+
+import os
+import sys
+
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.dialects import sqlite
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import db, Amendment, ArchivedAmendment, Clause, Delegate, File, Group, Message, UnreadCount, delegate_group
+
+# (endpoint, query); the queries mirror the ones in app.py
+HOT_QUERIES = [
+    ('GET /groups/<id>/messages',
+     db.select(Message).where(Message.group_id == 2, Message.id < 1000)
+     .order_by(Message.id.desc()).limit(51)),
+    ('GET /groups/<id>/messages?after_id',
+     db.select(Message).where(Message.group_id == 2, Message.id > 1000)
+     .order_by(Message.id.asc()).limit(51)),
+    ('GET /searchgroup/<id> groups',
+     db.select(Group).join(delegate_group, delegate_group.c.group_id == Group.id)
+     .where(delegate_group.c.delegate_id == 7)),
+    ('GET /searchgroup/<id> members',
+     db.select(delegate_group.c.delegate_id).where(delegate_group.c.group_id.in_([2, 3, 4]))),
+    ('GET /searchgroup/<id> last messages',
+     db.select(Message.group_id, db.func.max(Message.id))
+     .where(Message.group_id.in_([2, 3, 4])).group_by(Message.group_id)),
+    ('GET /searchgroup/<id> files',
+     db.select(File).where(File.message_id.in_([10, 11, 12]))),
+    ('count_unread',
+     db.select(Message.group_id, db.func.count(Message.id))
+     .outerjoin(UnreadCount, db.and_(UnreadCount.group_id == Message.group_id, UnreadCount.user_id == 7))
+     .where(Message.group_id.in_([2, 3, 4]),
+            Message.id > db.func.coalesce(UnreadCount.last_read_message_id, 0),
+            Message.sender_id != 7, Message.group_id != 1)
+     .group_by(Message.group_id)),
+    ('POST /unread/<user>/<group>',
+     db.select(Message.id).where(Message.group_id == 2, Message.sender_id != 7)
+     .order_by(Message.id.desc()).offset(4).limit(1)),
+    ('GET /unread/<user>/<group>',
+     db.select(UnreadCount).where(UnreadCount.user_id == 7, UnreadCount.group_id == 2)),
+    ('GET /amendments',
+     db.select(Amendment).where(Amendment.committee == 'junior').order_by(Amendment.timestamp.desc())),
+    ('GET /committee/<c>/current-clause amendment',
+     db.select(Amendment).where(Amendment.debate_clause_id == 3, Amendment.under_debate.is_(True))),
+    ('GET /clauses',
+     db.select(Clause).where(Clause.committee == 'junior').order_by(Clause.timestamp.desc())),
+    ('GET /committee/<c>/published-clause',
+     db.select(Clause.id, Clause.updated_at).where(Clause.committee == 'junior', Clause.is_published.is_(True))
+     .order_by(Clause.timestamp.desc()).limit(1)),
+    ('GET /amendments/archive?committee',
+     db.select(ArchivedAmendment).where(ArchivedAmendment.committee == 'junior')
+     .order_by(ArchivedAmendment.timestamp, ArchivedAmendment.id)),
+    ('GET /amendments/archive?country&from',
+     db.select(ArchivedAmendment).where(ArchivedAmendment.country == 'UK',
+                                        ArchivedAmendment.timestamp >= '2026-01-01')
+     .order_by(ArchivedAmendment.timestamp, ArchivedAmendment.id)),
+    ('POST /login',
+     db.select(Delegate).where(Delegate.name == 'Alice Junior', Delegate.country == 'USA')),
+]
+
+
+def plan_problems(plan):
+    """Full scans and temporary sorts in an EXPLAIN QUERY PLAN result"""
+    problems = []
+    for row in plan:
+        detail = row[-1]
+        if detail.startswith('SCAN ') and ' INDEX ' not in detail:
+            problems.append(detail)
+        elif 'USE TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def main():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        for endpoint, query in HOT_QUERIES:
+            sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+            plan = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+            problems = plan_problems(plan)
+            print(f"{'FAIL' if problems else 'ok  '}  {endpoint}")
+            for row in plan:
+                print(f"        {row[-1]}")
+            failures += bool(problems)
+
+    if failures:
+        print(f"{failures} hot queries need a full scan or a temporary sort")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# benchmarks/socket_load.py
+#
+# Socket load script: connects a room full of delegates to /chatsocket, sends chat messages
+# through POST /messages (or the socket's send_message event with --send socket) and measures
+# how long each new_message broadcast takes to reach every client.
+#
+#   python benchmarks/socket_load.py --url http://127.0.0.1:8000 --clients 500 --messages 50
+#   python benchmarks/socket_load.py --send socket --interval 0 --messages 2000
+#
+# Needs the asyncio client extras: pip install -r benchmarks/requirements.txt
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import aiohttp
+import socketio
+
+from stats import summarize
+
+
+async def connect_client(url, room_id, arrivals, connect_times, semaphore):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on('new_message', namespace='/chatsocket')
+    async def on_new_message(data, meta=None):
+        arrivals.setdefault(data.get('text'), []).append(time.perf_counter())
+
+    async with semaphore:
+        started = time.perf_counter()
+        await client.connect(url, namespaces=['/chatsocket'], transports=['websocket'])
+        await client.emit('join_room', {'roomId': room_id}, namespace='/chatsocket')
+        connect_times.append(time.perf_counter() - started)
+    return client
+
+
+async def run(args):
+    arrivals = {}
+    connect_times = []
+    semaphore = asyncio.Semaphore(args.ramp)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *[connect_client(args.url, args.room, arrivals, connect_times, semaphore) for _ in range(args.clients)],
+        return_exceptions=True
+    )
+    clients = [client for client in results if not isinstance(client, Exception)]
+    connect_wall = time.perf_counter() - started
+
+    # Let the join_room events settle before measuring broadcasts
+    await asyncio.sleep(1)
+
+    sent = {}
+    send_times = []
+    started_sending = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        async def send_http(token):
+            form = aiohttp.FormData()
+            form.add_field('content', token)
+            form.add_field('roomId', str(args.room))
+            form.add_field('senderId', str(args.sender_id))
+            form.add_field('timestamp', time.strftime('%H:%M'))
+            form.add_field('date', time.strftime('%Y-%m-%d'))
+            async with session.post(f"{args.url}/messages", data=form) as response:
+                await response.read()
+
+        async def send_socket(token):
+            # Each sender is one of the connected clients; the ack arrives once the batch is stored
+            sender = clients[len(sent) % len(clients)]
+            await sender.call('send_message', {'roomId': args.room, 'senderId': args.sender_id,
+                                               'content': token}, namespace='/chatsocket')
+
+        send = send_socket if args.send == 'socket' else send_http
+
+        async def send_one():
+            token = f"load-{uuid.uuid4().hex}"
+            sent[token] = time.perf_counter()
+            await send(token)
+            send_times.append(time.perf_counter() - sent[token])
+
+        # --concurrency senders at a time; an interval of 0 makes a burst
+        pending = set()
+        for _ in range(args.messages):
+            pending.add(asyncio.ensure_future(send_one()))
+            if len(pending) >= args.concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            await asyncio.sleep(args.interval)
+        if pending:
+            await asyncio.wait(pending)
+        send_wall = time.perf_counter() - started_sending
+
+    # Wait for stragglers
+    await asyncio.sleep(args.drain)
+
+    latencies = [arrival - sent[token] for token, times in arrivals.items() if token in sent for arrival in times]
+    expected = len(clients) * len(sent)
+
+    await asyncio.gather(*[client.disconnect() for client in clients], return_exceptions=True)
+
+    return {
+        'clients_requested': args.clients,
+        'clients_connected': len(clients),
+        'connect_wall_s': round(connect_wall, 2),
+        'connect': summarize(connect_times),
+        'messages_sent': len(sent),
+        'send_path': args.send,
+        'send': summarize(send_times),
+        'send_rate_per_s': round(len(sent) / send_wall, 1) if send_wall else None,
+        'emit_latency': summarize(latencies),
+        'deliveries': len(latencies),
+        'delivery_ratio': round(len(latencies) / expected, 4) if expected else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket connection and emit-latency load test')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--clients', type=int, default=500, help='concurrent socket connections')
+    parser.add_argument('--room', type=int, default=2, help='group id every client joins')
+    parser.add_argument('--sender-id', type=int, default=4, help='delegate id the messages are sent as')
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.1, help='seconds between sends')
+    parser.add_argument('--send', choices=['http', 'socket'], default='http',
+                        help='POST /messages or the send_message socket event')
+    parser.add_argument('--concurrency', type=int, default=1, help='sends in flight at once')
+    parser.add_argument('--ramp', type=int, default=50, help='connections opened in parallel')
+    parser.add_argument('--drain', type=float, default=2.0, help='seconds to wait for late deliveries')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# benchmarks/stats.py
+#
+# Latency summaries shared by the benchmark scripts.
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    """p50/p95/p99/max in milliseconds for durations given in seconds"""
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 2) if values else None,
+        'p95_ms': round(percentile(values, 0.95) * 1000, 2) if values else None,
+        'p99_ms': round(percentile(values, 0.99) * 1000, 2) if values else None,
+        'max_ms': round(max(values) * 1000, 2) if values else None,
+    }
@@ -0,0 +1,45 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LRUCache.get on a miss, since None and '' are valid cached values
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with an optional time-to-live per entry"""
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=MISSING):
+        """Drop one key, or everything when called without one"""
+        with self._lock:
+            if key is MISSING:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -0,0 +1,181 @@
+# change_log.py
+#
+# What changed since version N, for clients that missed socket events: a delegate whose
+# laptop dropped off the conference Wi-Fi catches up with one /sync request instead of
+# reloading the amendment list, the clause list, their groups and the published clause.
+#
+# Every insert, update and delete of an amendment, clause or resolution (logged under its
+# committee) and of a chat group or message (logged under the group) appends a row to
+# `changes` in the same transaction, through session hooks like the search index's. Row ids
+# are the versions. On PostgreSQL, appends take a transaction-level advisory lock so they
+# also commit in id order, and a reader never sees version N+1 before N.
+#
+# /sync answers with the current state of each entity changed after the client's version,
+# once, or a tombstone when it is gone. Log rows older than CHANGE_LOG_RETENTION seconds are
+# pruned; a client whose version predates what is left is told to reload (reset).
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from models import db, Amendment, Change, Clause, Group, Message, Resolution
+from search import committee_key
+
+CHANGE_LOG_RETENTION = float(os.environ.get('CHANGE_LOG_RETENTION', 24 * 3600))
+CHANGE_LOG_PRUNE_INTERVAL = 600  # seconds between prunes
+SYNC_PAGE_SIZE = 1000
+MAX_SYNC_PAGE_SIZE = 5000
+
+# Any constant; serializes change log appends on PostgreSQL
+_APPEND_LOCK_KEY = 0x5359_4E43
+
+# Model -> (entity name, column holding its committee or None, column holding its group)
+LOGGED_MODELS = {
+    Amendment: ('amendment', 'committee', None),
+    Clause: ('clause', 'committee', None),
+    Resolution: ('resolution', 'committee', None),
+    Group: ('group', None, 'id'),
+    Message: ('message', None, 'group_id'),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _record(model, row, deleted):
+    entity, committee_column, group_column = LOGGED_MODELS[model]
+    return {
+        'entity': entity,
+        'entity_id': row.id,
+        'committee': committee_key(getattr(row, committee_column)) if committee_column else None,
+        'group_id': getattr(row, group_column) if group_column else None,
+        'deleted': deleted,
+    }
+
+
+def install_change_hooks():
+    """Log every amendment, clause, resolution, group and message written through a session"""
+
+    def pending(session):
+        # (entity, id) -> record; a later write of the same row replaces the earlier one
+        return session.info.setdefault('change_log', {})
+
+    def add(session, record):
+        changes = pending(session)
+        key = record['entity'], record['entity_id']
+        changes.pop(key, None)
+        changes[key] = record
+
+    @event.listens_for(Session, 'after_flush')
+    def collect(session, flush_context):
+        for instances, deleted in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+            for instance in instances:
+                model = type(instance)
+                if model in LOGGED_MODELS and (deleted or instance in session.new or session.is_modified(instance)):
+                    add(session, _record(model, instance, deleted))
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def collect_bulk(state):
+        if not (state.is_update or state.is_delete) or state.bind_mapper is None:
+            return
+        model = state.bind_mapper.class_
+        if model not in LOGGED_MODELS:
+            return
+        # The rows the statement is about to change, read before it runs
+        _, committee_column, group_column = LOGGED_MODELS[model]
+        columns = [model.id] + [getattr(model, column) for column in (committee_column, group_column)
+                                if column and column != 'id']
+        query = select(*columns)
+        if state.statement.whereclause is not None:
+            query = query.where(state.statement.whereclause)
+        for row in state.session.execute(query):
+            add(state.session, _record(model, row, state.is_delete))
+
+    @event.listens_for(Session, 'before_commit')
+    def append(session):
+        session.flush()  # commit() flushes after this hook, too late to log what it writes
+        changes = session.info.pop('change_log', None)
+        if not changes:
+            return
+        connection = session.connection()
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _APPEND_LOCK_KEY})
+        now = datetime.utcnow()
+        connection.execute(Change.__table__.insert(), [dict(record, created_at=now) for record in changes.values()])
+
+    @event.listens_for(Session, 'after_rollback')
+    def forget(session):
+        session.info.pop('change_log', None)
+
+
+def current_version():
+    return db.session.query(db.func.max(Change.id)).scalar() or 0
+
+
+def changes_since(since, committee=None, group_ids=(), limit=SYNC_PAGE_SIZE):
+    """Log rows after version since for committee and group_ids.
+
+    Returns (rows, version, has_more, reset): rows in version order, the version to sync from
+    next, whether rows were left for another page, and whether since is too old (or unknown)
+    for the log to answer, in which case the client reloads everything.
+    """
+    latest = current_version()
+    oldest = db.session.query(db.func.min(Change.id)).scalar()
+    if since > latest or (oldest is not None and since < oldest - 1):
+        return [], latest, False, True
+
+    scopes = []
+    if committee:
+        scopes.append(Change.committee == committee_key(committee))
+    if group_ids:
+        scopes.append(Change.group_id.in_(list(group_ids)))
+    if not scopes:
+        return [], latest, False, False
+    rows = Change.query.filter(Change.id > since, db.or_(*scopes))\
+        .order_by(Change.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # Without more rows in scope, everything up to the latest version has been seen
+    version = rows[-1].id if has_more else max([latest] + [row.id for row in rows])
+    return rows, version, has_more, False
+
+
+def restart_change_log(session):
+    """Empty the log after the database was wiped, so every earlier version gets reset.
+
+    Ids keep growing past a marker row that is in no scope: the next /sync from any version
+    taken before the wipe falls below the log and is answered with reset, even a client that
+    was fully up to date.
+    """
+    session.info.pop('change_log', None)  # Tombstones of the wiped rows
+    latest = session.query(db.func.max(Change.id)).scalar() or 0
+    session.query(Change).delete(synchronize_session=False)
+    marker = latest + 2
+    session.execute(Change.__table__.insert().values(
+        id=marker, entity='reset', entity_id=0, deleted=True, created_at=datetime.utcnow()))
+    if session.get_bind().dialect.name == 'postgresql':
+        # An explicit id doesn't advance the sequence
+        session.execute(text("SELECT setval(pg_get_serial_sequence('changes', 'id'), :marker)"),
+                        {'marker': marker})
+
+
+def prune_changes(retention=CHANGE_LOG_RETENTION):
+    """Delete log rows older than retention seconds, always keeping the newest"""
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    latest = current_version()
+    deleted = Change.query.filter(Change.created_at < cutoff, Change.id < latest).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def run_pruner(app, sleep, interval=CHANGE_LOG_PRUNE_INTERVAL):
+    """Background loop; start it with socketio.start_background_task"""
+    while True:
+        sleep(interval)
+        try:
+            with app.app_context():
+                prune_changes()
+        except Exception:
+            logger.exception("Pruning the change log failed")
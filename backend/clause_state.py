@@ -0,0 +1,79 @@
+# clause_state.py
+#
+# Snapshots of the clause state every delegate screen polls during debate: the published
+# clause, the current clause with the amendment under debate, and the status of a clause.
+# A snapshot is the encoded response plus an ETag derived from its bytes, so a poll is a cache
+# lookup and, when nothing changed, a 304 without a body. The ETag only depends on the
+# content, so every worker hands out the same one for the same state.
+#
+# Snapshots are per committee. Writes to clauses or amendments through this worker's session
+# drop the affected snapshots right away (see serialization.listen_for_writes); writes made by
+# other workers show up after CLAUSE_STATE_TTL seconds.
+
+import hashlib
+import os
+import threading
+
+from cache import LRUCache, MISSING
+from models import Amendment, Clause
+from serialization import dumps, listen_for_writes
+
+CLAUSE_STATE_TTL = float(os.environ.get('CLAUSE_STATE_TTL', 1.0))
+
+# Scope of the per-clause status snapshots, which are not looked up by committee
+STATUS_SCOPE = object()
+
+
+class StateSnapshot:
+    __slots__ = ('status', 'body', 'etag')
+
+    def __init__(self, status, payload):
+        self.status = status
+        self.body = dumps(payload)
+        self.etag = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+
+
+class ClauseStateCache:
+    """(scope, view) -> StateSnapshot, where scope is a committee (lower case) or STATUS_SCOPE.
+
+    Invalidating a scope bumps its generation, which is part of the key, so a snapshot built
+    from rows read before a write can never be stored under the key readers use after it.
+    """
+
+    def __init__(self, ttl=CLAUSE_STATE_TTL, max_entries=1024):
+        self._snapshots = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._generations = {}
+        self._epoch = 0  # bumped to invalidate every scope at once
+        self._lock = threading.Lock()
+
+    def _key(self, scope, view):
+        with self._lock:
+            return scope, self._epoch, self._generations.get(scope, 0), view
+
+    def get(self, scope, view, build):
+        """The snapshot for view, built with build() -> (status, payload) on a miss"""
+        key = self._key(scope, view)
+        snapshot = self._snapshots.get(key)
+        if snapshot is MISSING:
+            snapshot = StateSnapshot(*build())
+            self._snapshots.put(key, snapshot)
+        return snapshot
+
+    def invalidate(self, scope=None):
+        with self._lock:
+            if scope is None:
+                self._epoch += 1
+            else:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def install_invalidation_hooks(self):
+        def stale_scopes(instance):
+            if isinstance(instance, Clause):
+                return [(instance.committee or '').lower(), STATUS_SCOPE]
+            if isinstance(instance, Amendment):
+                # The amendment under debate is found through its clause, whose committee
+                # may be spelled differently; amendment writes are rare enough to drop all
+                return [None]
+            return []
+
+        listen_for_writes('clause_state', stale_scopes, self.invalidate, bulk_models=(Clause, Amendment))
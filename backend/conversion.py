@@ -0,0 +1,154 @@
+# conversion.py
+#
+# Clause uploads become HTML off the request. Each job waits for one of CONVERSION_WORKERS
+# slots and converts inside it, python-docx and pandoc alike; at most CONVERSION_QUEUE_SIZE
+# jobs wait at once and further uploads are refused until some finish. Conversion is CPU-bound,
+# so under eventlet or gevent it runs on the hub's pool of OS threads instead of a green thread,
+# which would hold the hub until it finished.
+
+import hashlib
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pypandoc
+
+import docx_html
+
+# Upper bound on documents converting at the same time, and on jobs waiting for a slot
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', 4))
+CONVERSION_QUEUE_SIZE = int(os.environ.get('CONVERSION_QUEUE_SIZE', 100))
+# Finished jobs are forgotten oldest-first beyond this many
+MAX_TRACKED_JOBS = 1000
+FINISHED_STATUSES = ('done', 'failed')
+
+PANDOC_ARGS = ['--wrap=none', '--extract-media=media']
+
+
+def hash_file(path, chunk_size=64 * 1024):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convert_docx(path):
+    """Convert a DOCX file to HTML, returning (html, converter).
+
+    The in-process converter handles typical resolutions; documents it cannot represent
+    faithfully go to pandoc.
+    """
+    try:
+        return docx_html.convert(path), 'native'
+    except Exception:
+        # UnsupportedDocument, or anything python-docx chokes on: pandoc is the reference
+        pass
+    return pypandoc.convert_file(path, 'html', format='docx', extra_args=PANDOC_ARGS), 'pandoc'
+
+
+def run_in_os_thread(fn, *args):
+    """fn(*args), on an OS thread when eventlet or gevent has patched threading"""
+    eventlet = sys.modules.get('eventlet')
+    if eventlet is not None and eventlet.patcher.is_monkey_patched('thread'):
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+class ConversionQueue:
+    """Admission to conversion: CONVERSION_WORKERS jobs convert at once, max_queued wait"""
+
+    def __init__(self, workers=CONVERSION_WORKERS, max_queued=CONVERSION_QUEUE_SIZE):
+        self.max_queued = max_queued
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._queued = 0
+
+    def reserve(self):
+        """Take a place in the queue before starting a job; False when the queue is full"""
+        with self._lock:
+            if self._queued >= self.max_queued:
+                return False
+            self._queued += 1
+            return True
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free slot, leaving the queue, and hold it while converting"""
+        self._slots.acquire()
+        with self._lock:
+            self._queued -= 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+class ConversionCache:
+    """Converted HTML on disk, keyed by the SHA-256 of the uploaded document"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.folder, f"{digest}.html")
+
+    def get(self, digest):
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, digest, html_content):
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = f"{self._path(digest)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        os.replace(tmp_path, self._path(digest))
+
+
+class ConversionJobs:
+    """Status of queued and finished upload conversions, polled by /upload/jobs/<job_id>.
+
+    Jobs live in the memory of the worker that accepted the upload; with several workers, poll
+    through the same sticky session or wait for the clause_converted event, which every worker
+    relays through the message queue.
+    """
+
+    def __init__(self, max_jobs=MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, **info):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = dict(info, job_id=job_id, status='queued')
+            # Queued and converting jobs stay tracked however many there are
+            excess = len(self._jobs) - self.max_jobs
+            if excess > 0:
+                finished = [key for key, job in self._jobs.items() if job['status'] in FINISHED_STATUSES]
+                for key in finished[:excess]:
+                    del self._jobs[key]
+        return job_id
+
+    def update(self, job_id, **changes):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(changes)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
@@ -0,0 +1,82 @@
+# database.py
+#
+# Storage configuration. DATABASE_URL selects the backend: SQLite by default, or a
+# postgresql:// URI (requires pip install psycopg2-binary). Both get a sized connection pool;
+# SQLite connections are additionally switched to WAL so readers never wait for a commit and
+# concurrent chat senders queue on a busy timeout instead of failing with "database is locked".
+
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+DEFAULT_DATABASE_URL = 'sqlite:///amendments.db'
+
+# Connections kept open per process, and how many more may be opened under a burst
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+# Seconds to wait for a free connection, and to keep one before reconnecting
+POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000)),
+}
+
+
+def database_url(url=None):
+    url = url or os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URL
+    # Hosting providers often hand out postgres://, which SQLAlchemy no longer accepts
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite':
+        if parsed.database in (None, '', ':memory:'):
+            # In-memory databases live in a single connection; there is nothing to pool
+            return {}
+        return {
+            'pool_size': POOL_SIZE,
+            'max_overflow': MAX_OVERFLOW,
+            'pool_timeout': POOL_TIMEOUT,
+            # The driver's own lock wait, in seconds; busy_timeout below covers later statements
+            'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000},
+        }
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def init_database(app, url=None, sqlite_pragmas=None):
+    """Configure the app's database from DATABASE_URL (or url) and bind db to it"""
+    url = database_url(url)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            pragmas = dict(SQLITE_PRAGMAS, **(sqlite_pragmas or {}))
+
+            @event.listens_for(db.engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                if not isinstance(dbapi_connection, sqlite3.Connection):
+                    return
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"PRAGMA journal_mode={pragmas['journal_mode']}")
+                cursor.execute(f"PRAGMA synchronous={pragmas['synchronous']}")
+                cursor.execute(f"PRAGMA busy_timeout={int(pragmas['busy_timeout'])}")
+                cursor.close()
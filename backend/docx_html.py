@@ -0,0 +1,324 @@
+# docx_html.py
+#
+# In-process DOCX to HTML conversion for the subset of Word that resolutions use:
+# paragraphs, headings, numbered/lettered/bulleted lists, bold/italic/underline runs and
+# simple tables. Anything else raises UnsupportedDocument so the caller can fall back
+# to pandoc, which stays the reference converter.
+
+from html import escape
+
+from docx import Document
+from docx.oxml.ns import qn
+
+
+class UnsupportedDocument(Exception):
+    """The document uses a construct the native converter does not handle"""
+
+
+# Elements that carry no content of their own and can be skipped
+IGNORED_BODY_TAGS = {qn('w:sectPr'), qn('w:bookmarkStart'), qn('w:bookmarkEnd')}
+IGNORED_PARAGRAPH_TAGS = {qn('w:pPr'), qn('w:bookmarkStart'), qn('w:bookmarkEnd'), qn('w:proofErr'),
+                          qn('w:permStart'), qn('w:permEnd')}
+IGNORED_RUN_TAGS = {qn('w:rPr'), qn('w:lastRenderedPageBreak'), qn('w:softHyphen')}
+
+# numFmt -> (opening tag, closing tag); the opening tag gets its start attribute added later
+LIST_TAGS = {
+    'decimal': ('<ol type="1"', '</ol>'),
+    'decimalZero': ('<ol type="1"', '</ol>'),
+    'lowerLetter': ('<ol type="a"', '</ol>'),
+    'upperLetter': ('<ol type="A"', '</ol>'),
+    'lowerRoman': ('<ol type="i"', '</ol>'),
+    'upperRoman': ('<ol type="I"', '</ol>'),
+    'bullet': ('<ul', '</ul>'),
+}
+
+
+def _list_levels(document):
+    """(numId, ilvl) -> (numFmt, start) from the numbering part"""
+    try:
+        numbering = document.part.numbering_part.element
+    except (KeyError, NotImplementedError):
+        return {}
+
+    abstract_nums = {a.get(qn('w:abstractNumId')): a for a in numbering.findall(qn('w:abstractNum'))}
+    levels = {}
+    for num in numbering.findall(qn('w:num')):
+        abstract_ref = num.find(qn('w:abstractNumId'))
+        abstract_num = abstract_nums.get(abstract_ref.get(qn('w:val'))) if abstract_ref is not None else None
+        if abstract_num is None:
+            continue
+        for lvl in abstract_num.findall(qn('w:lvl')):
+            num_fmt = lvl.find(qn('w:numFmt'))
+            start = lvl.find(qn('w:start'))
+            levels[(int(num.get(qn('w:numId'))), int(lvl.get(qn('w:ilvl'))))] = (
+                num_fmt.get(qn('w:val')) if num_fmt is not None else 'decimal',
+                int(start.get(qn('w:val'))) if start is not None else 1,
+            )
+    return levels
+
+
+def _on(element):
+    """Whether a toggle property such as <w:b/> or <w:i w:val="0"/> is switched on"""
+    if element is None:
+        return None
+    return element.get(qn('w:val')) not in ('0', 'false', 'off')
+
+
+def _val(parent, tag):
+    element = parent.find(qn(tag)) if parent is not None else None
+    return element.get(qn('w:val')) if element is not None else None
+
+
+def _marks(r_pr):
+    """bold/italic/underline set in a run properties element; None where it is not set"""
+    if r_pr is None:
+        return {'bold': None, 'italic': None, 'underline': None}
+    underline = r_pr.find(qn('w:u'))
+    return {
+        'bold': _on(r_pr.find(qn('w:b'))),
+        'italic': _on(r_pr.find(qn('w:i'))),
+        'underline': underline.get(qn('w:val')) != 'none' if underline is not None else None,
+    }
+
+
+def _num_pr(p_pr):
+    num_pr = p_pr.find(qn('w:numPr')) if p_pr is not None else None
+    if num_pr is None:
+        return None
+    num_id = _val(num_pr, 'w:numId')
+    ilvl = _val(num_pr, 'w:ilvl')
+    return int(num_id) if num_id else 0, int(ilvl) if ilvl else 0
+
+
+class _Styles:
+    """Style sheet indexed once per document.
+
+    python-docx resolves styles by scanning the whole style sheet on every lookup,
+    which dominates conversion time, so the properties used here are read up front.
+    """
+
+    def __init__(self, document):
+        self.styles = {}
+        self.default_paragraph = None
+        for style in document.styles.element.findall(qn('w:style')):
+            style_id = style.get(qn('w:styleId'))
+            self.styles[style_id] = dict(
+                _marks(style.find(qn('w:rPr'))),
+                name=_val(style, 'w:name') or '',
+                based_on=_val(style, 'w:basedOn'),
+                numbering=_num_pr(style.find(qn('w:pPr'))),
+            )
+            if style.get(qn('w:type')) == 'paragraph' and style.get(qn('w:default')) in ('1', 'true', 'on'):
+                self.default_paragraph = style_id
+
+    def lookup(self, style_id, key):
+        """First value of key along the basedOn chain"""
+        seen = set()
+        while style_id in self.styles and style_id not in seen:
+            seen.add(style_id)
+            value = self.styles[style_id][key]
+            if value is not None:
+                return value
+            style_id = self.styles[style_id]['based_on']
+        return None
+
+    def name(self, style_id):
+        return self.styles.get(style_id, {}).get('name', '')
+
+
+def _paragraph_style(p, styles):
+    return _val(p.find(qn('w:pPr')), 'w:pStyle') or styles.default_paragraph
+
+
+def _numbering(p, styles):
+    """(numId, ilvl) for list paragraphs, looking through the paragraph style chain"""
+    numbering = _num_pr(p.find(qn('w:pPr'))) or styles.lookup(_paragraph_style(p, styles), 'numbering')
+    if not numbering or not numbering[0]:
+        return None
+    return numbering
+
+
+def _heading_level(p, styles):
+    name = styles.name(_paragraph_style(p, styles))
+    if name.lower().startswith('heading '):
+        level = name[len('heading '):]
+        if level.isdigit() and 1 <= int(level) <= 6:
+            return int(level)
+    return None
+
+
+def _run_marks(r, styles):
+    """(bold, italic, underline) from direct formatting, falling back to the character style"""
+    r_pr = r.find(qn('w:rPr'))
+    char_style = _val(r_pr, 'w:rStyle')
+    direct = _marks(r_pr)
+    return tuple(
+        bool(direct[key]) if direct[key] is not None else bool(styles.lookup(char_style, key))
+        for key in ('bold', 'italic', 'underline')
+    )
+
+
+def _run_text(r):
+    parts = []
+    for child in r.iterchildren():
+        if child.tag == qn('w:t'):
+            parts.append(escape(child.text or ''))
+        elif child.tag == qn('w:tab'):
+            parts.append(' ')
+        elif child.tag == qn('w:noBreakHyphen'):
+            parts.append('-')
+        elif child.tag == qn('w:br'):
+            # Page breaks have no meaning in the clause view
+            if child.get(qn('w:type')) in (None, 'textWrapping'):
+                parts.append('<br />')
+        elif child.tag not in IGNORED_RUN_TAGS:
+            raise UnsupportedDocument(f'run element {child.tag}')
+    return ''.join(parts)
+
+
+def _inline_html(p, styles):
+    """Paragraph runs as HTML, merging neighbouring runs with the same formatting"""
+    segments = []
+    for child in p.iterchildren():
+        if child.tag != qn('w:r'):
+            if child.tag not in IGNORED_PARAGRAPH_TAGS:
+                raise UnsupportedDocument(f'paragraph element {child.tag}')
+            continue
+        text = _run_text(child)
+        if not text:
+            continue
+        marks = _run_marks(child, styles)
+        if segments and segments[-1][0] == marks:
+            segments[-1][1].append(text)
+        else:
+            segments.append((marks, [text]))
+
+    html = []
+    for (bold, italic, underline), texts in segments:
+        text = ''.join(texts)
+        if underline:
+            text = f'<u>{text}</u>'
+        if italic:
+            text = f'<em>{text}</em>'
+        if bold:
+            text = f'<strong>{text}</strong>'
+        html.append(text)
+    return ''.join(html)
+
+
+def _table_html(tbl, styles):
+    rows = []
+    for tr in tbl.iterchildren():
+        if tr.tag in (qn('w:tblPr'), qn('w:tblGrid')):
+            continue
+        if tr.tag != qn('w:tr'):
+            raise UnsupportedDocument(f'table element {tr.tag}')
+        cells = []
+        for tc in tr.iterchildren():
+            if tc.tag in (qn('w:trPr'), qn('w:tblPrEx')):
+                continue
+            if tc.tag != qn('w:tc'):
+                raise UnsupportedDocument(f'row element {tc.tag}')
+            tc_pr = tc.find(qn('w:tcPr'))
+            if tc_pr is not None and (tc_pr.find(qn('w:gridSpan')) is not None or
+                                      tc_pr.find(qn('w:vMerge')) is not None):
+                raise UnsupportedDocument('merged table cells')
+            paragraphs = []
+            for child in tc.iterchildren():
+                if child.tag == qn('w:tcPr'):
+                    continue
+                if child.tag != qn('w:p'):
+                    raise UnsupportedDocument(f'cell element {child.tag}')
+                if _numbering(child, styles):
+                    raise UnsupportedDocument('list inside a table cell')
+                text = _inline_html(child, styles)
+                if text:
+                    paragraphs.append(f'<p>{text}</p>')
+            cells.append(f"<td>{''.join(paragraphs)}</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    return f"<table>\n<tbody>\n{chr(10).join(rows)}\n</tbody>\n</table>"
+
+
+class _ListWriter:
+    """Turns a run of numbered paragraphs into nested <ol>/<ul> elements.
+
+    Counters persist per numId so a list interrupted by plain paragraphs resumes at the
+    right number, as it does in Word.
+    """
+
+    def __init__(self, levels, html):
+        self.levels = levels
+        self.html = html
+        self.open = []  # (numId, ilvl, closing tag) for each open list, outermost first
+        self.counters = {}
+
+    def item(self, num_id, ilvl, content):
+        if (num_id, ilvl) not in self.levels:
+            raise UnsupportedDocument(f'numbering definition {num_id}/{ilvl}')
+        num_fmt, start = self.levels[(num_id, ilvl)]
+        if num_fmt not in LIST_TAGS:
+            raise UnsupportedDocument(f'list format {num_fmt}')
+
+        while self.open and (self.open[-1][1] > ilvl or
+                             (self.open[-1][1] == ilvl and self.open[-1][0] != num_id)):
+            self._close_one()
+
+        counts = self.counters.setdefault(num_id, {})
+        # A new item restarts the numbering of every deeper level
+        for deeper in [level for level in counts if level > ilvl]:
+            del counts[deeper]
+
+        if self.open and self.open[-1][1] == ilvl:
+            self.html[-1] += '</li>'
+        else:
+            opening, closing = LIST_TAGS[num_fmt]
+            number = start + counts.get(ilvl, 0)
+            if number != 1 and num_fmt != 'bullet':
+                opening += f' start="{number}"'
+            self.html.append(f'{opening}>')
+            self.open.append((num_id, ilvl, closing))
+
+        counts[ilvl] = counts.get(ilvl, 0) + 1
+        # Same shape as pandoc's output, so the clause stylesheet applies unchanged
+        self.html.append(f'<li><p>{content}</p>')
+
+    def _close_one(self):
+        _, _, closing = self.open.pop()
+        self.html[-1] += '</li>'
+        self.html.append(closing)
+
+    def close(self):
+        while self.open:
+            self._close_one()
+
+
+def convert(path):
+    """Convert a DOCX file to HTML, or raise UnsupportedDocument"""
+    document = Document(path)
+    styles = _Styles(document)
+    html = []
+    lists = _ListWriter(_list_levels(document), html)
+
+    for child in document.element.body.iterchildren():
+        if child.tag == qn('w:p'):
+            content = _inline_html(child, styles)
+            numbering = _numbering(child, styles)
+            if numbering:
+                lists.item(numbering[0], numbering[1], content)
+                continue
+            lists.close()
+            if not content:
+                continue
+            level = _heading_level(child, styles)
+            if level:
+                html.append(f'<h{level}>{content}</h{level}>')
+            else:
+                html.append(f'<p>{content}</p>')
+        elif child.tag == qn('w:tbl'):
+            lists.close()
+            html.append(_table_html(child, styles))
+        elif child.tag not in IGNORED_BODY_TAGS:
+            raise UnsupportedDocument(f'body element {child.tag}')
+
+    lists.close()
+    return '\n'.join(html) + '\n'
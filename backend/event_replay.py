@@ -0,0 +1,145 @@
+# event_replay.py
+#
+# Replay of recent room events for clients that briefly lost their socket. Every event
+# emitted to a chat group, committee or user room carries one more argument,
+# {room, stream, seq}: seq numbers that room's events and stream names the buffer they come
+# from. The last REPLAY_BUFFER_SIZE events of each room are kept in memory.
+#
+# The join handlers acknowledge with the room's current position. A client that rejoins
+# behind that position, or sees a gap in seq, sends `replay` with the last seq it handled and
+# gets the missed events in its ack. If they are no longer buffered, or the stream changed
+# (a restart, or a buffer evicted to make room for others), the ack asks it to reload a
+# snapshot instead (for committees, /sync; see change_log.py).
+#
+# Buffers belong to the process that emits. With several workers sharing a
+# SOCKETIO_MESSAGE_QUEUE, events from another worker reach clients with that worker's stream.
+# Clients sequence only the stream of the worker they joined through and deliver the others
+# as they come, so events other workers sent while a client was away are not replayed.
+
+import itertools
+import os
+import secrets
+import threading
+from collections import deque
+
+from flask_socketio import rooms
+
+from cache import LRUCache, MISSING
+
+REPLAY_BUFFER_SIZE = int(os.environ.get('REPLAY_BUFFER_SIZE', 200))
+REPLAY_MAX_ROOMS = int(os.environ.get('REPLAY_MAX_ROOMS', 10000))
+
+# Rooms whose events are sequenced; anything else (single sockets, /content documents) is not
+REPLAY_ROOM_PREFIXES = ('group_', 'committee_', 'user_')
+
+
+class RoomBuffer:
+    __slots__ = ('stream', 'seq', 'events', 'lock')
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.seq = 0
+        self.events = deque(maxlen=size)  # (seq, event, args)
+        self.lock = threading.Lock()
+
+
+class EventReplay:
+    def __init__(self, buffer_size=REPLAY_BUFFER_SIZE, max_rooms=REPLAY_MAX_ROOMS):
+        self.buffer_size = buffer_size
+        self._buffers = LRUCache(max_entries=max_rooms)
+        self._lock = threading.Lock()
+        # Streams are unique per process and buffer, so positions never carry over a restart
+        self._process = secrets.token_hex(4)
+        self._streams = itertools.count(1)
+
+    def _buffer(self, namespace, room, create=True):
+        with self._lock:
+            buffer = self._buffers.get((namespace, room))
+            if buffer is MISSING:
+                if not create:
+                    return None
+                buffer = RoomBuffer(f'{self._process}.{next(self._streams)}', self.buffer_size)
+                self._buffers.put((namespace, room), buffer)
+            return buffer
+
+    def position(self, namespace, room):
+        """{room, stream, seq} of the last event emitted to room"""
+        buffer = self._buffer(namespace, room)
+        with buffer.lock:
+            return {'room': room, 'stream': buffer.stream, 'seq': buffer.seq}
+
+    def since(self, namespace, room, stream, after):
+        """[(seq, event, args)] emitted to room after seq `after` of stream, or None when they
+        are not all buffered any more"""
+        buffer = self._buffer(namespace, room, create=False)
+        if buffer is None:
+            return None
+        with buffer.lock:
+            if buffer.stream != stream or after > buffer.seq:
+                return None
+            if after == buffer.seq:
+                return []
+            if not buffer.events or buffer.events[0][0] > after + 1:
+                return None  # overrun
+            return [entry for entry in buffer.events if entry[0] > after]
+
+    def emit(self, emit, event, args, namespace, room, kwargs):
+        """Number, buffer and send one event to one room"""
+        # Several arguments are sent as one tuple
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        buffer = self._buffer(namespace, room)
+        # Held while sending, so a room's events go out in seq order
+        with buffer.lock:
+            buffer.seq += 1
+            buffer.events.append((buffer.seq, event, args))
+            meta = {'room': room, 'stream': buffer.stream, 'seq': buffer.seq}
+            return emit(event, (*args, meta), namespace=namespace, to=room, **kwargs)
+
+    def _on_replay(self, namespace):
+        def on_replay(data):
+            """{room, stream, after} -> {ok, events: [[event, ...args, meta]], position}, or
+            {ok: false, snapshot: true, position} when the client has to reload instead"""
+            data = data if isinstance(data, dict) else {}
+            room = data.get('room')
+            if not isinstance(room, str) or room not in rooms(namespace=namespace):
+                return {'ok': False, 'error': 'Join the room first'}
+            try:
+                after = int(data.get('after'))
+            except (TypeError, ValueError):
+                return {'ok': False, 'error': 'after must be a seq'}
+            events = self.since(namespace, room, data.get('stream'), after)
+            position = self.position(namespace, room)
+            if events is None:
+                return {'ok': False, 'snapshot': True, 'position': position}
+            return {
+                'ok': True,
+                'events': [[event, *args, {'room': room, 'stream': position['stream'], 'seq': seq}]
+                           for seq, event, args in events],
+                'position': position,
+            }
+        return on_replay
+
+    def wrap_emit(self, emit):
+        """emit, numbering and buffering events sent to sequenced rooms (installed by app.py's
+        emit hook)"""
+        prefixes = REPLAY_ROOM_PREFIXES
+
+        def sequenced_emit(event, *args, **kwargs):
+            to, room = kwargs.pop('to', None), kwargs.pop('room', None)
+            target = to or room
+            targets = [target] if isinstance(target, str) else list(target or ())
+            if not targets or not all(isinstance(room, str) and room.startswith(prefixes) for room in targets):
+                if target is not None:
+                    kwargs['to'] = target
+                return emit(event, *args, **kwargs)
+            namespace = kwargs.pop('namespace', None) or '/'
+            # One emit per room, since each room numbers its own events
+            for room in targets:
+                self.emit(emit, event, args, namespace, room, kwargs)
+
+        return sequenced_emit
+
+    def init_app(self, socketio, namespaces):
+        for namespace in namespaces:
+            socketio.on_event('replay', self._on_replay(namespace), namespace=namespace)
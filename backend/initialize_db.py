@@ -1,150 +1,194 @@
-from models import db  # Importing the db object from your app
-from models import Delegate, Group, Chair, delegate_group, Message, File, Amendment  # Import the models
+# initialize_db.py
+#
+# Startup bootstrap and the destructive reset command.
+#
+# initialize_database() runs on every process start: it brings the schema up to date and
+# seeds an empty database from the roster file, and leaves a seeded one alone, so adding or
+# restarting workers never touches existing state. Wiping everything is an explicit command:
+#
+#   python initialize_db.py --reset [--roster path/to/roster.csv]
+
+import argparse
+import csv
+import json
+import os
 from datetime import datetime  # Import datetime to get current time for the message
 
-def initialize_database():
-    # Ensure all tables are created
-    db.create_all()
-
-    # Clear existing data if any (optional, for testing purposes)
-    db.session.query(delegate_group).delete()
-    db.session.query(Delegate).delete()
-    db.session.query(Group).delete()
-    db.session.query(Chair).delete()  # Also clear Chair data if it exists
-    db.session.query(Message).delete()
-    db.session.query(File).delete()
-    db.session.query(Amendment).delete()
-    # Commit the deletions
-    db.session.commit()
-
-    # Step 1: Create the "gossip" group first
-    gossip_group = Group(name='gossip')
-
-    # Step 2: Create other groups
-    junior_group = Group(name='junior')
-    senior_group = Group(name='senior')
-    security_council_group = Group(name='security council')
-
-    # Step 3: Add the groups to the session
-    db.session.add_all([gossip_group, junior_group, senior_group, security_council_group])
-    db.session.commit()
-
-    # Step 4: Create a single Chair instance for all committees
-    chair = Chair(username='admin_chair', password='password123')
-
-    # Add Chair instance to the session
-    db.session.add(chair)
-    db.session.commit()
-
-    # Step 5: Create Chair delegates for each committee
-    committees = ['junior', 'senior', 'security council']  # Removed 'gossip'
-    chair_delegates = []
-    
-    for committee in committees:
-        chair_delegate = Delegate(name=f'{committee.title()} Chair', country='Chair', committee=committee)
-        chair_delegates.append(chair_delegate)
-
-    # Add Chair delegates to the session
-    db.session.add_all(chair_delegates)
-    db.session.commit()
-
-    # Step 6: Create regular delegates for each committee
-    junior_delegates = [
-        Delegate(name='Alice Junior', country='USA', committee='junior'),
-        Delegate(name='Bob Junior', country='UK', committee='junior'),
-        Delegate(name='Charlie Junior', country='Canada', committee='junior')
-    ]
+from flask import current_app
+from sqlalchemy import text
 
-    senior_delegates = [
-        Delegate(name='David Senior', country='Germany', committee='senior'),
-        Delegate(name='Eve Senior', country='France', committee='senior'),
-        Delegate(name='Frank Senior', country='Japan', committee='senior')
+from models import db  # Importing the db object from your app
+from models import (Delegate, Group, Chair, delegate_group, Message, File, Amendment, UnreadCount, Blob,  # Import the models
+                    ArchivedAmendment, LiveContent, Resolution)
+from attachments import removing_blobs
+from change_log import restart_change_log
+from migrations import upgrade_schema
+from search import rebuild_search_index
+
+# Roster used when ROSTER_FILE is not set
+DEFAULT_ROSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'roster.json')
+
+GOSSIP_GROUP = 'gossip'
+GOSSIP_WELCOME = 'You can send your gossip to this group, and it cannot be deleted.'
+
+
+def load_roster(path=None):
+    """Committees and delegates from a JSON or CSV roster.
+
+    JSON: {"committees": [{"name", "welcome"?}], "delegates": [{"name", "country", "committee"}]}
+    CSV: one delegate per row with name,country,committee columns; committees are taken
+    in order of first appearance.
+    """
+    path = path or os.environ.get('ROSTER_FILE') or DEFAULT_ROSTER
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            roster = {'delegates': list(csv.DictReader(f))}
+        else:
+            roster = json.load(f)
+
+    delegates = [
+        {key: row[key].strip() for key in ('name', 'country', 'committee')}
+        for row in roster.get('delegates', [])
     ]
+    committees = [dict(committee) for committee in roster.get('committees', [])]
+    known = {committee['name'] for committee in committees}
+    for delegate in delegates:
+        if delegate['committee'] not in known:
+            committees.append({'name': delegate['committee']})
+            known.add(delegate['committee'])
+    for committee in committees:
+        committee.setdefault(
+            'welcome',
+            f"Welcome to the {committee['name'].title()} group chat. "
+            f"Here you can communicate with all delegates in your committee."
+        )
+    return committees, delegates
 
-    security_council_delegates = [
-        Delegate(name='Grace SC', country='Russia', committee='security council'),
-        Delegate(name='Hank SC', country='China', committee='security council'),
-        Delegate(name='Ivy SC', country='India', committee='security council')
-    ]
 
-    # Step 7: Add all regular delegates to the session
-    all_delegates = junior_delegates + senior_delegates + security_council_delegates
-    db.session.add_all(all_delegates)
-    db.session.commit()
+def _lock_for_bootstrap():
+    """Serialize schema creation and seeding with other processes starting at the same time"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        db.session.execute(text('BEGIN IMMEDIATE'))
+    elif dialect == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(4242)'))
 
-    # Step 8: Add regular delegates and Chair delegate to their respective groups
-    junior_group.delegates.extend(junior_delegates + [chair_delegates[0]])
-    senior_group.delegates.extend(senior_delegates + [chair_delegates[1]])
-    security_council_group.delegates.extend(security_council_delegates + [chair_delegates[2]])
 
-    # Step 9: Add all regular delegates to the "gossip" group (no chair)
-    gossip_group.delegates.extend(all_delegates)  # Removed chair delegate
+def seed_database(committees, delegates):
+    """Insert the groups, chairs, delegates and welcome messages in one transaction"""
+    now = datetime.now()
+    current_time = now.strftime("%H:%M")  # Current time as 'HH:MM'
+    current_date = now.strftime("%Y-%m-%d")  # Current date as 'YYYY-MM-DD'
 
-    # Commit changes to the database
-    db.session.commit()
+    # The "gossip" group is created first so it gets ID 1
+    gossip_group = Group(name=GOSSIP_GROUP)
+    committee_groups = [Group(name=committee['name']) for committee in committees]
+    db.session.add_all([gossip_group] + committee_groups)
 
-    # Step 10: Add a message to the "gossip" group saying it cannot be deleted
-    try:
-        gossip_message = Message(
-            text='You can send your gossip to this group, and it cannot be deleted.',
-            sender_id=chair_delegates[0].id,  # Use the Junior Chair as the sender instead of gossip chair
-            group_id=gossip_group.id,
-            timestamp=datetime.now().strftime("%H:%M"),  # Current time as 'HH:MM'
-            date=datetime.now().strftime("%Y-%m-%d"),  # Current date as 'YYYY-MM-DD'
-        )
-        db.session.add(gossip_message)
-        db.session.commit()
-        print("Gossip group message added.")
-    except Exception as e:
-        print(f"Failed to add gossip message: {e}")
+    # A single Chair account for all committees
+    db.session.add(Chair(username='admin_chair', password='password123'))
 
-    # Add welcome messages to each committee group
+    # One chair delegate per committee, then the roster
+    chair_delegates = [
+        Delegate(name=f"{committee['name'].title()} Chair", country='Chair', committee=committee['name'])
+        for committee in committees
+    ]
+    roster_delegates = [Delegate(**delegate) for delegate in delegates]
+    db.session.add_all(chair_delegates + roster_delegates)
+    db.session.flush()
+
+    # Committee groups hold their delegates and chair; gossip holds every delegate but no chair
+    group_ids = {group.name: group.id for group in committee_groups}
+    memberships = [{'delegate_id': delegate.id, 'group_id': group_ids[delegate.committee]}
+                   for delegate in chair_delegates + roster_delegates]
+    memberships += [{'delegate_id': delegate.id, 'group_id': gossip_group.id} for delegate in roster_delegates]
+    if memberships:
+        db.session.execute(delegate_group.insert(), memberships)
+
+    # The gossip message must be the first message (ID 1): the frontend treats it specially.
+    # Gossip has no chair of its own, so the first committee's chair sends it
+    if chair_delegates:
+        db.session.add(Message(text=GOSSIP_WELCOME, sender_id=chair_delegates[0].id, group_id=gossip_group.id,
+                               timestamp=current_time, date=current_date))
+        db.session.flush()
+        db.session.add_all([
+            Message(text=committee['welcome'], sender_id=chair.id, group_id=group.id,
+                    timestamp=current_time, date=current_date)
+            for committee, chair, group in zip(committees, chair_delegates, committee_groups)
+        ])
+
+
+def initialize_database(roster_path=None):
+    """Create or upgrade the schema and seed it if it is empty. Returns whether it seeded."""
     try:
-        # Current timestamp and date for all messages
-        current_time = datetime.now().strftime("%H:%M")
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # Junior committee welcome message
-        junior_message = Message(
-            text='Welcome to the Junior Committee group chat. Here you can communicate with all delegates in your committee.',
-            sender_id=chair_delegates[0].id,  # Junior Chair
-            group_id=junior_group.id,
-            timestamp=current_time,
-            date=current_date,
-        )
-        db.session.add(junior_message)
-        
-        # Senior committee welcome message
-        senior_message = Message(
-            text='Welcome to the Senior Committee group chat. Here you can communicate with all delegates in your committee.',
-            sender_id=chair_delegates[1].id,  # Senior Chair
-            group_id=senior_group.id,
-            timestamp=current_time,
-            date=current_date,
-        )
-        db.session.add(senior_message)
-        
-        # Security Council welcome message
-        security_council_message = Message(
-            text='Welcome to the Security Council group chat. Here you can communicate with all delegates in your committee.',
-            sender_id=chair_delegates[2].id,  # Security Council Chair
-            group_id=security_council_group.id,
-            timestamp=current_time,
-            date=current_date,
-        )
-        db.session.add(security_council_message)
-        
+        _lock_for_bootstrap()
+        upgrade_schema()
+        if db.session.query(Group.id).first() is not None:
+            db.session.commit()
+            return False
+        committees, delegates = load_roster(roster_path)
+        seed_database(committees, delegates)
         db.session.commit()
-        print("Committee welcome messages added.")
-    except Exception as e:
-        print(f"Failed to add committee welcome messages: {e}")
+    except Exception:
+        db.session.rollback()
+        raise
 
-    print("Database initialized with groups, delegates, chair, and messages.")
+    print(f"Database seeded with {len(committees)} committees and {len(delegates)} delegates.")
+    return True
+
+
+def reset_database(roster_path=None):
+    """Delete every delegate, group, chair, message, file, stored attachment, amendment (archived
+    ones too), resolution and live editor document and reseed"""
+    committees, delegates = load_roster(roster_path)
+    try:
+        _lock_for_bootstrap()
+        upgrade_schema()
+        # Every attachment goes with its File rows, stored bytes and thumbnails included
+        digests = [row.sha256 for row in db.session.query(Blob.sha256)]
+        if db.engine.dialect.name == 'postgresql':
+            # Restart the id sequences too, so the gossip group and its message get ID 1 again
+            db.session.execute(text(
+                'TRUNCATE delegate_group, unread_count, file, blobs, message, amendments, archived_amendments, '
+                'resolution, live_content, delegate, "group", chair '
+                'RESTART IDENTITY'
+            ))
+            # TRUNCATE bypasses the session, so the search index doesn't hear about it
+            rebuild_search_index(db.session)
+        else:
+            db.session.query(delegate_group).delete()
+            db.session.query(UnreadCount).delete()
+            db.session.query(File).delete()
+            db.session.query(Blob).delete()
+            db.session.query(Message).delete()
+            db.session.query(Amendment).delete()
+            db.session.query(ArchivedAmendment).delete()
+            db.session.query(Resolution).delete()
+            db.session.query(LiveContent).delete()
+            db.session.query(Delegate).delete()
+            db.session.query(Group).delete()
+            db.session.query(Chair).delete()
+        # Reused ids would make old change log rows describe new rows
+        restart_change_log(db.session)
+        seed_database(committees, delegates)
+        with removing_blobs(current_app.config['CHAT_FILES'], digests):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    print(f"Database reset with {len(committees)} committees and {len(delegates)} delegates.")
 
-    # Ensure this runs successfully
-    gossip_group = Group(name='gossip')  # This should get ID=1
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create, seed or reset the database')
+    parser.add_argument('--reset', action='store_true',
+                        help='delete all delegates, groups, messages, amendments and resolutions and reseed')
+    parser.add_argument('--roster', help='roster .json or .csv (default: $ROSTER_FILE or roster.json)')
+    args = parser.parse_args()
+
     from app import app
     with app.app_context():
-        initialize_database()
+        if args.reset:
+            reset_database(args.roster)
+        elif not initialize_database(args.roster):
+            print("Database already seeded; use --reset to wipe and reseed it.")
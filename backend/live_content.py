@@ -0,0 +1,288 @@
+# live_content.py
+#
+# The live editor document behind /current and the /content socket namespace.
+#
+# Each committee's document is versioned. Edits travel as patches instead of whole documents:
+# a patch replaces `delete` characters at `pos` with `insert` (positions count UTF-16 code
+# units, like JavaScript string indexes) and turns version N-1 into version N. The last
+# LIVE_CONTENT_PATCH_TAIL patches are kept, so a client that reconnects at version V gets only
+# the patches after V; anyone else gets a snapshot. A patch made against an older version is
+# moved past the patches applied since, unless they touched the same text, in which case it
+# is rejected and the client resyncs.
+#
+# Documents live in memory and a background task writes changed ones to the database every
+# LIVE_CONTENT_FLUSH_INTERVAL seconds, coalescing bursts of edits into one write. A worker that
+# is not editing a document re-checks the database after LIVE_CONTENT_CACHE_TTL seconds, so
+# workers converge within flush interval + TTL.
+#
+# Several workers can edit the same document (POST /current lands on any of them), so a write
+# only succeeds over the version the worker last read or wrote. When another worker got there
+# first, its document is reloaded, this worker's unwritten edits are rebased onto it as one
+# splice and the result is written as a newer version; edits overlapping the other worker's are
+# dropped. Clients of the merged document get a fresh snapshot (on_merge).
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from cache import LRUCache, MISSING
+from models import db, LiveContent
+
+LIVE_CONTENT_FLUSH_INTERVAL = float(os.environ.get('LIVE_CONTENT_FLUSH_INTERVAL', 0.5))
+LIVE_CONTENT_CACHE_TTL = float(os.environ.get('LIVE_CONTENT_CACHE_TTL', 1.0))
+LIVE_CONTENT_PATCH_TAIL = int(os.environ.get('LIVE_CONTENT_PATCH_TAIL', 500))
+
+# Characters outside the BMP take two UTF-16 code units but one Python character
+_ASTRAL = re.compile('[\U00010000-\U0010FFFF]')
+
+logger = logging.getLogger(__name__)
+
+
+class PatchConflict(Exception):
+    """The patch cannot be applied to the current document; the client must resync"""
+
+
+def utf16_length(text):
+    if _ASTRAL.search(text) is None:
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def apply_splice(text, pos, delete, insert):
+    """text with `delete` UTF-16 code units at `pos` replaced by `insert`"""
+    if _ASTRAL.search(text) is None:
+        if pos < 0 or delete < 0 or pos + delete > len(text):
+            raise PatchConflict('patch outside the document')
+        return text[:pos] + insert + text[pos + delete:]
+
+    encoded = text.encode('utf-16-le')
+    if pos < 0 or delete < 0 or 2 * (pos + delete) > len(encoded):
+        raise PatchConflict('patch outside the document')
+    try:
+        return (encoded[:2 * pos] + insert.encode('utf-16-le') + encoded[2 * (pos + delete):]).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise PatchConflict('patch splits a character')
+
+
+def _common_prefix_length(a, b, limit):
+    # Binary search on slice comparisons, which run in C, instead of a per-character loop
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix_length(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def diff_splice(old, new):
+    """The single splice turning old into new: (pos, delete, insert) in UTF-16 code units"""
+    prefix = _common_prefix_length(old, new, min(len(old), len(new)))
+    suffix = _common_suffix_length(old, new, min(len(old), len(new)) - prefix)
+    insert = new[prefix:len(new) - suffix]
+    return utf16_length(old[:prefix]), utf16_length(old[prefix:len(old) - suffix]), insert
+
+
+def rebase(patch, applied):
+    """Move patch past a concurrent patch applied before it, or raise PatchConflict"""
+    pos, delete = patch['pos'], patch['delete']
+    applied_end = applied['pos'] + applied['delete']
+    both_insert_here = delete == 0 and applied['delete'] == 0 and pos == applied['pos']
+    if pos + delete <= applied['pos'] and not both_insert_here:
+        return patch
+    if pos >= applied_end:
+        shift = utf16_length(applied['insert']) - applied['delete']
+        return dict(patch, pos=pos + shift)
+    raise PatchConflict('patch overlaps a concurrent edit')
+
+
+class LiveDocument:
+    __slots__ = ('content', 'version', 'patches', 'checked_at', 'stored_content', 'stored_version')
+
+    def __init__(self, content, version):
+        self.content = content
+        self.version = version
+        self.patches = deque(maxlen=LIVE_CONTENT_PATCH_TAIL)  # each with the version it produced
+        self.checked_at = time.monotonic()
+        self.stored(content, version)
+
+    def stored(self, content, version):
+        """Record what the database holds, which the next write has to replace"""
+        self.stored_content = content
+        self.stored_version = version
+
+
+class LiveContentStore:
+    """Committee -> versioned live document, cached in memory and written behind to LiveContent"""
+
+    def __init__(self, app, flush_interval=LIVE_CONTENT_FLUSH_INTERVAL, ttl=LIVE_CONTENT_CACHE_TTL,
+                 on_merge=None):
+        self.app = app
+        self.on_merge = on_merge  # (committee, content, version) after another worker's edits were merged in
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.documents = LRUCache(max_entries=256)
+        self._dirty = set()  # committees whose document has not been written to the database yet
+        self._lock = threading.RLock()
+
+    def _document(self, committee):
+        """The in-memory document, loaded or refreshed from the database when needed"""
+        document = self.documents.get(committee)
+        now = time.monotonic()
+        if document is not MISSING and (committee in self._dirty or now - document.checked_at <= self.ttl):
+            return document
+
+        if document is MISSING:
+            row = db.session.get(LiveContent, committee)
+            document = LiveDocument(row.content, row.version or 0) if row else LiveDocument('', 0)
+            self.documents.put(committee, document)
+        else:
+            # Another worker may have written a newer version since we loaded ours
+            version = db.session.query(LiveContent.version).filter_by(committee=committee).scalar()
+            if (version or 0) > document.version:
+                row = db.session.get(LiveContent, committee, populate_existing=True)
+                document.content, document.version = row.content, row.version
+                document.stored(row.content, row.version)
+                document.patches.clear()
+            document.checked_at = now
+        return document
+
+    def snapshot(self, committee):
+        """(content, version)"""
+        with self._lock:
+            document = self._document(committee)
+            return document.content, document.version
+
+    def get(self, committee):
+        return self.snapshot(committee)[0]
+
+    def patches_since(self, committee, version):
+        """Patches taking a client from version to the current one, or None if a snapshot is needed"""
+        with self._lock:
+            document = self._document(committee)
+            missing = document.version - version
+            if missing < 0 or missing > len(document.patches):
+                return None
+            return list(document.patches)[len(document.patches) - missing:]
+
+    def apply(self, committee, base_version, pos, delete, insert):
+        """Apply a patch made against base_version; returns it as applied, with its new version"""
+        with self._lock:
+            document = self._document(committee)
+            concurrent = self.patches_since(committee, base_version)
+            if concurrent is None:
+                raise PatchConflict('unknown base version')
+
+            patch = {'pos': pos, 'delete': delete, 'insert': insert}
+            for applied in concurrent:
+                patch = rebase(patch, applied)
+            document.content = apply_splice(document.content, patch['pos'], patch['delete'], patch['insert'])
+            document.version += 1
+            patch['version'] = document.version
+            document.patches.append(patch)
+            self._dirty.add(committee)
+            return patch
+
+    def replace(self, committee, content):
+        """Replace the whole document; returns the equivalent patch, or None if nothing changed"""
+        with self._lock:
+            document = self._document(committee)
+            if content == document.content:
+                return None
+            pos, delete, insert = diff_splice(document.content, content)
+            return self.apply(committee, document.version, pos, delete, insert)
+
+    def _merge(self, committee, document, content, version):
+        """Rebase the unwritten edits of document onto another worker's (content, version)"""
+        theirs = dict(zip(('pos', 'delete', 'insert'), diff_splice(document.stored_content, content)))
+        ours = dict(zip(('pos', 'delete', 'insert'), diff_splice(document.stored_content, document.content)))
+        try:
+            ours = rebase(ours, theirs)
+            document.content = apply_splice(content, ours['pos'], ours['delete'], ours['insert'])
+        except PatchConflict:
+            logger.warning("Edits to the live content of %s overlapped another worker's and were dropped", committee)
+            document.content = content
+        # Newer than both, so no client takes the merged document for one it already has
+        document.version = max(version, document.version) + 1
+        document.stored(content, version)
+        document.patches.clear()
+
+    def _write(self, committee, document):
+        """Write document over the version last read or written, without committing; True if it
+        had to be merged"""
+        merged = False
+        while True:
+            written = db.session.execute(
+                update(LiveContent)
+                .where(LiveContent.committee == committee, LiveContent.version == document.stored_version)
+                .values(content=document.content, version=document.version, updated_at=datetime.utcnow())
+            ).rowcount
+            if written:
+                break
+            row = db.session.get(LiveContent, committee, populate_existing=True)
+            if row is None:
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(LiveContent(committee=committee, content=document.content,
+                                                   version=document.version))
+                    break
+                except IntegrityError:
+                    continue  # another worker created it first
+            self._merge(committee, document, row.content, row.version)
+            merged = True
+        return merged
+
+    def flush(self):
+        """Write changed documents to the database"""
+        merged = []
+        # Held while writing, so no edit lands between a merge and its write
+        with self._lock:
+            if not self._dirty:
+                return
+            with self.app.app_context():
+                written = []
+                try:
+                    for committee in self._dirty:
+                        document = self.documents.get(committee)
+                        if document is MISSING:
+                            continue
+                        if self._write(committee, document):
+                            merged.append((committee, document.content, document.version))
+                        written.append(document)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Writing live content failed; retrying on the next flush")
+                else:
+                    for document in written:
+                        document.stored(document.content, document.version)
+                    self._dirty.clear()
+
+        for committee, content, version in merged:
+            if self.on_merge:
+                self.on_merge(committee, content, version)
+
+    def run_flusher(self, sleep):
+        """Background loop; sleep is socketio.sleep so it cooperates with eventlet"""
+        while True:
+            sleep(self.flush_interval)
+            self.flush()
@@ -0,0 +1,171 @@
+# message_ingest.py
+#
+# Socket-native chat sends. Handlers on /chatsocket hand messages to a MessageBatcher, which
+# writes everything submitted within MESSAGE_BATCH_INTERVAL seconds (or MESSAGE_BATCH_SIZE
+# messages, whichever comes first) in one transaction, then acknowledges each sender with the
+# new ids and broadcasts the messages. A burst of sends in a busy room therefore costs one
+# commit instead of one per message.
+#
+# If a batch fails (e.g. one message names a group that does not exist on PostgreSQL), its
+# messages are retried one by one so only the bad ones are rejected.
+#
+# A send still queued when its sender stops waiting is cancelled, and the writer skips it, so
+# 'Timed out' always means nothing was stored and the client may retry. Once the writer has
+# taken a send up, the sender waits for the real result.
+
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from models import db, Message
+
+MESSAGE_BATCH_INTERVAL = float(os.environ.get('MESSAGE_BATCH_INTERVAL', 0.01))
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', 200))
+# Most messages one socket event may carry
+MAX_MESSAGES_PER_SEND = 100
+
+logger = logging.getLogger(__name__)
+
+
+class MessageError(ValueError):
+    """A submitted message is malformed"""
+
+
+def parse_message(data):
+    """Message column values from a socket payload; timestamp and date default to now (UTC)"""
+    if not isinstance(data, dict):
+        raise MessageError('Message must be an object')
+    try:
+        group_id = int(data['roomId'])
+        sender_id = int(data['senderId'])
+    except (KeyError, TypeError, ValueError):
+        raise MessageError('Missing required fields')
+    text = data.get('content')
+    if not isinstance(text, str) or not text:
+        raise MessageError('Message has no content')
+    now = datetime.utcnow()
+    return {
+        'text': text,
+        'sender_id': sender_id,
+        'group_id': group_id,
+        'timestamp': str(data.get('timestamp') or now.strftime('%H:%M'))[:5],
+        'date': str(data.get('date') or now.strftime('%Y-%m-%d'))[:10],
+    }
+
+
+class PendingSend:
+    """Messages from one socket event, waiting for their batch to be written"""
+    __slots__ = ('values', 'results', 'done', 'state', 'lock')
+
+    def __init__(self, values):
+        self.values = values
+        self.results = [None] * len(values)  # serialized message, or {'error': ...}
+        self.done = threading.Event()
+        self.state = 'queued'  # then 'writing' or 'cancelled'
+        self.lock = threading.Lock()
+
+    def claim(self):
+        """Called by the writer; False if the sender gave up and it must be skipped"""
+        with self.lock:
+            if self.state == 'cancelled':
+                return False
+            self.state = 'writing'
+            return True
+
+    def cancel(self):
+        """Called by the sender on timeout; False if the writer already took it up"""
+        with self.lock:
+            if self.state != 'queued':
+                return False
+            self.state = 'cancelled'
+            return True
+
+
+class MessageBatcher:
+    """Coalesces message inserts from concurrent socket handlers into micro-batches"""
+
+    def __init__(self, app, on_stored, interval=MESSAGE_BATCH_INTERVAL, batch_size=MESSAGE_BATCH_SIZE):
+        self.app = app
+        self.on_stored = on_stored  # called with each stored message's serialization, after commit
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+
+    def submit(self, values, timeout=10):
+        """Store a list of message values; returns one result per message, in order"""
+        pending = PendingSend(values)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            if pending.cancel():
+                return [{'error': 'Timed out'}] * len(values)
+            # Being written: its messages may already be stored, so report what happened
+            pending.done.wait()
+        return pending.results
+
+    def _next_batch(self):
+        """Block until something is submitted, then gather more until the batch is due"""
+        batch = [self._queue.get()]
+        count = len(batch[0].values)
+        deadline = time.monotonic() + self.interval
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            count += len(pending.values)
+        return batch
+
+    def _insert(self, entries):
+        """Insert (pending, index) entries in one transaction; returns their serializations"""
+        messages = [Message(files=[], **pending.values[index]) for pending, index in entries]
+        db.session.add_all(messages)
+        db.session.flush()
+        # Serialized before the commit expires them, which would reload every row
+        serialized = [message.serialize() for message in messages]
+        db.session.commit()
+        return serialized
+
+    def write(self, batch):
+        batch = [pending for pending in batch if pending.claim()]
+        if not batch:
+            return
+        entries = [(pending, index) for pending in batch for index in range(len(pending.values))]
+        with self.app.app_context():
+            try:
+                stored = list(zip(entries, self._insert(entries)))
+            except Exception:
+                db.session.rollback()
+                logger.exception("Writing a batch of %d messages failed; retrying one by one", len(entries))
+                stored = []
+                for entry in entries:
+                    try:
+                        stored.append((entry, self._insert([entry])[0]))
+                    except Exception as e:
+                        db.session.rollback()
+                        pending, index = entry
+                        pending.results[index] = {'error': str(e)}
+
+        for (pending, index), message in stored:
+            pending.results[index] = message
+        for pending in batch:
+            pending.done.set()
+        for _, message in stored:
+            self.on_stored(message)
+
+    def run(self):
+        """Background loop; start it with socketio.start_background_task"""
+        while True:
+            batch = self._next_batch()
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("Message batch writer failed")
+                for pending in batch:
+                    pending.done.set()
@@ -0,0 +1,171 @@
+# metrics.py
+#
+# Opt-in instrumentation (METRICS_ENABLED=1): per-route request latency, SQL queries and query
+# time per request, and Socket.IO emits and payload sizes per event, exposed on /metrics in
+# the Prometheus text format. Requests running more than QUERY_BUDGET queries are logged with
+# their route, so an N+1 regression shows up in the log the first time the endpoint is hit.
+#
+# Metrics are kept per process; with several workers, scrape each one.
+
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 25))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+PAYLOAD_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series = {}  # labels -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", "+Inf")])} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {series[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}')
+        return lines
+
+
+class Metrics:
+    def __init__(self, query_budget=QUERY_BUDGET):
+        self.query_budget = query_budget
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Request latency by route',
+            ('method', 'route', 'status'), LATENCY_BUCKETS)
+        self.request_queries = Histogram(
+            'http_request_queries', 'SQL queries run per request',
+            ('method', 'route'), QUERY_COUNT_BUCKETS)
+        self.request_query_seconds = Counter(
+            'http_request_query_seconds_total', 'Time spent in SQL queries by route',
+            ('method', 'route'))
+        self.over_budget = Counter(
+            'http_requests_over_query_budget_total', 'Requests that ran more than QUERY_BUDGET queries',
+            ('method', 'route'))
+        self.emits = Counter(
+            'socketio_emits_total', 'Socket.IO events emitted', ('namespace', 'event'))
+        self.emit_bytes = Histogram(
+            'socketio_emit_payload_bytes', 'JSON size of emitted Socket.IO payloads',
+            ('namespace', 'event'), PAYLOAD_BUCKETS)
+        self.all = [self.request_latency, self.request_queries, self.request_query_seconds,
+                    self.over_budget, self.emits, self.emit_bytes]
+
+    def render(self):
+        lines = []
+        for metric in self.all:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _route(self):
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None or request.endpoint == 'metrics':
+            return response
+        route, method = self._route(), request.method
+        queries = g.get('metrics_queries', 0)
+        self.request_latency.observe((method, route, str(response.status_code)), time.perf_counter() - started)
+        self.request_queries.observe((method, route), queries)
+        self.request_query_seconds.inc((method, route), g.get('metrics_query_seconds', 0.0))
+        response.headers['X-Query-Count'] = str(queries)
+        if queries > self.query_budget:
+            self.over_budget.inc((method, route))
+            logger.warning("%s %s ran %d SQL queries (budget %d)", method, route, queries, self.query_budget)
+        return response
+
+    def _instrument_queries(self, engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context() and conn.info.get('metrics_started'):
+                elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+                g.metrics_queries = g.get('metrics_queries', 0) + 1
+                g.metrics_query_seconds = g.get('metrics_query_seconds', 0.0) + elapsed
+
+    def wrap_emit(self, emit):
+        """emit, counting each event and its payload size (installed by app.py's emit hook)"""
+
+        def counting_emit(event, *args, **kwargs):
+            namespace = kwargs.get('namespace') or '/'
+            self.emits.inc((namespace, event))
+            try:
+                size = len(json.dumps(args, default=str))
+            except (TypeError, ValueError):
+                size = 0
+            self.emit_bytes.observe((namespace, event), size)
+            return emit(event, *args, **kwargs)
+
+        return counting_emit
+
+    def init_app(self, app, engine):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        self._instrument_queries(engine)
+
+        @app.route('/metrics', methods=['GET'])
+        def metrics():
+            return app.response_class(self.render(), mimetype='text/plain; version=0.0.4')
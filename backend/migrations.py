@@ -0,0 +1,128 @@
+# migrations.py
+#
+# Brings an existing database up to the current models. db.create_all() only creates
+# missing tables, so columns and indexes added to existing tables are applied here, along
+# with one-off data moves such as the old archived_amendments.json.
+# Every step checks the live schema first, so running it on an up-to-date database is a no-op.
+# All steps run in the session's transaction; the caller commits.
+#
+#   python migrations.py
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from archive import import_legacy_archive
+from models import db, Amendment, Blob, File, Message
+from search import create_search_index, rebuild_search_index
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _add_missing_columns(connection):
+    """ALTER TABLE ... ADD COLUMN for model columns the table does not have yet.
+
+    Columns are added as nullable (SQLite cannot add a NOT NULL column without a default);
+    the models keep enforcing nullable=False on new rows.
+    """
+    inspector = inspect(connection)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def _parse_message_time(date, timestamp):
+    try:
+        return datetime.strptime(f'{date} {timestamp}', '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return None
+
+
+def _backfill_message_created_at():
+    """Fill Message.created_at for rows written before the column existed"""
+    filled = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Message.id, Message.date, Message.timestamp)\
+            .filter(Message.created_at.is_(None), Message.id > last_id)\
+            .order_by(Message.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not rows:
+            break
+        now = datetime.utcnow()
+        db.session.execute(
+            Message.__table__.update()
+            .where(Message.__table__.c.id == db.bindparam('message_id'))
+            .values(created_at=db.bindparam('created_at')),
+            [{'message_id': id, 'created_at': _parse_message_time(date, timestamp) or now}
+             for id, date, timestamp in rows]
+        )
+        filled += len(rows)
+        last_id = rows[-1].id
+    return filled
+
+
+def _backfill_amendment_updated_at():
+    """Amendments written before updated_at existed last changed when they were submitted"""
+    result = db.session.execute(
+        Amendment.__table__.update()
+        .where(Amendment.__table__.c.updated_at.is_(None))
+        .values(updated_at=db.func.coalesce(Amendment.__table__.c.timestamp, datetime.utcnow())))
+    return result.rowcount
+
+
+def _backfill_blobs():
+    """Blob rows for content-addressed files stored before blobs were reference counted"""
+    missing = db.select(File.sha256, db.func.max(File.size), db.func.count(File.id),
+                        db.literal(datetime.utcnow(), Blob.created_at.type))\
+        .where(File.sha256.is_not(None), File.sha256.not_in(db.select(Blob.sha256)))\
+        .group_by(File.sha256)
+    result = db.session.execute(
+        Blob.__table__.insert().from_select(['sha256', 'size', 'ref_count', 'created_at'], missing))
+    return result.rowcount
+
+
+def _create_missing_indexes(connection):
+    created = []
+    inspector = inspect(connection)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=connection)
+                created.append(index.name)
+    return created
+
+
+def upgrade_schema():
+    """Create missing tables, columns and indexes and backfill derived columns"""
+    # On the session's connection, so it shares a transaction (and any lock) with the caller
+    connection = db.session.connection()
+    db.metadata.create_all(bind=connection)
+    added = _add_missing_columns(connection)
+    filled = _backfill_message_created_at() + _backfill_amendment_updated_at()
+    blobs = _backfill_blobs()
+    created = _create_missing_indexes(connection)
+    # A new search index starts with everything already in the database
+    searchable = rebuild_search_index(db.session) if create_search_index(connection) else 0
+    imported = import_legacy_archive()
+    if added or filled or created or blobs or searchable:
+        print(f"Schema upgraded: columns {added}, indexes {created}, {filled} rows backfilled, "
+              f"{blobs} blobs counted, {searchable} documents indexed for search.")
+    if imported:
+        print(f"Imported {imported} archived amendments from archived_amendments.json.")
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        upgrade_schema()
+        db.session.commit()
@@ -3,8 +3,10 @@
 from flask_sqlalchemy import SQLAlchemy
 
 from datetime import datetime
-import base64
+import json
+import os
 from flask_bcrypt import Bcrypt
+from thumbnails import is_previewable
 # Initialize database and Bcrypt
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -24,10 +26,57 @@ class Amendment(db.Model):
     amended_clause = db.Column(db.Text, default='')  # New field for amended clause content
     under_debate = db.Column(db.Boolean, default=False)
     debate_clause_id = db.Column(db.Integer, db.ForeignKey('clause.id'), nullable=True)
+    # Last write, for incremental refreshes of the amendment list (get_amendments ?since=)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # get_amendments: committee filter, newest first
+        db.Index('ix_amendments_committee_timestamp', 'committee', 'timestamp'),
+        # get_amendments ?since=: what changed in a committee
+        db.Index('ix_amendments_committee_updated_at', 'committee', 'updated_at'),
+        # Active amendment lookups and debate resets on publish
+        db.Index('ix_amendments_debate_clause_id_under_debate', 'debate_clause_id', 'under_debate'),
+    )
 
     def __repr__(self):
         return f'<Amendment {self.id} by {self.country}>'
 
+# Append-only record of deleted amendments (see archive.py)
+class ArchivedAmendment(db.Model):
+    __tablename__ = 'archived_amendments'
+    id = db.Column(db.Integer, primary_key=True)
+    amendment_id = db.Column(db.Integer, nullable=False)  # id the amendment had before deletion
+    amendment_text = db.Column(db.Text, nullable=False)
+    country = db.Column(db.String(100), nullable=False)
+    committee = db.Column(db.String(100), nullable=False)
+    clause_id = db.Column(db.Integer, nullable=True)  # No foreign key, the clause may be deleted later
+    is_passed = db.Column(db.Boolean, default=False)
+    is_rejected = db.Column(db.Boolean, default=False)
+    timestamp = db.Column(db.DateTime, nullable=True)  # When the amendment was submitted
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Archive queries filter by committee or country and a submission date range
+        db.Index('ix_archived_amendments_committee_timestamp', 'committee', 'timestamp'),
+        db.Index('ix_archived_amendments_country_timestamp', 'country', 'timestamp'),
+        db.Index('ix_archived_amendments_timestamp', 'timestamp'),
+        # Deletions reported by get_amendments ?since=
+        db.Index('ix_archived_amendments_committee_archived_at', 'committee', 'archived_at'),
+    )
+
+    def serialize(self):
+        return {
+            'id': self.amendment_id,
+            'amendment_text': self.amendment_text,
+            'country': self.country,
+            'committee': self.committee,
+            'clause_id': self.clause_id,
+            'is_passed': self.is_passed,
+            'is_rejected': self.is_rejected,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'archived_at': self.archived_at.isoformat(),
+        }
+
 # Define the Chair model
 class Chair(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,7 +98,9 @@ class Chair(db.Model):
 # Define the DelegateGroup association table
 delegate_group = db.Table('delegate_group',
     db.Column('delegate_id', db.Integer, db.ForeignKey('delegate.id'), primary_key=True),
-    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    db.Column('group_id', db.Integer, db.ForeignKey('group.id'), primary_key=True),
+    # The primary key covers delegate -> groups; members of a group need their own index
+    db.Index('ix_delegate_group_group_id', 'group_id')
 )
 
 # Define the Delegate model
@@ -62,6 +113,9 @@ class Delegate(db.Model):
     # Many-to-many relationship with Group
     groups = db.relationship('Group', secondary=delegate_group, backref=db.backref('delegates', lazy=True))
 
+    # Login looks delegates up by name and country
+    __table_args__ = (db.Index('ix_delegate_name_country', 'name', 'country'),)
+
     def serialize(self):
         return {
             'id': self.id,
@@ -78,17 +132,24 @@ class Group(db.Model):
     messages = db.relationship('Message', backref='group', lazy=True)
     index = db.Column(db.String(80), nullable=True)
     unreadCount = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def serialize(self):
+    def serialize_summary(self):
+        """The group without per-user or per-message fields (cached, see serialization.py)"""
         return {
             'id': self.id,
             'name': self.name,
             'delegates': [{"id": delegate.id, "name": delegate.name} for delegate in self.delegates],  # To see which delegates are in the group
             'index': self.index,
-            'unreadCount': self.unreadCount,
-            'lastMessage': self.messages[-1].serialize() if self.messages else None,
         }
 
+    def serialize(self):
+        return dict(
+            self.serialize_summary(),
+            unreadCount=self.unreadCount,
+            lastMessage=self.messages[-1].serialize() if self.messages else None,
+        )
+
 
 # Define the Message model
 class Message(db.Model):
@@ -100,6 +161,8 @@ class Message(db.Model):
     # These fields will now accept data from the frontend
     timestamp = db.Column(db.String(5), nullable=False)  # Expected format 'HH:MM'
     date = db.Column(db.String(10), nullable=False)      # Expected format 'YYYY-MM-DD'
+    # timestamp/date above are the sender's local time for display; this is the sortable one
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     # Define the relationship for the sender
     sender = db.relationship('Delegate', backref='messages', lazy=True)
@@ -107,6 +170,12 @@ class Message(db.Model):
     # Establish a one-to-many relationship with the File model
     files = db.relationship('File', backref='message', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Keyset pagination in get_group_messages, last message per group and count_unread
+        db.Index('ix_message_group_id_id', 'group_id', 'id'),
+        db.Index('ix_message_group_id_created_at', 'group_id', 'created_at'),
+    )
+
     def serialize(self):
         return {
             'id': self.id,
@@ -119,38 +188,56 @@ class Message(db.Model):
             'username': self.sender.name,
             'timestamp': self.timestamp,  # Already formatted
             'date': self.date,          # Already formatted
+            'created_at': self.created_at.isoformat() if self.created_at else None,
             'files': [file.serialize() for file in self.files]  # Serialize associated files
         }
 
+# A stored attachment, CHAT_FILES/<sha256>, shared by every File with the same content
+# (see attachments.py)
+class Blob(db.Model):
+    __tablename__ = 'blobs'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # File rows using this blob
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            'sha256': self.sha256,
+            'size': self.size,
+        }
+
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)  # Foreign key to Message
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False, index=True)  # Foreign key to Message
     name = db.Column(db.String(255), nullable=False)  # Original file name
     size = db.Column(db.Integer, nullable=False)      # File size in bytes
     type = db.Column(db.String(50), nullable=False)   # File MIME type (e.g., 'image/png')
     path = db.Column(db.String(255), nullable=False)  # Path to the stored file
+    # Content digest; the file is stored as CHAT_FILES/<sha256> and path is /chatfiles/<sha256>/<name>.
+    # Null for files uploaded before attachments were content-addressed (path /chatfiles/<name>)
+    sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), nullable=True, index=True)
+
+    @property
+    def stored_name(self):
+        """Name of the file inside the chat files folder"""
+        return self.sha256 or os.path.basename(self.path)
 
     def serialize(self):
-        # Check if the file type is an image
-        if self.type.startswith('image/'):
-            # Read the file and convert it to Base64
-            try:
-                with open(self.path, "rb") as image_file:
-                    encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    # Include the Base64 data in the preview
-                    preview_data = f"data:{self.type};base64,{encoded_string}"
-            except FileNotFoundError:
-                preview_data = None
+        # Images reference their thumbnail by URL; the preview is rendered once at upload
+        # time and served (with caching headers) by the /thumbnails endpoint
+        if is_previewable(self.type):
+            preview_url = f"http://localhost:8000/thumbnails/{self.stored_name}"
         else:
             # If not an image, set preview to None
-            preview_data = None
-        
+            preview_url = None
+
         return {
             'name': self.name,
             'size': self.size,
             'type': self.type,
-            'url': f"http://localhost:8000/{self.path}",   # Construct URL for file download
-            'preview': preview_data,  # Include Base64 data if it's an image, else None
+            'url': f"http://localhost:8000/{self.path.lstrip('/')}",   # Construct URL for file download
+            'preview': preview_url,  # Thumbnail URL if it's an image, else None
         }
 
 # Define the Clause model
@@ -171,6 +258,15 @@ class Clause(db.Model):
         foreign_keys='Amendment.clause_id'  # Specify which foreign key to use
     )
     is_amended = db.Column(db.Boolean, default=False)
+    # Version of the row for cached serializations (see serialization.py)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # get_clauses: committee filter, newest first
+        db.Index('ix_clause_committee_timestamp', 'committee', 'timestamp'),
+        # The published clause of a committee (display, chair and debate views)
+        db.Index('ix_clause_committee_is_published', 'committee', 'is_published', 'timestamp'),
+    )
 
     def serialize(self):
         return {
@@ -184,6 +280,16 @@ class Clause(db.Model):
             'timestamp': self.timestamp.isoformat(),
         }
 
+    def serialize_published(self):
+        """Payload of GET /committee/<committee>/published-clause"""
+        return {
+            'id': self.id,
+            'content': self.html_content,
+            'country': self.country,
+            'filename': self.filename,
+            'timestamp': self.timestamp.isoformat(),
+        }
+
 # Define the UnreadCount model to track unread messages per user and group
 class UnreadCount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -196,7 +302,8 @@ class UnreadCount(db.Model):
     user = db.relationship('Delegate', backref='unread_counts')
     group = db.relationship('Group', backref='unread_counts')
     
-    # Add unique constraint to ensure one record per user-group pair
+    # Add unique constraint to ensure one record per user-group pair; its index also serves
+    # every lookup by user_id, alone or with group_id
     __table_args__ = (db.UniqueConstraint('user_id', 'group_id'),)
     
     def serialize(self):
@@ -206,4 +313,45 @@ class UnreadCount(db.Model):
             'group_id': self.group_id,
             'count': self.count,
             'last_read_message_id': self.last_read_message_id
-        }
\ No newline at end of file
+        }
+
+# Resolutions passed in each committee, in the order they were added
+class Resolution(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    committee = db.Column(db.String(100), nullable=False)
+    clause_id = db.Column(db.Integer, db.ForeignKey('clause.id'), nullable=True)
+    data = db.Column(db.Text, nullable=False)  # JSON of what the chair's editor submitted
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_resolution_committee_id', 'committee', 'id'),)
+
+    def serialize(self):
+        return json.loads(self.data)
+
+
+# Change log behind /sync, one row per written amendment, clause, resolution, group or message
+# (see change_log.py). The id is the version clients sync from.
+class Change(db.Model):
+    __tablename__ = 'changes'
+    id = db.Column(db.Integer, primary_key=True)
+    committee = db.Column(db.String(100), nullable=True)  # Committee entities, as in search.committee_key
+    group_id = db.Column(db.Integer, nullable=True)  # Chat groups and their messages
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_changes_committee_id', 'committee', 'id'),
+        db.Index('ix_changes_group_id_id', 'group_id', 'id'),
+        db.Index('ix_changes_created_at', 'created_at'),
+    )
+
+
+# Live editor content shown on /current, one row per committee (see live_content.py)
+class LiveContent(db.Model):
+    __tablename__ = 'live_content'
+    committee = db.Column(db.String(100), primary_key=True)
+    content = db.Column(db.Text, nullable=False, default='')
+    version = db.Column(db.Integer, nullable=False, default=0)  # Number of patches applied so far
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,338 @@
+# search.py
+#
+# Full-text search over chat messages, clause text and amendments. Everything goes into one
+# index table, `search_index`: an FTS5 table on SQLite, or a table with a weighted tsvector
+# column and a GIN index on PostgreSQL. Each indexed row is one document with a title
+# (clause filename and country, amendment country), a body, and a scope word naming the
+# committee or chat group it belongs to, so a search is narrowed to its scope by the index
+# itself before anything is ranked.
+#
+# The index is written in the same transaction as the rows it mirrors. Sessions remember the
+# messages, clauses and amendments they insert, update or delete (including bulk
+# Query.update()/delete()) and re-read and re-index them just before the commit. Core inserts
+# that bypass the session (bulk seeding) need rebuild_search_index() afterwards.
+#
+# Documents are keyed by id * 4 + kind code, so one row is replaced with a rowid lookup.
+
+import html
+import logging
+import re
+
+from bs4 import BeautifulSoup
+from sqlalchemy import bindparam, event, inspect, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import Amendment, Clause, Message
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_QUERY_TERMS = 16
+REINDEX_BATCH_SIZE = 500
+
+# Highlight markers around matched words in snippets; replaced by <mark> after escaping
+_START, _STOP = '\x02', '\x03'
+
+logger = logging.getLogger(__name__)
+
+# Engines whose database has the index table (SQLite may be built without FTS5)
+_index_available = {}
+
+
+def committee_key(committee):
+    """'Security-Council' -> 'security council', the form committees are compared in"""
+    return (committee or '').strip().lower().replace('-', ' ')
+
+
+def scope_token(kind, key):
+    """One word naming what a document belongs to: 'message12' (group 12), 'clausesecuritycouncil'"""
+    return kind + ''.join(character for character in str(key).lower() if character.isalnum())
+
+
+def html_text(content):
+    return BeautifulSoup(content or '', 'html.parser').get_text(' ', strip=True)
+
+
+class SearchUnavailable(Exception):
+    """The database has no search index"""
+
+
+class Source:
+    """How rows of one model become documents"""
+
+    def __init__(self, kind, code, model, columns, build):
+        self.kind, self.code, self.model = kind, code, model
+        self.columns = columns  # read to build a document; changes to any of them re-index
+        self.build = build  # row -> (group id or committee, title, body)
+
+    def document(self, row):
+        key, title, body = self.build(row)
+        if not (title or body):
+            return None
+        return {'id': row.id * 4 + self.code, 'scope': scope_token(self.kind, key),
+                'title': title or '', 'body': body or ''}
+
+
+SOURCES = [
+    Source('message', 1, Message, ('text', 'group_id'),
+           lambda row: (row.group_id, '', row.text)),
+    Source('clause', 2, Clause, ('committee', 'country', 'filename', 'html_content'),
+           lambda row: (committee_key(row.committee), ' '.join(filter(None, [row.filename, row.country])),
+                        html_text(row.html_content))),
+    Source('amendment', 3, Amendment, ('committee', 'country', 'amendment_text'),
+           lambda row: (committee_key(row.committee), row.country, row.amendment_text)),
+]
+SOURCES_BY_KIND = {source.kind: source for source in SOURCES}
+SOURCES_BY_MODEL = {source.model: source for source in SOURCES}
+SOURCES_BY_CODE = {source.code: source for source in SOURCES}
+KINDS = tuple(SOURCES_BY_KIND)
+
+
+_QUERY_TOKEN = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+def parse_query(query):
+    """[(words, prefix)]: "quoted phrases" and bare words, all of which must match. The last
+    bare word also matches longer words, so results show up while a word is being typed."""
+    terms = []
+    for phrase, word in _QUERY_TOKEN.findall(query or ''):
+        words = [token.lower() for token in re.findall(r'\w+', phrase or word)]
+        if words:
+            terms.append((words, False))
+    if terms and not query.rstrip().endswith('"'):
+        terms[-1] = (terms[-1][0], True)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def highlight(snippet):
+    """Escape a snippet for HTML and turn the match markers into <mark> tags"""
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+class SqliteBackend:
+    def exists(self, connection):
+        return connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).first() is not None
+
+    def create(self, connection):
+        # scope is matched like a word, so FTS5 narrows to the scope while it matches the terms
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "title, body, scope, tokenize = 'unicode61 remove_diacritics 2')"))
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM search_index"))
+
+    def remove(self, connection, ids):
+        connection.execute(text("DELETE FROM search_index WHERE rowid IN :ids")
+                           .bindparams(bindparam('ids', expanding=True)), {'ids': list(ids)})
+
+    def add(self, connection, documents):
+        connection.execute(text(
+            "INSERT INTO search_index (rowid, title, body, scope) VALUES (:id, :title, :body, :scope)"), documents)
+
+    def match_expression(self, terms, scopes):
+        words = ' '.join('"' + ' '.join(words) + '"' + ('*' if prefix else '') for words, prefix in terms)
+        return '{title body} : (' + words + ') AND scope : (' + ' OR '.join(f'"{scope}"' for scope in scopes) + ')'
+
+    def search(self, connection, terms, scopes, limit, offset):
+        # bm25 is lower for better matches; title matches count four times as much as body ones
+        return connection.execute(text(
+            "SELECT rowid AS id, -bm25(search_index, 4.0, 1.0, 0.0) AS score, "
+            "snippet(search_index, 1, :start, :stop, '…', 16) AS snippet "
+            "FROM search_index WHERE search_index MATCH :match "
+            "ORDER BY bm25(search_index, 4.0, 1.0, 0.0) LIMIT :limit OFFSET :offset"
+        ), {'match': self.match_expression(terms, scopes), 'start': _START, 'stop': _STOP,
+            'limit': limit, 'offset': offset}).all()
+
+
+class PostgresBackend:
+    def exists(self, connection):
+        return inspect(connection).has_table('search_index')
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE TABLE search_index ("
+            "id BIGINT PRIMARY KEY, scope VARCHAR(120) NOT NULL, title TEXT NOT NULL, body TEXT NOT NULL, "
+            "document TSVECTOR GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')) STORED)"))
+        connection.execute(text("CREATE INDEX ix_search_index_document ON search_index USING GIN (document)"))
+        connection.execute(text("CREATE INDEX ix_search_index_scope ON search_index (scope)"))
+
+    def clear(self, connection):
+        connection.execute(text("TRUNCATE search_index"))
+
+    def remove(self, connection, ids):
+        connection.execute(text("DELETE FROM search_index WHERE id IN :ids")
+                           .bindparams(bindparam('ids', expanding=True)), {'ids': list(ids)})
+
+    def add(self, connection, documents):
+        connection.execute(text(
+            "INSERT INTO search_index (id, scope, title, body) VALUES (:id, :scope, :title, :body)"), documents)
+
+    def match_expression(self, terms):
+        # 'simple' configuration: no stemming or stop words, since names and countries matter most
+        return ' & '.join('(' + ' <-> '.join(word + (':*' if prefix and index == len(words) - 1 else '')
+                                             for index, word in enumerate(words)) + ')'
+                          for words, prefix in terms)
+
+    def search(self, connection, terms, scopes, limit, offset):
+        # Headlines are only built for the page, after ranking
+        return connection.execute(text(
+            "SELECT id, score, ts_headline('simple', body, query, :options) AS snippet FROM ("
+            "SELECT id, body, query, ts_rank_cd(document, query) AS score "
+            "FROM search_index, to_tsquery('simple', :match) AS query "
+            "WHERE document @@ query AND scope IN :scopes "
+            "ORDER BY score DESC, id DESC LIMIT :limit OFFSET :offset) AS hits "
+            "ORDER BY score DESC, id DESC"
+        ).bindparams(bindparam('scopes', expanding=True)),
+            {'match': self.match_expression(terms), 'scopes': list(scopes), 'limit': limit, 'offset': offset,
+             'options': f'StartSel="{_START}", StopSel="{_STOP}", MaxFragments=1, MaxWords=24, MinWords=8'}
+        ).all()
+
+
+def backend_for(connection):
+    return PostgresBackend() if connection.dialect.name == 'postgresql' else SqliteBackend()
+
+
+def index_available(connection):
+    available = _index_available.get(connection.engine)
+    if available is None:
+        available = _index_available[connection.engine] = backend_for(connection).exists(connection)
+    return available
+
+
+def create_search_index(connection):
+    """Create the index table if it is missing; returns whether it was created"""
+    backend = backend_for(connection)
+    if backend.exists(connection):
+        _index_available[connection.engine] = True
+        return False
+    try:
+        # In a savepoint, so a SQLite built without FTS5 leaves the caller's transaction usable
+        with connection.begin_nested():
+            backend.create(connection)
+    except OperationalError:
+        logger.exception("Could not create the search index; search is disabled")
+        _index_available[connection.engine] = False
+        return False
+    _index_available[connection.engine] = True
+    return True
+
+
+def _documents(session, source, ids=None, after_id=None, limit=None):
+    """(ids read, documents) for rows of source, by id or in id order"""
+    model = source.model
+    query = select(model.id, *(getattr(model, column) for column in source.columns)).order_by(model.id)
+    if ids is not None:
+        query = query.where(model.id.in_(ids))
+    if after_id is not None:
+        query = query.where(model.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = session.execute(query).all()
+    return [row.id for row in rows], [document for document in map(source.document, rows) if document]
+
+
+def reindex(session, source, ids):
+    """Replace the documents of these rows with their current content; rows that are gone are dropped"""
+    connection = session.connection()
+    backend = backend_for(connection)
+    ids = sorted(ids)
+    for start in range(0, len(ids), REINDEX_BATCH_SIZE):
+        batch = ids[start:start + REINDEX_BATCH_SIZE]
+        backend.remove(connection, [id * 4 + source.code for id in batch])
+        _, documents = _documents(session, source, ids=batch)
+        if documents:
+            backend.add(connection, documents)
+
+
+def rebuild_search_index(session):
+    """Re-index every message, clause and amendment; returns the number of documents"""
+    connection = session.connection()
+    if not index_available(connection):
+        return 0
+    backend = backend_for(connection)
+    backend.clear(connection)
+    indexed = 0
+    for source in SOURCES:
+        last_id = 0
+        while True:
+            ids, documents = _documents(session, source, after_id=last_id, limit=REINDEX_BATCH_SIZE)
+            if not ids:
+                break
+            if documents:
+                backend.add(connection, documents)
+            indexed += len(documents)
+            last_id = ids[-1]
+    return indexed
+
+
+def install_index_hooks():
+    """Keep the index in step with messages, clauses and amendments written through any session"""
+
+    def pending(session):
+        return session.info.setdefault('search_reindex', {})
+
+    @event.listens_for(Session, 'after_flush')
+    def collect(session, flush_context):
+        changed = pending(session)
+        for instance in list(session.new) + list(session.deleted):
+            source = SOURCES_BY_MODEL.get(type(instance))
+            if source is not None:
+                changed.setdefault(source, set()).add(instance.id)
+        for instance in session.dirty:
+            source = SOURCES_BY_MODEL.get(type(instance))
+            if source is not None:
+                state = inspect(instance)
+                if any(state.attrs[column].history.has_changes() for column in source.columns):
+                    changed.setdefault(source, set()).add(instance.id)
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def collect_bulk(state):
+        if not (state.is_update or state.is_delete) or state.bind_mapper is None:
+            return
+        source = SOURCES_BY_MODEL.get(state.bind_mapper.class_)
+        if source is None:
+            return
+        # The rows the statement is about to change, read before it runs
+        query = select(source.model.id)
+        if state.statement.whereclause is not None:
+            query = query.where(state.statement.whereclause)
+        pending(state.session).setdefault(source, set()).update(id for id, in state.session.execute(query))
+
+    @event.listens_for(Session, 'before_commit')
+    def write(session):
+        session.flush()  # commit() flushes after this hook, too late to index what it writes
+        changed = session.info.pop('search_reindex', None)
+        if not changed or not index_available(session.connection()):
+            return
+        for source, ids in changed.items():
+            reindex(session, source, ids)
+
+    @event.listens_for(Session, 'after_rollback')
+    def forget(session):
+        session.info.pop('search_reindex', None)
+
+
+def search(session, query, committee=None, group_ids=(), kinds=KINDS, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Ranked hits for query: clauses and amendments of committee and messages of group_ids.
+
+    Returns ([(kind, id, score, snippet)], has_more); the snippet is HTML with <mark>ed matches.
+    """
+    terms = parse_query(query)
+    scopes = []
+    if 'message' in kinds:
+        scopes += [scope_token('message', group_id) for group_id in group_ids]
+    if committee:
+        scopes += [scope_token(kind, committee_key(committee)) for kind in kinds if kind != 'message']
+    if not terms or not scopes:
+        return [], False
+
+    connection = session.connection()
+    if not index_available(connection):
+        raise SearchUnavailable()
+    rows = backend_for(connection).search(connection, terms, scopes, limit + 1, offset)
+    hits = [(SOURCES_BY_CODE[row.id % 4].kind, row.id // 4, float(row.score), highlight(row.snippet))
+            for row in rows[:limit]]
+    return hits, len(rows) > limit
@@ -0,0 +1,149 @@
+# serialization.py
+#
+# Cache of serialized Message, Group and Clause payloads, so hot endpoints (the group list with
+# each group's last message, the published clause) stop rebuilding the same dicts and JSON on
+# every request.
+#
+# Entries are keyed by (model, id) and carry the row's version: updated_at for groups and
+# clauses, nothing for messages, which are never edited after they are sent. A lookup with a
+# different version misses, so a row changed by another worker is re-serialized as soon as
+# this worker reads it. Writes made through this worker's session also drop their entries
+# right away (install_invalidation_hooks), including bulk Query.update()/delete() calls.
+#
+# Payloads are shared between requests: serialize() hands out shallow copies, and the JSON
+# bytes of a payload are encoded once. orjson is used for encoding when it is installed.
+
+import json
+import os
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import LRUCache, MISSING
+from models import Clause, Delegate, File, Group, Message
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+SERIALIZATION_CACHE_SIZE = int(os.environ.get('SERIALIZATION_CACHE_SIZE', 20000))
+
+CACHED_MODELS = (Message, Group, Clause)
+
+
+def dumps(value):
+    """JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def version_of(instance):
+    return getattr(instance, 'updated_at', None)
+
+
+class CachedPayload:
+    __slots__ = ('payload', '_body')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = dumps(self.payload)
+        return self._body
+
+
+class SerializationCache:
+    """(model, id) -> the row's version and its payloads, one per view"""
+
+    def __init__(self, max_entries=SERIALIZATION_CACHE_SIZE):
+        self._entries = LRUCache(max_entries=max_entries)
+
+    def lookup(self, model, id, version=None, view='serialize'):
+        """The CachedPayload for this version of the row, or None"""
+        entry = self._entries.get((model, id))
+        if entry is MISSING or entry[0] != version:
+            return None
+        return entry[1].get(view)
+
+    def store(self, model, id, version, payload, view='serialize'):
+        entry = self._entries.get((model, id))
+        if entry is MISSING or entry[0] != version:
+            entry = (version, {})
+            self._entries.put((model, id), entry)
+        cached = entry[1][view] = CachedPayload(payload)
+        return cached
+
+    def cached(self, instance, view='serialize'):
+        """CachedPayload of instance.<view>(), built on a miss"""
+        model, version = type(instance), version_of(instance)
+        cached = self.lookup(model, instance.id, version, view)
+        if cached is None:
+            cached = self.store(model, instance.id, version, getattr(instance, view)(), view)
+        return cached
+
+    def serialize(self, instance, view='serialize'):
+        """Like instance.serialize(), from the cache; the copy may be modified by the caller"""
+        return dict(self.cached(instance, view).payload)
+
+    def invalidate(self, model=None, id=None):
+        """Drop one row's payloads, or everything (bulk writes don't say which rows changed)"""
+        if model is None or id is None:
+            self._entries.invalidate()
+        else:
+            self._entries.invalidate((model, id))
+
+    def install_invalidation_hooks(self):
+        """Drop the entries of rows written through any SQLAlchemy session"""
+
+        def stale_keys(instance):
+            if isinstance(instance, CACHED_MODELS):
+                # New rows have no id yet, and nothing cached for them either
+                return [(type(instance), instance.id)] if instance.id is not None else []
+            if isinstance(instance, File) and instance.message_id is not None:
+                return [(Message, instance.message_id)]
+            if isinstance(instance, Delegate):
+                return [None]  # Group payloads list member names
+            return []
+
+        listen_for_writes('serializations', stale_keys, lambda key: self.invalidate(*(key or ())),
+                          bulk_models=CACHED_MODELS + (File, Delegate))
+
+
+def listen_for_writes(name, stale_keys, drop, bulk_models):
+    """Call drop(key) for the keys stale_keys(instance) returns for every instance a session
+    inserts, updates or deletes, both after the flush and after the commit (in case another
+    request cached the old row in between). A None key, and any bulk Query.update()/delete()
+    on one of bulk_models, means everything is stale.
+    """
+    info_key = f'stale_{name}'
+
+    @event.listens_for(Session, 'before_flush')
+    def collect(session, flush_context, instances):
+        keys = session.info.setdefault(info_key, set())
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            keys.update(stale_keys(instance))
+
+    @event.listens_for(Session, 'after_flush')
+    def drop_after_flush(session, flush_context):
+        for key in session.info.get(info_key, ()):
+            drop(key)
+
+    @event.listens_for(Session, 'after_commit')
+    def drop_after_commit(session):
+        for key in session.info.pop(info_key, ()):
+            drop(key)
+
+    @event.listens_for(Session, 'after_rollback')
+    def forget(session):
+        session.info.pop(info_key, None)
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def bulk_write(state):
+        if (state.is_update or state.is_delete) and state.bind_mapper is not None \
+                and issubclass(state.bind_mapper.class_, bulk_models):
+            drop(None)
@@ -2,8 +2,10 @@ import requests
 import json
 import os
 
-# Replace with your actual DeepSeek API key
-api_key = "sk-519079ea9b144723a1c62c2bcb98202c"
+# Read from the environment, like app.py
+api_key = os.environ.get('DEEPSEEK_API_KEY')
+if not api_key:
+    raise SystemExit('Set DEEPSEEK_API_KEY to run this script')
 
 # Test HTML content - replace with your own clause content for testing
 html_content = """
@@ -0,0 +1,46 @@
+# thumbnails.py
+
+import os
+from PIL import Image, ImageOps
+
+# Bounding box for chat image previews; the original aspect ratio is kept
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_SUFFIX = '.thumb.jpg'
+THUMBNAIL_QUALITY = 80
+
+# Image types that get a preview: formats Pillow decodes (SVG and HEIC, for example, it can't).
+# Other files are only offered as a download
+PREVIEWABLE_TYPES = frozenset({
+    'image/jpeg', 'image/jpg', 'image/pjpeg', 'image/png', 'image/gif', 'image/webp',
+    'image/bmp', 'image/x-bmp', 'image/x-ms-bmp',
+})
+
+
+def thumbnail_name(filename):
+    """Name of the preview stored next to an uploaded chat file"""
+    return f"{filename}{THUMBNAIL_SUFFIX}"
+
+
+def is_previewable(mimetype):
+    return bool(mimetype) and mimetype.lower() in PREVIEWABLE_TYPES
+
+
+def create_thumbnail(source_path):
+    """Render a small JPEG preview next to source_path.
+
+    Returns the thumbnail path, or None if the file is not an image Pillow can read.
+    """
+    thumbnail_path = thumbnail_name(source_path)
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(thumbnail_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    except (OSError, Image.DecompressionBombError):
+        # Don't leave a half-written preview behind to be served later
+        if os.path.exists(thumbnail_path):
+            os.remove(thumbnail_path)
+        return None
+    return thumbnail_path
@@ -0,0 +1,28 @@
+# wsgi.py
+#
+# Production entry point. Runs Flask-SocketIO on an async worker model instead of the
+# Werkzeug debug server:
+#
+#   gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:8000 wsgi:app
+#   python wsgi.py                      # same server without gunicorn
+#
+# Each process holds its own socket connections, so to run several workers start one
+# process per port behind a load balancer with sticky sessions and point them all at
+# the same SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0).
+
+import os
+
+ASYNC_MODE = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'eventlet')
+
+# Monkey patching has to happen before anything else imports socket or threading
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app import app, socketio
+
+if __name__ == '__main__':
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 8000)))
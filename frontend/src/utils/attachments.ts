@@ -0,0 +1,40 @@
+import axios from 'axios';
+
+export interface Attachment {
+  blob: Blob;
+  name: string;
+}
+
+async function sha256(blob: Blob): Promise<string | null> {
+  // crypto.subtle only exists in secure contexts (https or localhost)
+  if (!window.crypto?.subtle) return null;
+  const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Add attachments to a message's FormData. Files the sender already has on the server (a
+// briefing forwarded to several of their groups, say) are sent as a reference in 'blobs'
+// instead of being uploaded again; everything else goes in 'files' as before.
+export async function appendAttachments(
+  formData: FormData,
+  baseUrl: string,
+  attachments: Attachment[],
+  senderId: string | number
+) {
+  const stored: { sha256: string; name: string; type: string }[] = [];
+  for (const { blob, name } of attachments) {
+    const digest = await sha256(blob).catch(() => null);
+    if (digest) {
+      const known = await axios.get(`${baseUrl}/blobs/${digest}`, { params: { delegate_id: senderId } })
+        .then(() => true, () => false);
+      if (known) {
+        stored.push({ sha256: digest, name, type: blob.type || 'application/octet-stream' });
+        continue;
+      }
+    }
+    formData.append('files', blob, name);
+  }
+  if (stored.length) {
+    formData.append('blobs', JSON.stringify(stored));
+  }
+}
@@ -0,0 +1,26 @@
+import type { Socket } from 'socket.io-client';
+
+// Keep a socket subscribed to its committee's room. The server only sends clause,
+// amendment and resolution events to that room, and rooms are lost on reconnect,
+// so the join is repeated on every connect. Call the returned function again
+// whenever the committee being followed changes. onJoined gets the room's position, for
+// RoomReplay.joined (see roomReplay.ts).
+export function joinCommitteeRoom(
+  socket: Socket,
+  getCommittee: () => string | null | undefined,
+  onJoined?: (position: unknown) => void
+) {
+  const join = () => {
+    const committee = getCommittee();
+    if (committee && socket.connected) {
+      if (onJoined) {
+        socket.emit('join_committee', { committee }, onJoined);
+      } else {
+        socket.emit('join_committee', { committee });
+      }
+    }
+  };
+  socket.on('connect', join);
+  join();
+  return join;
+}
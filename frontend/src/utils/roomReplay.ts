@@ -0,0 +1,107 @@
+import type { Socket } from 'socket.io-client';
+
+export interface RoomPosition {
+  room: string;
+  stream: string;
+  seq: number;
+}
+
+type Handler = (...args: any[]) => void;
+
+const isPosition = (value: any): value is RoomPosition =>
+  !!value && typeof value === 'object' && typeof value.room === 'string' &&
+  typeof value.stream === 'string' && typeof value.seq === 'number';
+
+// Deliver a socket's room events in order and without gaps across reconnects. The server
+// numbers the events of each chat group, committee and user room and passes
+// {room, stream, seq} as their last argument; join acks carry the room's current position.
+// Events already handled are dropped. Missed ones are fetched with `replay` from the server's
+// buffer of recent events. When it no longer holds them, or the server restarted (a new
+// stream), resync(room) is called to reload that room's data instead.
+//
+// Only the stream of the worker the room was joined through is sequenced. With several
+// workers, events another worker emitted carry its stream and are delivered as they come.
+export class RoomReplay {
+  private positions = new Map<string, RoomPosition>();
+  private handlers = new Map<string, Handler>();
+  // Rooms with a replay in flight, and the live events that arrived meanwhile
+  private replaying = new Map<string, [string, any[]][]>();
+
+  constructor(private socket: Socket, private resync: (room: string) => void) {
+    // A replay's ack never comes once the socket is gone; the rejoin starts another
+    socket.on('disconnect', () => this.replaying.clear());
+  }
+
+  on(event: string, handler: Handler) {
+    this.handlers.set(event, handler);
+    this.socket.on(event, (...args: any[]) => this.receive(event, args));
+  }
+
+  // Pass the ack of a room join; catches up on what was emitted to the room since. Returns
+  // true on the first join of a room, when what came before it can't be replayed
+  joined(position: unknown): boolean {
+    if (!isPosition(position)) return false;
+    const known = this.positions.get(position.room);
+    if (!known) {
+      this.positions.set(position.room, position);
+      return true;
+    } else if (known.stream !== position.stream) {
+      this.positions.set(position.room, position);
+      this.resync(position.room);
+    } else if (position.seq > known.seq) {
+      this.replay(position.room);
+    }
+    return false;
+  }
+
+  private receive(event: string, args: any[]) {
+    const meta = args[args.length - 1];
+    if (!isPosition(meta)) {
+      this.handlers.get(event)?.(...args);
+      return;
+    }
+    const queued = this.replaying.get(meta.room);
+    if (queued) {
+      queued.push([event, args]);
+      return;
+    }
+    const known = this.positions.get(meta.room);
+    if (!known || known.stream !== meta.stream) {
+      // Not joined yet, or sent by another worker: nothing to sequence it against
+      this.handlers.get(event)?.(...args);
+      return;
+    }
+    if (meta.seq <= known.seq) return;
+    if (meta.seq > known.seq + 1) {
+      this.replay(meta.room);
+      this.replaying.get(meta.room)?.push([event, args]);
+      return;
+    }
+    this.positions.set(meta.room, meta);
+    this.handlers.get(event)?.(...args);
+  }
+
+  private replay(room: string) {
+    const known = this.positions.get(room);
+    if (!known || this.replaying.has(room)) return;
+    this.replaying.set(room, []);
+    this.socket.emit('replay', { room, stream: known.stream, after: known.seq }, (ack: any) => {
+      const queued = this.replaying.get(room) || [];
+      this.replaying.delete(room);
+      if (!ack?.ok) {
+        // Overrun, new stream, or the room was left: the queued events go with the reload
+        if (isPosition(ack?.position)) {
+          this.positions.set(room, ack.position);
+        }
+        this.resync(room);
+        return;
+      }
+      for (const [event, ...args] of ack.events) {
+        this.receive(event, args);
+      }
+      for (const [event, args] of queued) {
+        this.receive(event, args);
+      }
+    });
+  }
+}
@@ -0,0 +1,39 @@
+import axios from 'axios';
+
+export interface Change {
+  entity: 'amendment' | 'clause' | 'resolution' | 'group' | 'message';
+  id: number;
+  deleted: boolean;
+  data?: any;
+}
+
+export interface SyncResult {
+  version: number;
+  reset: boolean;
+  changes: Change[];
+}
+
+// Catch up on what changed since `since` with the server's /sync change log, following its
+// pages. Without a version, or when the log no longer reaches back that far, `reset` is set:
+// reload everything, then keep the returned version for the next catch-up.
+export async function fetchChanges(
+  baseUrl: string,
+  scope: { committee?: string; delegate_id?: number },
+  since: number | null
+): Promise<SyncResult> {
+  const changes: Change[] = [];
+  let version = since;
+  for (;;) {
+    const { data } = await axios.get(`${baseUrl}/sync`, {
+      params: { ...scope, ...(version !== null ? { since: version } : {}) }
+    });
+    if (data.reset) {
+      return { version: data.version, reset: true, changes: [] };
+    }
+    changes.push(...data.changes);
+    version = data.version;
+    if (!data.has_more) {
+      return { version: data.version, reset: false, changes };
+    }
+  }
+}